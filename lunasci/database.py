@@ -0,0 +1,132 @@
+"""
+This module smooths over the differences between the psycopg2 and psycopg 3 drivers,
+and reports on the connection pools of the databases.
+
+Django uses psycopg 3 when it is installed and psycopg2 otherwise. Queries run through
+Django cursors behave the same with both, but COPY, LISTEN and the connection pool are
+driver specific: connection pooling, enabled with POSTGRES_POOL, requires psycopg 3.
+
+It contains:
+    - Database: The driver module used by Django.
+    - copy_from: Streams COPY FROM STDIN input from an iterator of byte chunks.
+    - copy_to: Writes COPY TO STDOUT output into a file object.
+    - connect: Opens a connection outside of Django, e.g. to LISTEN.
+    - wait_notifications: Waits for the notifications of a listening connection.
+    - pool_stats: Returns the statistics of the connection pools.
+    - repeatable_read: Runs the queries of a block in a single snapshot.
+"""
+
+import io
+import select
+from contextlib import contextmanager
+
+from django.db import connections, transaction
+from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+if is_psycopg3:
+    import psycopg as Database
+else:
+    import psycopg2 as Database
+
+class _ChunkStream(io.RawIOBase):
+    """
+    A read-only file object over an iterator of byte chunks,
+    which lets psycopg2 pull COPY input from a generator.
+    """
+    def __init__(self, chunks):
+        super().__init__()
+        self._chunks = chunks
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+def copy_from(cursor, sql, chunks):
+    """
+    Run a COPY FROM STDIN statement with a Django cursor, sending the input
+    chunk by chunk as it is produced by an iterator of bytes.
+    """
+    if is_psycopg3:
+        with cursor.cursor.copy(sql) as copy:
+            for chunk in chunks:
+                copy.write(chunk)
+    else:
+        cursor.copy_expert(sql, _ChunkStream(iter(chunks)))
+
+def copy_to(cursor, sql, file):
+    """
+    Run a COPY TO STDOUT statement with a Django cursor, writing the output into a binary file object.
+    """
+    if is_psycopg3:
+        with cursor.cursor.copy(sql) as copy:
+            for chunk in copy:
+                file.write(chunk)
+    else:
+        cursor.copy_expert(sql, file)
+
+def connect(alias='default'):
+    """
+    Open an autocommit connection with the parameters of a database, outside of Django,
+    so it is neither pooled nor closed at the end of requests.
+    """
+    params = connections[alias].get_connection_params()
+    if is_psycopg3:
+        return Database.connect(**params, autocommit=True)
+    connection = Database.connect(**params)
+    connection.autocommit = True
+    return connection
+
+def wait_notifications(connection, timeout):
+    """
+    Wait up to timeout seconds for notifications on a connection opened with connect,
+    returning the payloads received as soon as there are any.
+    """
+    if is_psycopg3:
+        return [notify.payload for notify in connection.notifies(timeout=timeout, stop_after=1)]
+    if select.select([connection], [], [], timeout) == ([], [], []):
+        return []
+    connection.poll()
+    payloads = [notify.payload for notify in connection.notifies]
+    connection.notifies.clear()
+    return payloads
+
+def pool_stats():
+    """
+    Return the statistics of the connection pools of the databases that have one, keyed by alias.
+
+    The statistics are those of psycopg_pool, notably pool_size, pool_available, requests_waiting
+    and connections_num, the number of connections created by the pool.
+    """
+    stats = {}
+    for alias in connections:
+        pool = getattr(connections[alias], 'pool', None)
+        if pool is not None:
+            stats[alias] = pool.get_stats()
+    return stats
+
+@contextmanager
+def repeatable_read(using='default'):
+    """
+    Run the queries of the block on a database in a single snapshot, in a REPEATABLE READ transaction.
+
+    Inside a transaction already, the block runs in it, since the isolation level of a
+    transaction cannot change once it ran a query.
+    """
+    connection = connections[using]
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(using=using, savepoint=False):
+        if outermost:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        yield
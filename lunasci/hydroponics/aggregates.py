@@ -0,0 +1,97 @@
+"""
+This module implements time-bucketed aggregation of sensor readings in the database.
+
+It contains:
+    - BUCKETS: The supported bucket sizes, in seconds, keyed by their query parameter value.
+    - METRICS: The names of the aggregated sensor measurements.
+    - EpochBin: A database function flooring a timestamp to a multiple of a number of seconds.
+    - bucket_expression: Builds the expression assigning readings to buckets of a given size.
+    - aggregate_readings: Computes per-bucket statistics over a queryset of readings.
+"""
+
+from django.db.models import (
+    Avg,
+    Count,
+    DateTimeField,
+    Func,
+    Max,
+    Min,
+    StdDev,
+)
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+BUCKETS = {
+    '1m': 60,
+    '5m': 5 * 60,
+    '1h': 60 * 60,
+    '1d': 24 * 60 * 60,
+}
+
+METRICS = ('ph', 'temperature', 'tds')
+
+STATISTICS = {
+    'min': Min,
+    'max': Max,
+    'avg': Avg,
+    'stddev': StdDev,
+    'count': Count,
+}
+
+# Buckets that line up with calendar units, truncated in the current time zone
+_TRUNCATED_BUCKETS = {
+    '1m': 'minute',
+    '1h': 'hour',
+    '1d': 'day',
+}
+
+class EpochBin(Func):
+    """
+    Floors a timestamp to a multiple of the given number of seconds since the Unix epoch.
+    """
+    template = 'to_timestamp(floor(extract(epoch from %(expressions)s) / %(seconds)d) * %(seconds)d)'
+    output_field = DateTimeField()
+
+    def __init__(self, expression, seconds, **extra):
+        super().__init__(expression, seconds=seconds, **extra)
+
+def bucket_expression(bucket, field='created'):
+    """
+    Return an expression mapping the given timestamp field to the start of its bucket.
+    """
+    if bucket in _TRUNCATED_BUCKETS:
+        return Trunc(field, _TRUNCATED_BUCKETS[bucket], output_field=DateTimeField())
+    return EpochBin(field, BUCKETS[bucket])
+
+def aggregate_readings(queryset, bucket, per_system=False, limit=None):
+    """
+    Compute the count and the min, max, avg, stddev and count of every metric per bucket.
+
+    The aggregation runs in the database and returns one dict per bucket, ordered by bucket,
+    or per bucket and hydroponics system when per_system is set. At most limit buckets are returned.
+    """
+    group_by = ['bucket', 'hydroponics'] if per_system else ['bucket']
+    annotations = {'count': Count('id')}
+    for metric in METRICS:
+        for name, function in STATISTICS.items():
+            annotations[f'{metric}_{name}'] = function(metric)
+
+    rows = (
+        queryset.order_by()
+        .values(*group_by[1:], bucket=bucket_expression(bucket))
+        .annotate(**annotations)
+        .order_by(*group_by)
+    )
+    if limit is not None:
+        rows = rows[:limit]
+
+    results = []
+    for row in rows:
+        result = {'bucket': timezone.localtime(row['bucket'])}
+        if per_system:
+            result['hydroponics'] = row['hydroponics']
+        result['count'] = row['count']
+        for metric in METRICS:
+            result[metric] = {name: row[f'{metric}_{name}'] for name in STATISTICS}
+        results.append(result)
+    return results
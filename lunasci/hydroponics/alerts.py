@@ -0,0 +1,219 @@
+"""
+This module evaluates alert rules against sensor readings while they are ingested.
+
+Enabled rules are compiled into a RuleIndex keyed by hydroponics id, so a reading is only
+checked against the rules of its own system, each with a single comparison, however many
+rules the fleet has. The database is only written to when a rule changes state.
+
+The index is cached per process for HYDROPONICS_ALERT_RULES_TTL seconds, and dropped as soon
+as rules are changed through the API of the current process. States are written with
+a compare-and-set UPDATE, so concurrent ingest processes never record the same transition
+twice, and a process holding a stale state reloads it when its UPDATE matches no row.
+
+It contains:
+    - CompiledRule: An alert rule reduced to what evaluating a reading needs.
+    - RuleIndex: The enabled rules and their states, keyed by hydroponics id.
+    - get_rule_index: Returns the rule index of the current process, loading it when stale.
+    - invalidate_rule_index: Drops the rule index of the current process.
+    - evaluate_readings: Evaluates newly created readings and records the resulting events.
+"""
+
+import operator
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import partial
+from operator import attrgetter
+from typing import Callable
+
+from django.conf import settings
+from django.db import transaction
+
+from lunasci.hydroponics.models import AlertEvent, AlertRule
+
+OK = AlertRule.State.OK
+PENDING = AlertRule.State.PENDING
+FIRING = AlertRule.State.FIRING
+
+RULE_FIELDS = (
+    'id', 'hydroponics_id', 'metric', 'comparator', 'threshold',
+    'hysteresis', 'min_duration', 'state', 'breached_since',
+)
+
+@dataclass(frozen=True)
+class CompiledRule:
+    """
+    An alert rule reduced to what evaluating a reading needs.
+
+    Attributes:
+        id (int): The id of the rule.
+        hydroponics_id (int): The id of the watched system.
+        metric (str): The name of the watched reading attribute.
+        comparator (str): The comparator of the rule, copied into its events.
+        threshold (float): The threshold of the rule, copied into its events.
+        breached (callable): Tells whether a value breaches the rule.
+        cleared (callable): Tells whether a value resolves the firing rule, taking the hysteresis into account.
+        min_duration (timedelta): How long the rule must stay breached before it triggers.
+    """
+    id: int
+    hydroponics_id: int
+    metric: str
+    comparator: str
+    threshold: float
+    breached: Callable
+    cleared: Callable
+    min_duration: timedelta
+
+    @classmethod
+    def compile(cls, row):
+        """
+        Compile a rule from a dict of its RULE_FIELDS.
+
+        The comparisons are bound to the thresholds up front, e.g. breached(value)
+        is threshold < value for a gt rule.
+        """
+        threshold = row['threshold']
+        if row['comparator'] == AlertRule.Comparator.GT:
+            breached = partial(operator.lt, threshold)
+            cleared = partial(operator.ge, threshold - row['hysteresis'])
+        else:
+            breached = partial(operator.gt, threshold)
+            cleared = partial(operator.le, threshold + row['hysteresis'])
+        return cls(
+            id=row['id'],
+            hydroponics_id=row['hydroponics_id'],
+            metric=row['metric'],
+            comparator=row['comparator'],
+            threshold=threshold,
+            breached=breached,
+            cleared=cleared,
+            min_duration=row['min_duration'],
+        )
+
+class RuleIndex:
+    """
+    The enabled alert rules and their states, keyed by hydroponics id.
+
+    Attributes:
+        rules (dict): The compiled rules of every system with enabled rules.
+        states (dict): The (state, breached_since) of every rule, keyed by rule id.
+        loaded_at (float): The time.monotonic() of the load.
+    """
+
+    def __init__(self, rows=()):
+        self.rules = {}
+        self.states = {}
+        for row in rows:
+            rule = CompiledRule.compile(row)
+            self.rules.setdefault(rule.hydroponics_id, []).append(rule)
+            self.states[rule.id] = (row['state'], row['breached_since'])
+        self.rules = {hydroponics_id: tuple(rules) for hydroponics_id, rules in self.rules.items()}
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls):
+        """
+        Load the enabled rules from the database with a single query.
+        """
+        return cls(AlertRule.objects.filter(enabled=True).order_by('id').values(*RULE_FIELDS))
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_rule_index():
+    """
+    Return the rule index of the current process, reloading it once it is older
+    than HYDROPONICS_ALERT_RULES_TTL seconds.
+    """
+    global _index
+    index = _index
+    if index is None or time.monotonic() - index.loaded_at > settings.HYDROPONICS_ALERT_RULES_TTL:
+        with _index_lock:
+            index = _index = RuleIndex.load()
+    return index
+
+def invalidate_rule_index():
+    """
+    Drop the rule index of the current process, so the next evaluation reloads the rules.
+    """
+    global _index
+    _index = None
+
+def _transition(rule, state, breached_since, value, created):
+    """
+    Return the (state, breached_since, event kind or None) of a rule after a reading,
+    or None if the reading leaves the rule unchanged.
+    """
+    if state == FIRING:
+        return (OK, None, AlertEvent.Kind.RESOLVED) if rule.cleared(value) else None
+    if not rule.breached(value):
+        return (OK, None, None) if state == PENDING else None
+    if state == OK:
+        breached_since = created
+    if created - breached_since >= rule.min_duration:
+        return FIRING, breached_since, AlertEvent.Kind.TRIGGERED
+    return (PENDING, breached_since, None) if state == OK else None
+
+def _reload_state(rule_id):
+    return AlertRule.objects.filter(pk=rule_id).values_list('state', 'breached_since').first()
+
+def evaluate_readings(readings):
+    """
+    Evaluate newly created readings against the alert rules of their systems,
+    in the order they were created, and store the resulting alert events.
+
+    Meant to run in the transaction creating the readings, so the state changes
+    and the events are rolled back along with them. Returns the created events.
+    """
+    index = get_rule_index()
+    readings = [reading for reading in readings if reading.hydroponics_id in index.rules]
+    if not readings:
+        return []
+    readings.sort(key=attrgetter('created', 'id'))
+
+    # states changed by this batch, only published to the index once they are committed
+    states = {}
+    deleted = set()
+    events = []
+    for reading in readings:
+        for rule in index.rules[reading.hydroponics_id]:
+            value = getattr(reading, rule.metric)
+            if value is None or rule.id in deleted:
+                continue
+            state = states.get(rule.id) or index.states[rule.id]
+            for _ in range(2):
+                transition = _transition(rule, *state, value, reading.created)
+                if transition is None:
+                    break
+                new_state, breached_since, kind = transition
+                updated = AlertRule.objects.filter(pk=rule.id, state=state[0]).update(
+                    state=new_state, breached_since=breached_since,
+                )
+                if updated:
+                    states[rule.id] = (new_state, breached_since)
+                    if kind is not None:
+                        events.append(AlertEvent(
+                            created=reading.created,
+                            rule_id=rule.id,
+                            hydroponics_id=rule.hydroponics_id,
+                            kind=kind,
+                            metric=rule.metric,
+                            comparator=rule.comparator,
+                            threshold=rule.threshold,
+                            value=value,
+                            reading_id=reading.id,
+                        ))
+                    break
+                # another process changed the state since the index was loaded, retry with the current one
+                state = _reload_state(rule.id)
+                if state is None:
+                    deleted.add(rule.id)
+                    break
+                states[rule.id] = state
+
+    if events:
+        AlertEvent.objects.bulk_create(events)
+    if states:
+        transaction.on_commit(lambda: index.states.update(states))
+    return events
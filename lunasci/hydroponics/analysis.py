@@ -0,0 +1,248 @@
+"""
+This module analyzes windows of sensor readings with NumPy.
+
+A window is loaded with a single binary COPY of the selected readings, parsed straight into
+column arrays without creating a Python object per reading, and every statistic is computed
+with array operations, so analyzing millions of readings takes a fraction of a second.
+
+It contains:
+    - METRICS: The analyzed metrics.
+    - ReadingWindow: The readings of a window as column arrays.
+    - load_window: Loads the latest readings of a queryset into a ReadingWindow.
+    - rolling_mean_std: Computes the trailing rolling mean and standard deviation of a series.
+    - ewma: Computes the exponentially weighted moving average of a series.
+    - analyze_series: Analyzes the values of a single metric.
+    - analyze_window: Analyzes every metric of a window.
+"""
+
+import io
+import math
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.db import connection
+from django.db.models import FloatField, Value
+from django.db.models.functions import Coalesce
+from rest_framework import serializers
+
+from lunasci.database import copy_to
+
+METRICS = ('ph', 'temperature', 'tds')
+
+# Outliers listed per metric, the latest ones
+MAX_OUTLIERS = 100
+
+# Microseconds between the Unix epoch and the PostgreSQL epoch, 2000-01-01
+_PG_EPOCH_US = 946684800 * 10 ** 6
+
+_COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+# One row of the binary COPY output: the field count, then the length and value of every field
+_COPY_ROW = np.dtype(
+    [('fields', '>i2'), ('created_length', '>i4'), ('created', '>i8')]
+    + [field for metric in METRICS for field in ((f'{metric}_length', '>i4'), (metric, '>f8'))]
+)
+
+@dataclass
+class ReadingWindow:
+    """
+    The readings of a window as column arrays, ordered by creation time.
+
+    Attributes:
+        created (ndarray): The creation timestamps, as datetime64[us] in UTC.
+        seconds (ndarray): The creation timestamps, as float seconds since the Unix epoch.
+        values (dict): The float64 values of every metric, NaN where a measurement is missing.
+        truncated (bool): Whether older readings were left out of the window.
+    """
+    created: np.ndarray
+    seconds: np.ndarray
+    values: dict
+    truncated: bool = False
+
+    def __len__(self):
+        return len(self.created)
+
+def _parse_copy(data):
+    """
+    Parse the output of COPY ... TO STDOUT WITH (FORMAT binary) selecting created
+    and the metrics, none of them NULL, into an array of _COPY_ROW.
+    """
+    if data[:len(_COPY_SIGNATURE)] != _COPY_SIGNATURE:
+        raise ValueError('Unexpected binary COPY signature.')
+    offset = len(_COPY_SIGNATURE) + 4
+    extension_length = int.from_bytes(data[offset:offset + 4], 'big')
+    body = data[offset + 4 + extension_length:-2]
+    if len(body) % _COPY_ROW.itemsize:
+        raise ValueError('Unexpected binary COPY row layout.')
+    return np.frombuffer(body, dtype=_COPY_ROW)
+
+def load_window(queryset, max_rows):
+    """
+    Load the latest max_rows readings of a queryset into a ReadingWindow with a single query.
+
+    Missing measurements are sent as NaN, so every row of the binary COPY output has
+    the same size and the whole output can be viewed as one structured array.
+    """
+    nan = Value(math.nan, output_field=FloatField())
+    rows = queryset.order_by('-created', '-id').values_list(
+        'created', *(Coalesce(metric, nan) for metric in METRICS)
+    )[:max_rows]
+    sql, params = rows.query.sql_with_params()
+    buffer = io.BytesIO()
+    with connection.cursor() as cursor:
+        query = connection.ops.compose_sql(sql, params)
+        copy_to(cursor, f'COPY ({query}) TO STDOUT WITH (FORMAT binary)', buffer)
+    rows = _parse_copy(buffer.getbuffer())[::-1]
+
+    microseconds = rows['created'].astype(np.int64) + _PG_EPOCH_US
+    return ReadingWindow(
+        created=microseconds.astype('datetime64[us]'),
+        seconds=microseconds / 1e6,
+        values={metric: rows[metric].astype(np.float64) for metric in METRICS},
+        truncated=len(rows) == max_rows,
+    )
+
+def rolling_mean_std(values, window):
+    """
+    Return the mean and population standard deviation of the window values ending at every
+    position, NaN where fewer than window values precede it.
+
+    Computed from cumulative sums of the values, shifted by the first value
+    to keep the sums small.
+    """
+    count = len(values)
+    mean = np.empty(count)
+    std = np.empty(count)
+    mean[:window - 1] = std[:window - 1] = np.nan
+    if count < window:
+        return mean, std
+    shifted = values - values[0]
+    sums = np.zeros(count + 1)
+    np.cumsum(shifted, out=sums[1:])
+    window_means = (sums[window:] - sums[:-window]) / window
+    np.square(shifted, out=shifted)
+    np.cumsum(shifted, out=sums[1:])
+    variance = (sums[window:] - sums[:-window]) / window - window_means * window_means
+    np.sqrt(np.maximum(variance, 0, out=variance), out=std[window - 1:])
+    mean[window - 1:] = window_means + values[0]
+    return mean, std
+
+def ewma(values, alpha):
+    """
+    Return the exponentially weighted moving average y[t] = (1 - alpha) * y[t - 1] + alpha * x[t]
+    of a series, starting from its first value.
+
+    The recurrence is unrolled into cumulative sums over blocks short enough
+    for (1 - alpha) ** -length not to overflow, carrying the average from block to block.
+    """
+    result = np.empty(len(values))
+    if not len(values) or alpha >= 1:
+        result[:] = values
+        return result
+    # log1p keeps tiny smoothing factors apart from zero, where 1 - alpha rounds to 1
+    log_decay = math.log1p(-alpha)
+    if not log_decay:
+        result[:] = values[0]
+        return result
+    decay = 1 - alpha
+    block = min(len(values), max(1, int(600 / -log_decay)))
+    powers = decay ** np.arange(1, block + 1)
+    previous = values[0]
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        scale = powers[:len(chunk)]
+        output = result[start:start + len(chunk)]
+        np.cumsum(chunk / scale, out=output)
+        output *= alpha
+        output += previous
+        output *= scale
+        previous = output[-1]
+    return result
+
+def _number(value):
+    value = float(value)
+    return None if math.isnan(value) or math.isinf(value) else value
+
+def _timestamp(value):
+    moment = value.astype(datetime).replace(tzinfo=dt_timezone.utc)
+    return serializers.DateTimeField().to_representation(moment)
+
+def analyze_series(created, seconds, values, window, z_threshold, alpha):
+    """
+    Analyze the values of a single metric, missing values excluded.
+
+    Returns a dict with:
+        - the count, mean, stddev, min and max of the values,
+        - the rolling mean and stddev over the last window values,
+        - the latest EWMA and its drift from the mean of the first window values,
+        - the rate of change per hour over the last window values and its largest
+          absolute value between consecutive readings,
+        - the outliers, whose z-score against the preceding window exceeds z_threshold.
+    """
+    present = ~np.isnan(values)
+    if not present.all():
+        created, seconds, values = created[present], seconds[present], values[present]
+    count = len(values)
+    if not count:
+        return {'count': 0}
+
+    mean, std = rolling_mean_std(values, window)
+    averaged = ewma(values, alpha)
+
+    # score every value against the window preceding it, a value differing
+    # from a constant window scores infinity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.full(count, np.nan)
+        np.divide(values[1:] - mean[:-1], std[:-1], out=scores[1:])
+        outliers = np.flatnonzero(np.abs(scores) > z_threshold)
+
+        elapsed = np.diff(seconds)
+        rates = np.diff(values) / elapsed * 3600
+        # readings taken at the same time have no rate of change
+        rates[elapsed <= 0] = 0
+    span = min(window, count) - 1
+    rate_of_change = None
+    if span and seconds[-1] > seconds[-1 - span]:
+        rate_of_change = (values[-1] - values[-1 - span]) / (seconds[-1] - seconds[-1 - span]) * 3600
+    max_rate = int(np.argmax(np.abs(rates))) if len(rates) else None
+
+    return {
+        'count': count,
+        'mean': _number(values.mean()),
+        'stddev': _number(values.std()),
+        'min': _number(values.min()),
+        'max': _number(values.max()),
+        'rolling_mean': _number(mean[-1]),
+        'rolling_stddev': _number(std[-1]),
+        'ewma': _number(averaged[-1]),
+        'drift': _number(averaged[-1] - values[:window].mean()),
+        'rate_of_change': None if rate_of_change is None else _number(rate_of_change),
+        'max_rate_of_change': None if max_rate is None else {
+            'created': _timestamp(created[max_rate + 1]),
+            'value': _number(rates[max_rate]),
+        },
+        'outlier_count': len(outliers),
+        'outliers': [
+            {'created': _timestamp(created[index]), 'value': _number(values[index]), 'z': _number(scores[index])}
+            for index in outliers[-MAX_OUTLIERS:]
+        ],
+    }
+
+def analyze_window(readings, window, z_threshold, alpha):
+    """
+    Analyze every metric of a ReadingWindow, see analyze_series.
+    """
+    return {
+        'count': len(readings),
+        'start': _timestamp(readings.created[0]) if len(readings) else None,
+        'end': _timestamp(readings.created[-1]) if len(readings) else None,
+        'truncated': readings.truncated,
+        'window': window,
+        'z_threshold': z_threshold,
+        'alpha': alpha,
+        'metrics': {
+            metric: analyze_series(readings.created, readings.seconds, values, window, z_threshold, alpha)
+            for metric, values in readings.values.items()
+        },
+    }
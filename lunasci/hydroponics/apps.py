@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class HydroponicsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lunasci.hydroponics'
+
+    def ready(self):
+        # connects the signal receivers
+        from lunasci.hydroponics import signals  # pylint: disable=import-outside-toplevel,unused-import
@@ -0,0 +1,283 @@
+"""
+This module defines asynchronous, read-only counterparts of the hydroponics API endpoints.
+
+They are served under /async/ and meant for ASGI deployments (e.g. uvicorn lunasci.asgi:application),
+where a single worker can hold thousands of concurrent dashboard connections, since a request waiting
+on the database or the cache does not occupy a worker thread.
+
+Representations match the synchronous endpoints. Lists accept the same filters, but are always
+ordered by (created, id) and paginated with a forward-only keyset cursor.
+
+It contains:
+    - hydroponics_list, hydroponics_detail: List and retrieve hydroponics systems.
+    - hydroponics_latest: Returns the latest sensor reading of a system.
+    - hydroponics_aggregate: Aggregates the sensor readings of a system into time buckets.
+    - sensor_reading_list, sensor_reading_detail: List and retrieve sensor readings.
+    - sensor_reading_aggregate: Aggregates the filtered sensor readings into time buckets.
+    - sensor_reading_live: Streams new sensor readings as Server-Sent Events.
+"""
+
+import asyncio
+import base64
+import json
+from datetime import datetime
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Prefetch, Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from lunasci.hydroponics.cache import aget_cached_latest, aget_latest
+from lunasci.hydroponics.live import broadcaster, ensure_listener, reading_event
+from lunasci.hydroponics.models import Hydroponics, ReadingRollup, SensorReading
+from lunasci.hydroponics.serializers import (
+    HydroponicsSerializer,
+    LatestReadingSerializer,
+    SensorReadingRowSerializer,
+)
+from lunasci.hydroponics.views import (
+    HydroponicsFilter,
+    SensorReadingFilter,
+    aggregate_data,
+    readings_limit,
+)
+
+# Milliseconds Server-Sent Events clients wait before reconnecting
+SSE_RETRY = 3000
+
+def _json(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+def async_api_view(view):
+    """
+    Restrict an async view to GET and HEAD and render the API exceptions it raises
+    the way DRF does.
+    """
+    @require_safe
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+            return _json(detail, status=exc.status_code)
+    return wrapper
+
+def _page_size(request):
+    """
+    Return the page size requested with `page_size`, capped at HYDROPONICS_MAX_PAGE_SIZE,
+    falling back to the default page size like the synchronous endpoints.
+    """
+    try:
+        size = int(request.GET['page_size'])
+    except (KeyError, ValueError):
+        return api_settings.PAGE_SIZE
+    return min(size, settings.HYDROPONICS_MAX_PAGE_SIZE) if size > 0 else api_settings.PAGE_SIZE
+
+def _encode_cursor(created, pk):
+    return base64.urlsafe_b64encode(f'{created.isoformat()}|{pk}'.encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        created, _, pk = base64.urlsafe_b64decode(cursor.encode()).decode().partition('|')
+        return datetime.fromisoformat(created), int(pk)
+    except ValueError as exc:
+        raise NotFound('Invalid cursor') from exc
+
+async def _keyset_page(request, queryset, position):
+    """
+    Fetch the page of a queryset ordered by (created, id) following the `cursor` query parameter.
+
+    position returns the (created, id) of a row. Returns the rows and the link to the next page,
+    or None on the last page.
+    """
+    size = _page_size(request)
+    cursor = request.GET.get('cursor')
+    if cursor:
+        created, pk = _decode_cursor(cursor)
+        queryset = queryset.filter(Q(created__gt=created) | Q(created=created, id__gt=pk))
+    rows = [row async for row in queryset.order_by('created', 'id')[:size + 1]]
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    next_url = replace_query_param(request.build_absolute_uri(), 'cursor', _encode_cursor(*position(rows[-1])))
+    return rows, next_url
+
+def _hydroponics_queryset(limit):
+    """
+    Return the hydroponics queryset with the owners and the latest readings prefetched.
+
+    At least one reading is prefetched, so that latest_reading is never loaded synchronously.
+    """
+    latest_readings = SensorReading.objects.order_by('-created', '-id')[:max(limit, 1)]
+    return Hydroponics.objects.select_related('owner').prefetch_related(
+        Prefetch('readings', queryset=latest_readings, to_attr='latest_readings')
+    )
+
+async def _ensure_hydroponics(pk):
+    if not await Hydroponics.objects.filter(pk=pk).aexists():
+        raise NotFound('No Hydroponics matches the given query.')
+
+@async_api_view
+async def hydroponics_list(request):
+    """
+    List hydroponics systems with their latest readings, see HydroponicsViewSet.
+    """
+    limit = readings_limit(request.GET)
+    filterset = HydroponicsFilter(request.GET, queryset=_hydroponics_queryset(limit))
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+    systems, next_url = await _keyset_page(request, filterset.qs, lambda system: (system.created, system.pk))
+    context = {'request': request, 'readings_limit': limit}
+    results = HydroponicsSerializer(systems, many=True, context=context).data
+    return _json({'next': next_url, 'previous': None, 'results': results})
+
+@async_api_view
+async def hydroponics_detail(request, pk):
+    """
+    Retrieve a hydroponics system with its latest readings.
+    """
+    limit = readings_limit(request.GET)
+    try:
+        system = await _hydroponics_queryset(limit).aget(pk=pk)
+    except Hydroponics.DoesNotExist as exc:
+        raise NotFound('No Hydroponics matches the given query.') from exc
+    context = {'request': request, 'readings_limit': limit}
+    return _json(HydroponicsSerializer(system, context=context).data)
+
+@async_api_view
+async def hydroponics_latest(request, pk):
+    """
+    Return the latest sensor reading of a hydroponics system from the latest reading cache.
+    """
+    snapshot = await aget_cached_latest(pk)
+    if snapshot is None:
+        await _ensure_hydroponics(pk)
+        snapshot = await aget_latest(pk)
+    if not snapshot:
+        raise NotFound('This hydroponics system has no sensor readings.')
+    return _json(LatestReadingSerializer(snapshot, context={'request': request}).data)
+
+@async_api_view
+async def hydroponics_aggregate(request, pk):
+    """
+    Aggregate the sensor readings of a hydroponics system into time buckets.
+
+    The aggregation runs a handful of queries followed by merging in Python,
+    so it is delegated to a thread as a whole.
+    """
+    await _ensure_hydroponics(pk)
+    filterset = SensorReadingFilter(request.GET, queryset=SensorReading.objects.filter(hydroponics_id=pk))
+    rollups = ReadingRollup.objects.filter(hydroponics_id=pk)
+    return _json(await sync_to_async(aggregate_data)(request.GET, filterset, rollups))
+
+@async_api_view
+async def sensor_reading_list(request):
+    """
+    List sensor readings, see SensorReadingViewSet.
+    """
+    rows = SensorReading.objects.values(*SensorReadingRowSerializer.ROW_FIELDS)
+    filterset = SensorReadingFilter(request.GET, queryset=rows)
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+    # name filters look up the ids of the matching systems while the queryset is built
+    queryset = await sync_to_async(lambda: filterset.qs)()
+    rows, next_url = await _keyset_page(request, queryset, lambda row: (row['created'], row['id']))
+    results = SensorReadingRowSerializer(rows, many=True, context={'request': request}).data
+    return _json({'next': next_url, 'previous': None, 'results': results})
+
+@async_api_view
+async def sensor_reading_detail(request, pk):
+    """
+    Retrieve a sensor reading.
+    """
+    row = await SensorReading.objects.values(*SensorReadingRowSerializer.ROW_FIELDS).filter(pk=pk).afirst()
+    if row is None:
+        raise NotFound('No SensorReading matches the given query.')
+    return _json(SensorReadingRowSerializer(row, context={'request': request}).data)
+
+@async_api_view
+async def sensor_reading_aggregate(request):
+    """
+    Aggregate the filtered sensor readings into time buckets.
+    """
+    filterset = SensorReadingFilter(request.GET, queryset=SensorReading.objects.all())
+    rollups = ReadingRollup.objects.all()
+    return _json(await sync_to_async(aggregate_data)(request.GET, filterset, rollups))
+
+def _sse_event(event):
+    return f'id: {event["id"]}\nevent: reading\ndata: {json.dumps(event)}\n\n'
+
+async def _live_events(hydroponics_ids, last_event_id):
+    """
+    Generate the Server-Sent Events of a live subscription.
+
+    Readings created after last_event_id are replayed from the database first, up to
+    HYDROPONICS_MAX_PAGE_SIZE of them, so reconnecting clients do not miss readings.
+    """
+    subscription = broadcaster.subscribe(hydroponics_ids)
+    try:
+        yield f'retry: {SSE_RETRY}\n\n'
+        replayed = 0
+        if last_event_id is not None:
+            missed = (
+                SensorReading.objects.filter(hydroponics_id__in=hydroponics_ids, id__gt=last_event_id)
+                .order_by('id')[:settings.HYDROPONICS_MAX_PAGE_SIZE]
+            )
+            async for reading in missed:
+                event = reading_event(reading)
+                replayed = event['id']
+                yield _sse_event(event)
+        while True:
+            try:
+                batch = await asyncio.wait_for(subscription.get(), settings.HYDROPONICS_LIVE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if batch is None:
+                # the client fell behind, it has to reconnect with its Last-Event-ID
+                yield 'event: dropped\ndata: {}\n\n'
+                return
+            events = ''.join(_sse_event(event) for event in batch if event['id'] > replayed)
+            if events:
+                yield events
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+@async_api_view
+async def sensor_reading_live(request):
+    """
+    Stream the readings of the systems listed in `hydroponics` (comma separated ids)
+    as Server-Sent Events while they are ingested.
+
+    Every event carries the reading id, so clients reconnecting with Last-Event-ID
+    receive the readings they missed. Requires an ASGI deployment.
+    """
+    try:
+        hydroponics_ids = {int(value) for value in request.GET.get('hydroponics', '').split(',') if value.strip()}
+    except ValueError as exc:
+        raise ValidationError({'hydroponics': ['Expected a comma separated list of ids.']}) from exc
+    if not hydroponics_ids:
+        raise ValidationError({'hydroponics': ['This parameter is required.']})
+    if await Hydroponics.objects.filter(pk__in=hydroponics_ids).acount() != len(hydroponics_ids):
+        raise NotFound('No Hydroponics matches the given query.')
+    try:
+        last_event_id = int(request.headers['Last-Event-ID'])
+    except (KeyError, ValueError):
+        last_event_id = None
+
+    ensure_listener()
+    response = StreamingHttpResponse(
+        _live_events(hydroponics_ids, last_event_id),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # keep reverse proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
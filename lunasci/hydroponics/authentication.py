@@ -0,0 +1,112 @@
+"""
+This module authenticates devices, e.g. sensor gateways, with their device keys.
+
+Devices send their key in an "Authorization: Device <key>" header. Keys are looked up by their
+HMAC digest, see DeviceKey, and every process keeps the keys it verified in an LRU cache for
+HYDROPONICS_DEVICE_KEY_CACHE_TTL seconds, so ingesting the readings of a known device runs no
+authentication query: no session lookup, no password hash and no user row. Revoking a key drops
+it from the cache of the current process, other processes may accept it until their entry expires.
+
+A device is not a user: requests authenticated with a key carry an anonymous user, and the
+DeviceKey as request.auth, which only tells the hydroponics system the device may write to.
+
+It contains:
+    - get_device_key: Returns the DeviceKey of a key, from the cache of the current process if possible.
+    - invalidate_device_keys: Drops keys from the cache of the current process.
+    - DeviceKeyAuthentication: Authenticates requests carrying a device key.
+    - DeviceKeyScheme: Describes the device key authentication in the OpenAPI schema.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from drf_spectacular.extensions import OpenApiAuthenticationExtension
+from rest_framework import authentication, exceptions
+
+from lunasci.hydroponics.models import DeviceKey
+
+_keys = OrderedDict()
+_keys_lock = threading.Lock()
+
+def get_device_key(key):
+    """
+    Return the DeviceKey of a key, or None if there is no such key.
+
+    Keys are cached by digest, in least recently used order, until HYDROPONICS_DEVICE_KEY_CACHE_TTL
+    seconds after they were loaded. Unknown keys are not cached, so a key works as soon as it is created.
+    """
+    digest = DeviceKey.hash_key(key)
+    now = time.monotonic()
+    with _keys_lock:
+        entry = _keys.get(digest)
+        if entry is not None and entry[1] > now:
+            _keys.move_to_end(digest)
+            return entry[0]
+
+    device_key = DeviceKey.objects.only('id', 'hydroponics_id', 'prefix').filter(digest=digest).first()
+    with _keys_lock:
+        if device_key is None:
+            _keys.pop(digest, None)
+            return None
+        _keys[digest] = (device_key, now + settings.HYDROPONICS_DEVICE_KEY_CACHE_TTL)
+        _keys.move_to_end(digest)
+        while len(_keys) > settings.HYDROPONICS_DEVICE_KEY_CACHE_SIZE:
+            _keys.popitem(last=False)
+    return device_key
+
+def invalidate_device_keys(digests=None):
+    """
+    Drop the keys with the given digests, or all of them, from the cache of the current process.
+    """
+    with _keys_lock:
+        if digests is None:
+            _keys.clear()
+        for digest in digests or ():
+            _keys.pop(digest, None)
+
+class DeviceKeyAuthentication(authentication.BaseAuthentication):
+    """
+    Authenticates requests with an "Authorization: Device <key>" header.
+
+    Requests without such a header are left to the other authentication classes of the view.
+    Listed after them, it leaves the response to unauthenticated requests unchanged, since
+    that is decided by the first authentication class.
+    """
+    keyword = 'Device'
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid device key header. Expected "Device <key>".')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid device key.') from None
+
+        device_key = get_device_key(key)
+        if device_key is None:
+            raise exceptions.AuthenticationFailed('Invalid device key.')
+        return AnonymousUser(), device_key
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+class DeviceKeyScheme(OpenApiAuthenticationExtension):
+    """
+    Describes DeviceKeyAuthentication in the OpenAPI schema.
+    """
+    target_class = DeviceKeyAuthentication
+    name = 'deviceKey'
+
+    def get_security_definition(self, auto_schema):
+        return {
+            'type': 'apiKey',
+            'in': 'header',
+            'name': 'Authorization',
+            'description': 'A device key, prefixed with "Device ", e.g. "Device <key>".',
+        }
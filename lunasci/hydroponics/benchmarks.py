@@ -0,0 +1,424 @@
+"""
+This module contains the benchmarks of the hot paths of the hydroponics application.
+
+Micro-benchmarks create their own data and compare implementations of one operation.
+Fleet benchmarks time the API end to end, through the test client, against a synthetic fleet
+generated once for all of them, see lunasci.hydroponics.fleet. Both are run in a transaction
+that is rolled back, so they can be pointed at any database without leaving anything behind.
+The connection benchmark, serve_requests, only reads the data already in the database.
+
+It contains:
+    - BENCHMARKS: The registered micro-benchmarks, keyed by name.
+    - FLEET_BENCHMARKS: The registered fleet benchmarks, keyed by name.
+    - register: Registers a micro-benchmark function.
+    - register_fleet: Registers a fleet benchmark function.
+    - run: Runs a micro-benchmark in a rolled back transaction.
+    - run_fleet: Generates a fleet and runs fleet benchmarks against it in a rolled back transaction.
+    - serialize_readings: Compares SensorReadingSerializer with SensorReadingRowSerializer.
+    - analyze_readings: Compares the NumPy analysis with a loop over model instances.
+    - ingest_readings: Times single and bulk ingest.
+    - list_readings: Times filtered and deep pages of the sensor readings list.
+    - list_hydroponics: Times the hydroponics list with embedded readings.
+    - aggregate_readings: Times the aggregation endpoint over raw readings and rollups.
+    - serve_requests: Measures requests per second with new, persistent and pooled connections.
+"""
+
+import math
+import threading
+import time
+from base64 import b64encode
+from collections import deque
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections, transaction
+from django.db.backends.postgresql.psycopg_any import is_psycopg3
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from lunasci.database import pool_stats
+from lunasci.instrumentation import QueryCounter, registry
+from lunasci.hydroponics import rollups
+from lunasci.hydroponics.analysis import METRICS, analyze_window, load_window
+from lunasci.hydroponics.fleet import generate_fleet
+from lunasci.hydroponics.models import Hydroponics, SensorReading
+from lunasci.hydroponics.serializers import SensorReadingRowSerializer, SensorReadingSerializer
+
+BENCHMARKS = {}
+FLEET_BENCHMARKS = {}
+
+# Number of readings per request of the bulk ingest benchmark
+BULK_ROWS = 1000
+
+# Number of concurrent clients of the connection benchmark
+CONNECTION_CLIENTS = 8
+
+def register(function):
+    """
+    Register a micro-benchmark under the name of its function.
+
+    Micro-benchmarks take the number of rows and of repetitions as keyword arguments
+    and return a dict mapping the name of every measured variant to its best time in seconds.
+    """
+    BENCHMARKS[function.__name__] = function
+    return function
+
+def register_fleet(function):
+    """
+    Register a fleet benchmark under the name of its function.
+
+    Fleet benchmarks take the Fleet, an APIClient authenticated as the owner of its first
+    systems and the number of repetitions, and return a dict mapping the name of every
+    measured variant to a dict of its best time in seconds and the number of queries it ran.
+    """
+    FLEET_BENCHMARKS[function.__name__] = function
+    return function
+
+def run(name, **options):
+    """
+    Run the named benchmark in a transaction that is rolled back afterwards.
+    """
+    with transaction.atomic():
+        try:
+            return BENCHMARKS[name](**options)
+        finally:
+            transaction.set_rollback(True)
+
+def run_fleet(names, spec, repeat=3):
+    """
+    Generate a fleet of the given FleetSpec and run the named fleet benchmarks against it,
+    in a transaction that is rolled back afterwards.
+
+    Returns the Fleet, the seconds taken to generate it and the results keyed by benchmark name.
+    """
+    with transaction.atomic():
+        try:
+            start = time.perf_counter()
+            fleet = generate_fleet(spec, name='benchmark-fleet')
+            generated = time.perf_counter() - start
+            client = APIClient(SERVER_NAME=_host())
+            client.force_authenticate(fleet.users[0])
+            return fleet, generated, {name: FLEET_BENCHMARKS[name](fleet, client, repeat) for name in names}
+        finally:
+            transaction.set_rollback(True)
+
+def _host():
+    """
+    Return an allowed host, for requests to the application.
+    """
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host not in ('', '*')]
+    return hosts[0] if hosts else 'localhost'
+
+def _request(path):
+    """
+    Build a GET request for path addressed to an allowed host, for serializers building hyperlinks.
+    """
+    return Request(APIRequestFactory().get(path, SERVER_NAME=_host()))
+
+def _best_of(repeat, function):
+    """
+    Return the result of function and the shortest of repeat timed runs.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def _timed(repeat, function):
+    """
+    Return the best of repeat timed runs of function and the number of queries of the last one.
+    """
+    best = None
+    for _ in range(repeat):
+        with QueryCounter() as queries:
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'seconds': best, 'queries': queries.count}
+
+def _get(client, url, params=None):
+    """
+    Return a function requesting url with the client and checking the response is successful.
+    """
+    def request():
+        response = client.get(url, params)
+        if response.status_code != 200:
+            raise AssertionError(f'GET {url} {params} returned {response.status_code}: {response.content[:200]}')
+        return response
+    return request
+
+@register
+def serialize_readings(rows=10000, repeat=3):
+    """
+    Serialize a page of readings with the model serializer and the row serializer,
+    including the query, and check that both produce the same output.
+    """
+    owner = get_user_model().objects.create_user(username='benchmark-serialize-readings')
+    hydroponics = Hydroponics.objects.create(owner=owner, name='Benchmark')
+    SensorReading.objects.bulk_create(
+        (SensorReading(hydroponics=hydroponics, ph=6.0, temperature=21.5, tds=float(i)) for i in range(rows)),
+        batch_size=5000,
+    )
+    readings = SensorReading.objects.filter(hydroponics=hydroponics).order_by('created', 'id')
+    context = {'request': _request('/sensor_readings/')}
+
+    def model_serializer():
+        return SensorReadingSerializer(list(readings), many=True, context=context).data
+
+    def row_serializer():
+        rows = readings.values(*SensorReadingRowSerializer.ROW_FIELDS)
+        return SensorReadingRowSerializer(list(rows), many=True, context=context).data
+
+    expected, model_time = _best_of(repeat, model_serializer)
+    output, row_time = _best_of(repeat, row_serializer)
+    if [dict(item) for item in expected] != output:
+        raise AssertionError('SensorReadingRowSerializer output differs from SensorReadingSerializer.')
+    return {'SensorReadingSerializer': model_time, 'SensorReadingRowSerializer': row_time}
+
+def _analyze_instances(readings, window, z_threshold, alpha):
+    """
+    Compute the rolling statistics, outliers and EWMA of every metric
+    with a plain loop over model instances, as a baseline for the NumPy analysis.
+    """
+    results = {}
+    for metric in METRICS:
+        recent = deque(maxlen=window)
+        average = None
+        outliers = 0
+        for reading in readings:
+            value = getattr(reading, metric)
+            if value is None or math.isnan(value):
+                continue
+            if len(recent) == window:
+                mean = sum(recent) / window
+                std = math.sqrt(max(sum(item * item for item in recent) / window - mean * mean, 0))
+                if std and abs(value - mean) / std > z_threshold:
+                    outliers += 1
+            recent.append(value)
+            average = value if average is None else (1 - alpha) * average + alpha * value
+        results[metric] = {'ewma': average, 'outlier_count': outliers}
+    return results
+
+@register
+def analyze_readings(rows=10000, repeat=3):
+    """
+    Analyze the readings of a system taken every second, with NumPy and with a loop over
+    model instances, including the query, and check that both find the same outliers.
+    The NumPy analysis of an already loaded window is timed as well.
+    """
+    owner = get_user_model().objects.create_user(username='benchmark-analyze-readings')
+    hydroponics = Hydroponics.objects.create(owner=owner, name='Benchmark')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            INSERT INTO {SensorReading._meta.db_table} (created, hydroponics_id, ph, temperature, tds)
+            SELECT now() - make_interval(secs => %s - i), %s,
+                   6 + 0.1 * sin(i / 600.0) + 0.02 * random(),
+                   21 + i / 100000.0 + 0.1 * random(),
+                   CASE WHEN i %% 5000 = 0 THEN 2000 ELSE 800 + 10 * random() END
+            FROM generate_series(1, %s) AS i
+            ''',
+            [rows, hydroponics.pk, rows],
+        )
+    readings = SensorReading.objects.filter(hydroponics=hydroponics)
+    options = {'window': 60, 'z_threshold': 3.0, 'alpha': 0.01}
+
+    def instances():
+        return _analyze_instances(list(readings.order_by('created', 'id')), **options)
+
+    def vectorized():
+        return analyze_window(load_window(readings, rows), **options)
+
+    expected, loop_time = _best_of(repeat, instances)
+    output, numpy_time = _best_of(repeat, vectorized)
+    window = load_window(readings, rows)
+    _, analysis_time = _best_of(repeat, lambda: analyze_window(window, **options))
+    for metric, result in expected.items():
+        if output['metrics'][metric]['outlier_count'] != result['outlier_count'] or not math.isclose(
+            output['metrics'][metric]['ewma'], result['ewma'], rel_tol=1e-9,
+        ):
+            raise AssertionError(f'The NumPy analysis of {metric} differs from the loop.')
+    return {'model instances': loop_time, 'numpy': numpy_time, 'numpy, analysis only': analysis_time}
+
+@register_fleet
+def ingest_readings(fleet, client, repeat):
+    """
+    Time the creation of a single reading, and of a batch of BULK_ROWS readings
+    spread over the systems of the authenticated owner.
+    """
+    owned = fleet.hydroponics_ids[:fleet.spec.systems_per_user]
+    single_url = reverse('sensorreading-list')
+    hydroponics_url = reverse('hydroponics-detail', kwargs={'pk': owned[0]})
+    bulk_url = reverse('sensorreading-bulk')
+    rows = [
+        {'hydroponics': owned[index % len(owned)], 'ph': 6.0, 'temperature': 21.0, 'tds': 800.0 + index}
+        for index in range(BULK_ROWS)
+    ]
+
+    def single():
+        response = client.post(single_url, {'hydroponics': hydroponics_url, 'ph': 6.0}, format='json')
+        if response.status_code != 201:
+            raise AssertionError(f'Single ingest returned {response.status_code}: {response.content[:200]}')
+
+    def bulk():
+        response = client.post(bulk_url, rows, format='json')
+        if response.status_code != 201:
+            raise AssertionError(f'Bulk ingest returned {response.status_code}: {response.content[:200]}')
+
+    return {'single reading': _timed(repeat, single), f'bulk of {BULK_ROWS}': _timed(repeat, bulk)}
+
+@register_fleet
+def list_readings(fleet, client, repeat):
+    """
+    Time pages of the sensor readings list filtered with SensorReadingFilter,
+    and a page from the middle of the table.
+    """
+    url = reverse('sensorreading-list')
+    hydroponics_id = fleet.hydroponics_ids[len(fleet.hydroponics_ids) // 2]
+    name = Hydroponics.objects.get(pk=hydroponics_id).name
+    day = str(timezone.localdate(fleet.end))
+    middle = SensorReading.objects.order_by('created', 'id').values_list('created', flat=True)[fleet.readings // 2]
+    # the cursor of CursorPagination, positioned on the creation time of the middle reading
+    cursor = b64encode(urlencode({'p': str(middle)}).encode('ascii')).decode('ascii')
+    variants = {
+        'first page': {},
+        'by system': {'hydroponics': hydroponics_id},
+        'by system, day and ph': {
+            'hydroponics': hydroponics_id, 'created_after': day, 'created_before': day, 'ph__gte': 6,
+        },
+        'by system name': {'hydroponics__name__icontains': name.rpartition(' ')[2]},
+        'by temperature range': {'temperature__gte': 23.5, 'temperature__lte': 24},
+        'deep page': {'cursor': cursor},
+        'deep page of 1000': {'cursor': cursor, 'page_size': 1000},
+    }
+    return {variant: _timed(repeat, _get(client, url, params)) for variant, params in variants.items()}
+
+@register_fleet
+def list_hydroponics(fleet, client, repeat):
+    """
+    Time pages of 100 hydroponics systems with their latest readings embedded.
+    """
+    url = reverse('hydroponics-list')
+    return {
+        f'readings_limit={limit}': _timed(repeat, _get(client, url, {'page_size': 100, 'readings_limit': limit}))
+        for limit in (0, 10, 100)
+    }
+
+@register_fleet
+def aggregate_readings(fleet, client, repeat):
+    """
+    Time aggregates over the last week, of the whole fleet hourly, of ten systems daily and
+    of one system every five minutes over its last day. They are computed from the raw readings,
+    then from the rollups, whose catch-up is timed as well.
+    """
+    url = reverse('sensorreading-aggregate')
+    last_day = timezone.localdate(fleet.end)
+    week = {'created_after': str(last_day - timedelta(days=6))}
+    systems = {'hydroponics__in': ','.join(map(str, fleet.hydroponics_ids[:10])), 'group_by': 'hydroponics'}
+    # a filter the rollups cannot serve, which forces the raw readings
+    raw = {'ph__gte': 0}
+    results = {
+        '5m, one system': _timed(repeat, _get(client, url, {
+            'bucket': '5m', 'hydroponics': fleet.hydroponics_ids[0], 'created_after': str(last_day),
+        })),
+        '1h, fleet, raw': _timed(repeat, _get(client, url, {'bucket': '1h', **week, **raw})),
+        '1d, 10 systems, raw': _timed(repeat, _get(client, url, {'bucket': '1d', **week, **systems, **raw})),
+    }
+    start = time.perf_counter()
+    with QueryCounter() as queries:
+        rollups.catch_up()
+    results['rollup catch-up'] = {'seconds': time.perf_counter() - start, 'queries': queries.count}
+    results['1h, fleet, rollups'] = _timed(repeat, _get(client, url, {'bucket': '1h', **week}))
+    results['1d, 10 systems, rollups'] = _timed(repeat, _get(client, url, {'bucket': '1d', **week, **systems}))
+    return results
+
+def _serve(handler, path, requests, clients):
+    """
+    Send requests GET requests for path to the WSGI handler from clients concurrent threads,
+    each closing its connection once done, and raise the first error of any of them.
+    """
+    errors = []
+
+    def start_response(status, headers, exc_info=None):
+        if not status.startswith('200'):
+            errors.append(AssertionError(f'GET {path} returned {status}'))
+
+    def client(count):
+        try:
+            for _ in range(count):
+                environ = RequestFactory(SERVER_NAME=_host()).get(path).environ
+                response = handler(environ, start_response)
+                # closing the response sends request_finished, which closes or releases the connection
+                response.close()
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            errors.append(exc)
+        finally:
+            connections.close_all()
+
+    threads = [
+        threading.Thread(target=client, args=(requests // clients + (index < requests % clients),))
+        for index in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+def serve_requests(requests=2000, clients=CONNECTION_CLIENTS, repeat=3):
+    """
+    Time anonymous requests for a page of sensor readings, sent through the WSGI handler
+    from concurrent client threads, opening a new connection for every request, reusing
+    persistent connections and, when psycopg 3 is installed, with a connection pool.
+
+    Requests are not run in a transaction, they read the readings committed to the database.
+    Returns a dict mapping the name of every variant to a dict of its best time in seconds,
+    its requests per second and the number of connections opened by its last run, or by
+    the pool over all the runs.
+    """
+    database = connections.settings['default']
+    original = {key: database.get(key) for key in ('CONN_MAX_AGE', 'OPTIONS')}
+    variants = {
+        'new connections': {'CONN_MAX_AGE': 0},
+        'persistent connections': {'CONN_MAX_AGE': None},
+    }
+    if is_psycopg3:
+        variants['pooled connections'] = {
+            'CONN_MAX_AGE': 0,
+            'OPTIONS': {**original['OPTIONS'], 'pool': {'min_size': clients, 'max_size': clients}},
+        }
+    path = f'{reverse("sensorreading-list")}?page_size=10'
+    handler = WSGIHandler()
+    results = {}
+    for variant, overrides in variants.items():
+        # the connections of every thread share the settings dict of the alias
+        database.update(overrides)
+        try:
+            best = None
+            for _ in range(repeat):
+                opened = registry.connections.get('default', 0)
+                start = time.perf_counter()
+                _serve(handler, path, requests, clients)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+                opened = registry.connections.get('default', 0) - opened
+            stats = pool_stats().get('default')
+            if stats is not None:
+                # connections checked out of the pool are not opened
+                opened = stats['connections_num']
+                connections['default'].close_pool()
+        finally:
+            database.update(original)
+        results[variant] = {'seconds': best, 'requests_per_second': requests / best, 'connections': opened}
+    return results
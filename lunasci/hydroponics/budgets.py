@@ -0,0 +1,55 @@
+"""
+This module enforces query budgets on the hydroponics viewsets.
+
+A viewset declares the largest number of SQL queries each of its actions may run, including
+authentication, in its query_budgets attribute. Going over budget usually means an N+1 query
+pattern slipped in, e.g. a related field serialized without being prefetched.
+
+What happens when an action goes over budget is set by HYDROPONICS_QUERY_BUDGETS: "raise"
+raises QueryBudgetExceeded, which the tests use to fail, "log" logs a warning, and nothing
+happens when it is unset. Queries run while a streaming response is consumed are not counted.
+
+It contains:
+    - QueryBudgetExceeded: Raised when an action runs more queries than its budget.
+    - QueryBudgetMixin: Counts the queries of every request to a viewset and checks them against its budgets.
+"""
+
+import logging
+
+from django.conf import settings
+
+from lunasci.instrumentation import QueryCounter
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when an action runs more queries than its budget.
+    """
+
+class QueryBudgetMixin:
+    """
+    Counts the queries of every request to a viewset and checks them against the budget
+    of its action, see HYDROPONICS_QUERY_BUDGETS.
+
+    Attributes:
+        query_budgets (dict): The largest number of queries of every budgeted action, keyed by action name.
+    """
+    query_budgets = {}
+
+    def dispatch(self, request, *args, **kwargs):
+        mode = settings.HYDROPONICS_QUERY_BUDGETS
+        if not mode:
+            return super().dispatch(request, *args, **kwargs)
+        with QueryCounter() as queries:
+            response = super().dispatch(request, *args, **kwargs)
+        budget = self.query_budgets.get(self.action)
+        if budget is not None and queries.count > budget:
+            message = (
+                f'{type(self).__name__}.{self.action} ran {queries.count} queries, '
+                f'over its budget of {budget}: {request.method} {request.get_full_path()}'
+            )
+            if mode == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
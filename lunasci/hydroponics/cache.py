@@ -0,0 +1,170 @@
+"""
+This module caches the latest sensor reading of every hydroponics system.
+
+Entries live in the cache configured by HYDROPONICS_CACHE_ALIAS, local memory by default,
+and are kept up to date by the ingest paths rather than expiring on their own. The entries of
+deleted systems, also deleted by cascades, are dropped, see lunasci.hydroponics.signals.
+
+Entries are only written while holding a lock on them, itself a cache entry, so concurrent
+writers cannot replace a newer reading with an older one. The lock only spans the processes
+sharing the cache, i.e. all of them with a shared backend such as Redis or Memcached.
+
+It contains:
+    - reading_snapshot: Converts a sensor reading into the cached representation.
+    - get_latest: Returns the latest reading of a system, loading it on a cache miss.
+    - aget_cached_latest, aget_latest: The asynchronous counterparts of get_cached_latest and get_latest.
+    - record_latest: Updates the cached readings with newly created ones.
+    - invalidate_latest: Drops the cached readings of some systems.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from lunasci.hydroponics.models import SensorReading
+
+SNAPSHOT_FIELDS = ('id', 'created', 'ph', 'temperature', 'tds')
+
+# Cached in place of a snapshot for systems without readings
+NO_READING = {}
+
+# Seconds after which the lock on an entry expires, in case its holder died,
+# and a writer waiting for it takes the entry over
+LOCK_TIMEOUT = 5
+
+# Seconds between two attempts to take a lock
+LOCK_POLL_INTERVAL = 0.01
+
+def _cache():
+    return caches[settings.HYDROPONICS_CACHE_ALIAS]
+
+def _key(hydroponics_id):
+    return f'hydroponics:{hydroponics_id}:latest_reading'
+
+@contextmanager
+def _locked(hydroponics_id):
+    """
+    Hold the lock on the cache entry of a system, waiting up to LOCK_TIMEOUT for it.
+    """
+    cache, key, token = _cache(), f'{_key(hydroponics_id)}:lock', uuid4().hex
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not cache.add(key, token, timeout=LOCK_TIMEOUT) and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        # a lock that expired meanwhile may have been taken by another writer
+        if cache.get(key) == token:
+            cache.delete(key)
+
+@asynccontextmanager
+async def _alocked(hydroponics_id):
+    """
+    Asynchronous counterpart of _locked.
+    """
+    cache, key, token = _cache(), f'{_key(hydroponics_id)}:lock', uuid4().hex
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not await cache.aadd(key, token, timeout=LOCK_TIMEOUT) and time.monotonic() < deadline:
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        if await cache.aget(key) == token:
+            await cache.adelete(key)
+
+def reading_snapshot(reading):
+    """
+    Return the cached representation of a sensor reading instance.
+    """
+    return {field: getattr(reading, field) for field in SNAPSHOT_FIELDS}
+
+def get_cached_latest(hydroponics_id):
+    """
+    Return the cached latest reading of a system, NO_READING if it is known to have none,
+    or None on a cache miss.
+    """
+    return _cache().get(_key(hydroponics_id))
+
+def get_latest(hydroponics_id):
+    """
+    Return the latest reading of a system as a snapshot dict, or None if it has no readings.
+    On a cache miss the reading is loaded from the database and cached.
+    """
+    snapshot = get_cached_latest(hydroponics_id)
+    if snapshot is None:
+        # loaded under the lock, so a reading committed meanwhile is either loaded here
+        # or recorded over the loaded one, see record_latest
+        with _locked(hydroponics_id):
+            snapshot = get_cached_latest(hydroponics_id)
+            if snapshot is None:
+                # from the primary, a lagging replica would leave a stale reading cached
+                # until the next one
+                snapshot = (
+                    SensorReading.objects.using(DEFAULT_DB_ALIAS)
+                    .filter(hydroponics_id=hydroponics_id)
+                    .order_by('-created', '-id')
+                    .values(*SNAPSHOT_FIELDS)
+                    .first()
+                ) or NO_READING
+                _cache().set(_key(hydroponics_id), snapshot, timeout=None)
+    return snapshot or None
+
+async def aget_cached_latest(hydroponics_id):
+    """
+    Asynchronous counterpart of get_cached_latest.
+    """
+    return await _cache().aget(_key(hydroponics_id))
+
+async def aget_latest(hydroponics_id):
+    """
+    Asynchronous counterpart of get_latest, using the async cache and ORM interfaces.
+    """
+    snapshot = await aget_cached_latest(hydroponics_id)
+    if snapshot is None:
+        async with _alocked(hydroponics_id):
+            snapshot = await aget_cached_latest(hydroponics_id)
+            if snapshot is None:
+                snapshot = await (
+                    SensorReading.objects.using(DEFAULT_DB_ALIAS)
+                    .filter(hydroponics_id=hydroponics_id)
+                    .order_by('-created', '-id')
+                    .values(*SNAPSHOT_FIELDS)
+                    .afirst()
+                ) or NO_READING
+                await _cache().aset(_key(hydroponics_id), snapshot, timeout=None)
+    return snapshot or None
+
+def record_latest(readings):
+    """
+    Update the cached latest readings with newly created readings.
+
+    Systems without a cache entry are left alone, since the new readings
+    may be backfilled ones older than the latest stored reading. Every entry
+    is compared and replaced under its lock, see _locked.
+    """
+    newest = {}
+    for reading in readings:
+        current = newest.get(reading.hydroponics_id)
+        if current is None or (reading.created, reading.id) > (current.created, current.id):
+            newest[reading.hydroponics_id] = reading
+
+    for hydroponics_id, reading in newest.items():
+        with _locked(hydroponics_id):
+            snapshot = get_cached_latest(hydroponics_id)
+            if snapshot is None or (
+                snapshot != NO_READING
+                and (reading.created, reading.id) <= (snapshot['created'], snapshot['id'])
+            ):
+                continue
+            _cache().set(_key(hydroponics_id), reading_snapshot(reading), timeout=None)
+
+def invalidate_latest(hydroponics_ids):
+    """
+    Drop the cached latest readings of the given systems.
+    """
+    _cache().delete_many([_key(hydroponics_id) for hydroponics_id in hydroponics_ids])
@@ -0,0 +1,152 @@
+"""
+This module implements HTTP conditional requests for the hydroponics viewsets.
+
+Validators are derived from Hydroponics.version and Hydroponics.modified, which are bumped
+whenever a system, its sensor readings or the username of its owner change, so they are computed with a single cheap
+query and unchanged resources are answered with 304 Not Modified before anything is
+serialized.
+
+It contains:
+    - ResourceState: The validators of a resource or collection.
+    - fleet_state: Computes the validators of every collection backed by hydroponics systems.
+    - ConditionalRequestMixin: Adds ETag and Last-Modified handling to a model viewset.
+"""
+
+import hashlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from lunasci.hydroponics.models import Hydroponics
+
+@dataclass(frozen=True)
+class ResourceState:
+    """
+    The validators of a resource or collection.
+
+    Attributes:
+        key (str): A string changing whenever the resource changes.
+        last_modified (datetime): The time of the latest change, if known.
+    """
+    key: str
+    last_modified: datetime | None = None
+
+def fleet_state():
+    """
+    Return the state of all hydroponics systems and their sensor readings.
+
+    The sum of the versions changes with every write, and the count and the
+    maximum id tell apart creations and deletions that would keep it unchanged.
+    """
+    state = Hydroponics.objects.aggregate(
+        count=Count('id'), last_id=Max('id'), versions=Sum('version'), modified=Max('modified'),
+    )
+    return ResourceState(
+        key=f'{state["count"]}:{state["last_id"]}:{state["versions"]}',
+        last_modified=state['modified'],
+    )
+
+class ConditionalRequestMixin(ABC):
+    """
+    Adds HTTP conditional requests to a model viewset.
+
+    list and retrieve set ETag and Last-Modified headers and answer If-None-Match and
+    If-Modified-Since with 304 Not Modified without running the list or detail queries.
+    update, partial_update and destroy honor If-Match and If-Unmodified-Since for
+    optimistic concurrency: the validators are checked while the row holding the version
+    is locked, and a stale precondition is answered with 412 Precondition Failed.
+
+    Viewsets describe their resources by implementing get_list_state and get_object_state.
+    """
+
+    @abstractmethod
+    def get_list_state(self):
+        """
+        Return the ResourceState of the collection.
+        """
+
+    @abstractmethod
+    def get_object_state(self, pk, lock=False):
+        """
+        Return the ResourceState of the instance with the given primary key, or None if it
+        does not exist. With lock set, the row holding the version is locked until the end
+        of the transaction.
+        """
+
+    def get_etag(self, state):
+        """
+        Return a strong ETag for the given state in the negotiated representation.
+        """
+        media_type = getattr(self.request, 'accepted_media_type', '')
+        digest = hashlib.md5(f'{state.key}:{media_type}'.encode(), usedforsecurity=False)
+        return f'"{digest.hexdigest()}"'
+
+    def _current_state(self, lock=False):
+        if not self.detail:
+            return self.get_list_state()
+        try:
+            return self.get_object_state(self.kwargs[self.lookup_url_kwarg or self.lookup_field], lock)
+        except (TypeError, ValueError):
+            # malformed primary keys are left to get_object to reject
+            return None
+
+    def _precondition_response(self, state):
+        """
+        Evaluate the request preconditions, returning a 304 or 412 response if they fail.
+        """
+        last_modified = state.last_modified if state else None
+        return get_conditional_response(
+            self.request._request,
+            etag=self.get_etag(state) if state else None,
+            # HTTP dates have a resolution of one second
+            last_modified=int(last_modified.timestamp()) if last_modified else None,
+        )
+
+    def _set_validators(self, response, state):
+        if state is None or not 200 <= response.status_code < 300:
+            return response
+        response['ETag'] = self.get_etag(state)
+        if state.last_modified:
+            response['Last-Modified'] = http_date(state.last_modified.timestamp())
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    def _has_write_preconditions(self):
+        meta = self.request.META
+        return 'HTTP_IF_MATCH' in meta or 'HTTP_IF_UNMODIFIED_SINCE' in meta
+
+    def list(self, request, *args, **kwargs):
+        state = self.get_list_state()
+        return self._precondition_response(state) or self._set_validators(
+            super().list(request, *args, **kwargs), state
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        state = self._current_state()
+        if state is None:
+            return super().retrieve(request, *args, **kwargs)
+        return self._precondition_response(state) or self._set_validators(
+            super().retrieve(request, *args, **kwargs), state
+        )
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            if self._has_write_preconditions():
+                failed = self._precondition_response(self._current_state(lock=True))
+                if failed is not None:
+                    return failed
+            response = super().update(request, *args, **kwargs)
+        return self._set_validators(response, self._current_state())
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            if self._has_write_preconditions():
+                failed = self._precondition_response(self._current_state(lock=True))
+                if failed is not None:
+                    return failed
+            return super().destroy(request, *args, **kwargs)
@@ -0,0 +1,110 @@
+"""
+This module reduces series of sensor readings to a number of points a chart can draw,
+while keeping their visual shape.
+
+It contains:
+    - DOWNSAMPLERS: The downsampling methods, keyed by name.
+    - lttb: Selects points with the Largest-Triangle-Three-Buckets algorithm.
+    - minmax: Selects the smallest and largest value of every bucket.
+    - downsample_window: Downsamples every metric of a ReadingWindow into [timestamp, value] pairs.
+"""
+
+import numpy as np
+
+def lttb(x, y, max_points):
+    """
+    Return the indexes of at most max_points points of the series (x, y) selected with
+    Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept, and the points in between are split into
+    max_points - 2 buckets of equal size. From every bucket, the point forming the largest
+    triangle with the point selected from the previous bucket and the average of the next
+    bucket is selected, which preserves peaks and troughs much better than averaging.
+    max_points must be at least 3.
+    """
+    count = len(x)
+    if max_points >= count:
+        return np.arange(count)
+    if max_points < 3:
+        raise ValueError('LTTB needs at least 3 points.')
+
+    edges = (np.arange(max_points - 1) * ((count - 2) / (max_points - 2))).astype(np.int64) + 1
+    edges[-1] = count - 1
+    sizes = np.diff(edges)
+    average_x = np.add.reduceat(x[:count - 1], edges[:-1]) / sizes
+    average_y = np.add.reduceat(y[:count - 1], edges[:-1]) / sizes
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket < max_points - 3:
+            next_x, next_y = average_x[bucket + 1], average_y[bucket + 1]
+        else:
+            next_x, next_y = x[-1], y[-1]
+        previous_x, previous_y = x[previous], y[previous]
+        # twice the triangle areas, the factor does not change which one is the largest
+        areas = np.abs(
+            (previous_x - next_x) * (y[start:end] - previous_y)
+            - (previous_x - x[start:end]) * (next_y - previous_y)
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+def minmax(x, y, max_points):
+    """
+    Return the indexes of at most max_points points of the series (x, y), made of the
+    smallest and the largest value of max_points / 2 buckets of equal size, in order.
+
+    Every extreme of the series is kept, which makes it the safer choice for spotting spikes.
+    max_points must be at least 2.
+    """
+    count = len(y)
+    if max_points >= count:
+        return np.arange(count)
+    if max_points < 2:
+        raise ValueError('Min-max decimation needs at least 2 points.')
+    buckets = max_points // 2
+    size = -(-count // buckets)
+    buckets = -(-count // size)
+    padding = buckets * size - count
+    low = np.concatenate((y, np.full(padding, np.inf))).reshape(buckets, size)
+    high = np.concatenate((y, np.full(padding, -np.inf))).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    indexes = np.stack((offsets + low.argmin(axis=1), offsets + high.argmax(axis=1)), axis=1)
+    indexes.sort(axis=1)
+    indexes = indexes.ravel()
+    # single valued buckets select the same point twice
+    return indexes[np.concatenate(([True], indexes[1:] != indexes[:-1]))]
+
+DOWNSAMPLERS = {
+    'lttb': lttb,
+    'minmax': minmax,
+}
+
+def downsample_window(readings, metrics, max_points, method='lttb'):
+    """
+    Downsample the given metrics of a ReadingWindow to at most max_points points each.
+
+    Missing measurements are skipped. Returns a dict mapping every metric to a list of
+    [timestamp, value] pairs, with timestamps in milliseconds since the Unix epoch.
+    """
+    downsampler = DOWNSAMPLERS[method]
+    milliseconds = readings.created.astype('datetime64[ms]').astype(np.int64)
+    series = {}
+    for metric in metrics:
+        values = readings.values[metric]
+        present = ~np.isnan(values)
+        if present.all():
+            timestamps, seconds = milliseconds, readings.seconds
+        else:
+            timestamps, seconds, values = milliseconds[present], readings.seconds[present], values[present]
+        if len(values):
+            # relative times keep the triangle areas precise
+            selected = downsampler(seconds - seconds[0], values, max_points)
+            timestamps, values = timestamps[selected], values[selected]
+        series[metric] = [list(point) for point in zip(timestamps.tolist(), values.tolist())]
+    return series
@@ -0,0 +1,203 @@
+"""
+This module implements streaming exports of sensor readings.
+
+Readings are fetched through a server-side cursor in chunks of HYDROPONICS_EXPORT_CHUNK_SIZE
+rows and encoded one chunk at a time, so memory use does not depend on the number of rows.
+
+The binary format is meant for loading straight into NumPy. It consists of:
+    - BINARY_MAGIC,
+    - the length of the header as a little-endian uint32, followed by the header,
+      a UTF-8 JSON object listing the columns with their NumPy dtypes,
+    - blocks made of a little-endian uint32 row count followed by the values of every column
+      in turn, packed in the column's dtype,
+    - a block with a row count of zero marking the end of the stream.
+created is stored as microseconds since the Unix epoch, missing measurements as NaN.
+
+It contains:
+    - EXPORT_COLUMNS: The exported reading columns.
+    - ExportFormat: Describes an export format.
+    - EXPORT_FORMATS: The supported export formats, keyed by name.
+    - export_readings: Streams the readings of a queryset in a given format.
+    - iter_binary_blocks: Decodes a binary export into blocks of columns.
+    - ExportContentNegotiation: Lets export endpoints ignore the Accept header.
+"""
+
+import csv
+import io
+import json
+import math
+import struct
+import sys
+from array import array
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+from typing import Callable
+
+from django.conf import settings
+from rest_framework.negotiation import BaseContentNegotiation
+
+EXPORT_COLUMNS = ('id', 'created', 'hydroponics', 'ph', 'temperature', 'tds')
+
+BINARY_MAGIC = b'LSRB\x01'
+
+# NumPy dtype and array typecode of every column in the binary format
+BINARY_COLUMNS = (
+    ('id', '<i8', 'q'),
+    ('created', '<i8', 'q'),
+    ('hydroponics', '<i8', 'q'),
+    ('ph', '<f4', 'f'),
+    ('temperature', '<f4', 'f'),
+    ('tds', '<f4', 'f'),
+)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_UINT32 = struct.Struct('<I')
+
+def _chunks(rows, size):
+    """
+    Split an iterable of rows into lists of at most size rows.
+    """
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+def _isoformat(value):
+    return value.astimezone(dt_timezone.utc).isoformat().replace('+00:00', 'Z')
+
+def _encode_csv(rows, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows(
+            (pk, _isoformat(created), hydroponics, ph, temperature, tds)
+            for pk, created, hydroponics, ph, temperature, tds in chunk
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def _encode_ndjson(rows, chunk_size):
+    for chunk in _chunks(rows, chunk_size):
+        lines = []
+        for pk, created, hydroponics, ph, temperature, tds in chunk:
+            lines.append(json.dumps({
+                'id': pk,
+                'created': _isoformat(created),
+                'hydroponics': hydroponics,
+                'ph': ph,
+                'temperature': temperature,
+                'tds': tds,
+            }))
+        yield ('\n'.join(lines) + '\n').encode()
+
+def _pack(typecode, values):
+    packed = array(typecode, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def _encode_binary(rows, chunk_size):
+    header = json.dumps({
+        'columns': [{'name': name, 'dtype': dtype} for name, dtype, _ in BINARY_COLUMNS],
+        'created': 'microseconds since the Unix epoch',
+    }).encode()
+    yield BINARY_MAGIC + _UINT32.pack(len(header)) + header
+    nan = math.nan
+    for chunk in _chunks(rows, chunk_size):
+        ids, created, hydroponics, ph, temperature, tds = zip(*chunk)
+        yield b''.join((
+            _UINT32.pack(len(chunk)),
+            _pack('q', ids),
+            _pack('q', [(value - _EPOCH) // _MICROSECOND for value in created]),
+            _pack('q', hydroponics),
+            *(
+                _pack('f', [nan if value is None else value for value in column])
+                for column in (ph, temperature, tds)
+            ),
+        ))
+    yield _UINT32.pack(0)
+
+@dataclass(frozen=True)
+class ExportFormat:
+    """
+    Describes an export format.
+
+    Attributes:
+        name (str): The name of the format, as passed by clients.
+        media_type (str): The media type of the exported document.
+        extension (str): The file name extension of the exported document.
+        encode (callable): Turns an iterable of value rows into chunks of bytes.
+    """
+    name: str
+    media_type: str
+    extension: str
+    encode: Callable
+
+EXPORT_FORMATS = {
+    export_format.name: export_format for export_format in (
+        ExportFormat('csv', 'text/csv', 'csv', _encode_csv),
+        ExportFormat('ndjson', 'application/x-ndjson', 'ndjson', _encode_ndjson),
+        ExportFormat('binary', 'application/octet-stream', 'bin', _encode_binary),
+    )
+}
+
+def export_readings(queryset, export_format, chunk_size=None):
+    """
+    Stream the readings of a queryset, in its order, as chunks of bytes of the given format.
+
+    Rows are fetched through a server-side cursor, chunk_size rows
+    (HYDROPONICS_EXPORT_CHUNK_SIZE by default) at a time.
+    """
+    chunk_size = chunk_size or settings.HYDROPONICS_EXPORT_CHUNK_SIZE
+    rows = queryset.values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+    return EXPORT_FORMATS[export_format].encode(rows, chunk_size)
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated binary export.')
+    return data
+
+def iter_binary_blocks(stream):
+    """
+    Decode a binary export read from a binary file object into blocks of columns.
+
+    Yields one dict per block, mapping every column name to an array of its values.
+    With NumPy, np.frombuffer(data, dtype) can be used on the column bytes instead.
+    """
+    if _read_exactly(stream, len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError('Not a binary sensor reading export.')
+    header_length, = _UINT32.unpack(_read_exactly(stream, _UINT32.size))
+    header = json.loads(_read_exactly(stream, header_length))
+    typecodes = dict((name, typecode) for name, _, typecode in BINARY_COLUMNS)
+    columns = [(column['name'], typecodes[column['name']]) for column in header['columns']]
+    while True:
+        count, = _UINT32.unpack(_read_exactly(stream, _UINT32.size))
+        if not count:
+            return
+        block = {}
+        for name, typecode in columns:
+            values = array(typecode)
+            values.frombytes(_read_exactly(stream, count * values.itemsize))
+            if sys.byteorder == 'big':
+                values.byteswap()
+            block[name] = values
+        yield block
+
+class ExportContentNegotiation(BaseContentNegotiation):
+    """
+    Selects the first renderer whatever the Accept header says, since the export itself
+    is not rendered. Requests accepting only the export's media type would otherwise be
+    refused with 406 Not Acceptable, and errors are still rendered as JSON.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
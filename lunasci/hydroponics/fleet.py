@@ -0,0 +1,165 @@
+"""
+This module generates synthetic fleets of hydroponics systems with realistic sensor readings,
+for benchmarks and load tests.
+
+Every system reads its sensors at a fixed interval, staggered across the fleet, so the fleet
+as a whole produces readings_per_second readings every second over the history. Temperatures
+follow a diurnal curve peaking mid-afternoon, local time, around a base temperature of their
+own; the pH wanders slowly around the set point of its system; and the TDS falls as nutrients
+are taken up, until the reservoir is topped up every three days.
+
+Readings are generated by PostgreSQL in a single INSERT ... SELECT over generate_series, in
+creation order like real ingestion, and the random numbers are seeded, so a fleet is
+reproduced exactly from its FleetSpec.
+
+It contains:
+    - FleetSpec: The shape of a synthetic fleet.
+    - Fleet: The users, systems and time range of a generated fleet.
+    - generate_fleet: Creates the users, systems and readings of a fleet.
+"""
+
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.utils import timezone
+
+from lunasci.hydroponics.ingest import readings_changed
+from lunasci.hydroponics.models import Hydroponics, SensorReading
+
+_READINGS_SQL = """
+WITH systems AS MATERIALIZED (
+    SELECT
+        id,
+        row_number() OVER (ORDER BY id) - 1 AS position,
+        5.8 + 0.4 * random() AS ph_set,
+        19 + 4 * random() AS base_temperature,
+        700 + 300 * random() AS full_tds
+    FROM {hydroponics}
+    WHERE id = ANY(%(ids)s)
+    ORDER BY id
+),
+readings AS (
+    SELECT
+        systems.*,
+        i,
+        %(end)s - make_interval(secs => (%(count)s - i + position::float / %(systems)s) * %(interval)s) AS created
+    FROM generate_series(1, %(count)s) AS i, systems
+)
+INSERT INTO {reading} (created, hydroponics_id, ph, temperature, tds)
+SELECT
+    created,
+    id,
+    ph_set + 0.1 * sin(i * %(interval)s / 21600 + position) + 0.04 * (random() - 0.5),
+    base_temperature
+        + 3 * sin(2 * pi() * (extract(epoch FROM (created AT TIME ZONE %(tz)s)::time) / 86400 - 0.375))
+        + 0.3 * (random() - 0.5),
+    full_tds * (1 - 0.3 * mod(extract(epoch FROM created) + position * 3600, 259200)::float / 259200)
+        + 5 * (random() - 0.5)
+FROM readings
+ORDER BY i, position DESC
+"""
+
+@dataclass(frozen=True)
+class FleetSpec:
+    """
+    The shape of a synthetic fleet.
+
+    Attributes:
+        users (int): The number of owners.
+        systems_per_user (int): The number of hydroponics systems of every owner.
+        readings_per_second (float): The number of readings produced by the whole fleet every second.
+        history (timedelta): How far back the readings go.
+        seed (float): The seed of the random numbers, between -1 and 1.
+    """
+    users: int = 10
+    systems_per_user: int = 10
+    readings_per_second: float = 1.0
+    history: timedelta = timedelta(days=1)
+    seed: float = 0.0
+
+    @property
+    def systems(self):
+        return self.users * self.systems_per_user
+
+    @property
+    def interval(self):
+        """
+        The seconds between two readings of a system.
+        """
+        return self.systems / self.readings_per_second
+
+    @property
+    def readings_per_system(self):
+        return int(self.history.total_seconds() // self.interval)
+
+    @property
+    def readings(self):
+        return self.readings_per_system * self.systems
+
+@dataclass
+class Fleet:
+    """
+    The users, systems and time range of a generated fleet.
+
+    Attributes:
+        spec (FleetSpec): The shape of the fleet.
+        users (list): The owners.
+        hydroponics_ids (list): The ids of the systems, in creation order.
+        start (datetime): The start of the history, no reading is older.
+        end (datetime): The time of the latest reading.
+    """
+    spec: FleetSpec
+    users: list
+    hydroponics_ids: list
+    start: object
+    end: object
+
+    @property
+    def readings(self):
+        return self.spec.readings
+
+def generate_fleet(spec, name='fleet', end=None):
+    """
+    Create the users, systems and readings of a fleet, the latest readings being taken at end,
+    now by default. Users are named {name}-{index} and systems {name} {user}-{index}.
+
+    Returns a Fleet.
+    """
+    end = end or timezone.now()
+    users = get_user_model().objects.bulk_create(
+        get_user_model()(username=f'{name}-{index}', password=make_password(None))
+        for index in range(spec.users)
+    )
+    systems = Hydroponics.objects.bulk_create(
+        Hydroponics(owner=user, name=f'{name} {user_index}-{index}')
+        for user_index, user in enumerate(users)
+        for index in range(spec.systems_per_user)
+    )
+    hydroponics_ids = [system.pk for system in systems]
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT setseed(%s)', [spec.seed])
+        cursor.execute(
+            _READINGS_SQL.format(hydroponics=Hydroponics._meta.db_table, reading=SensorReading._meta.db_table),
+            {
+                'ids': hydroponics_ids,
+                'end': end,
+                'count': spec.readings_per_system,
+                'systems': spec.systems,
+                'interval': spec.interval,
+                'tz': timezone.get_current_timezone_name(),
+            },
+        )
+        # fresh statistics, so queries against the fleet are planned like in production
+        cursor.execute(f'ANALYZE {SensorReading._meta.db_table}')
+    readings_changed(set(hydroponics_ids))
+    return Fleet(
+        spec=spec,
+        users=users,
+        hydroponics_ids=hydroponics_ids,
+        start=end - timedelta(seconds=spec.interval * spec.readings_per_system),
+        end=end,
+    )
@@ -0,0 +1,360 @@
+"""
+This module implements batch ingestion of sensor readings.
+
+Ingestion is idempotent for readings numbered by their device: readings are inserted with
+INSERT ... ON CONFLICT DO NOTHING, so a reading sent again with the same device sequence
+number and measurement timestamp is skipped after a single index lookup, see SensorReading.
+COPY cannot skip conflicting rows, so streamed loads are copied into a temporary staging
+table first and inserted from there.
+
+It contains:
+    - readings_created, readings_changed: Keep the state derived from readings up to date.
+    - validate_rows: Validates a batch of raw readings in a single pass.
+    - insert_readings: Inserts readings, skipping those already stored.
+    - bulk_ingest: Validates a batch and inserts the valid readings.
+    - iter_csv_rows, iter_ndjson_rows: Lazily decode CSV and NDJSON input into raw readings.
+    - copy_ingest: Streams raw readings into the sensor_reading table with COPY FROM STDIN.
+"""
+
+import csv
+import json
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, DateTimeField, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from rest_framework import serializers
+
+from lunasci.database import copy_from
+from lunasci.hydroponics import rollups
+from lunasci.hydroponics.alerts import evaluate_readings
+from lunasci.hydroponics.cache import invalidate_latest, record_latest
+from lunasci.hydroponics.live import publish_readings
+from lunasci.hydroponics.models import Hydroponics, SensorReading
+from lunasci.hydroponics.serializers import SensorReadingBulkSerializer
+
+# Maximum number of rejected rows described in a CopyResult
+MAX_REPORTED_ERRORS = 100
+
+# Number of rows encoded into a single chunk of COPY input
+COPY_CHUNK_ROWS = 1000
+
+# Columns written by insert_readings and copy_ingest
+COPY_COLUMNS = ('created', 'hydroponics_id', 'ph', 'temperature', 'tds', 'device_seq')
+
+# Error of the rows referencing a system outside of the systems the ingest is restricted to
+OUT_OF_SCOPE_ERROR = {'hydroponics': ['Not allowed to write readings of this hydroponics instance.']}
+
+def _schedule_rollup():
+    """
+    Fold newly ingested readings into the rollups once the current transaction commits,
+    if HYDROPONICS_ROLLUP_ON_INGEST is enabled. The catch-up is skipped when another one
+    is already running, since that one or the next one picks the readings up.
+    """
+    if settings.HYDROPONICS_ROLLUP_ON_INGEST:
+        transaction.on_commit(lambda: rollups.catch_up(wait=False))
+
+def readings_created(readings):
+    """
+    Update the state derived from sensor readings after the given readings were created:
+    the cached latest readings, the last_reading_at and version of the systems, the alert
+    rules and, optionally, the rollups. The readings are also published to live subscribers.
+    """
+    last_reading_at = {}
+    for reading in readings:
+        current = last_reading_at.get(reading.hydroponics_id)
+        if current is None or reading.created > current:
+            last_reading_at[reading.hydroponics_id] = reading.created
+    if last_reading_at:
+        # a single UPDATE however many systems the readings belong to
+        latest = Case(
+            *(When(pk=hydroponics_id, then=Value(created)) for hydroponics_id, created in last_reading_at.items()),
+            output_field=DateTimeField(),
+        )
+        Hydroponics.objects.filter(pk__in=last_reading_at).update(
+            last_reading_at=Greatest(Coalesce('last_reading_at', latest), latest),
+            version=F('version') + 1,
+            modified=timezone.now(),
+        )
+    evaluate_readings(readings)
+    transaction.on_commit(lambda: record_latest(readings))
+    transaction.on_commit(lambda: publish_readings(readings))
+    _schedule_rollup()
+
+def readings_changed(hydroponics_ids):
+    """
+    Update the state derived from sensor readings after readings of the given systems
+    were updated or deleted, or created without their ids being known.
+    """
+    if not hydroponics_ids:
+        return
+    latest = SensorReading.objects.filter(hydroponics=OuterRef('pk')).order_by('-created')
+    Hydroponics.objects.filter(pk__in=hydroponics_ids).update(
+        last_reading_at=Subquery(latest.values('created')[:1]),
+        version=F('version') + 1,
+        modified=timezone.now(),
+    )
+    transaction.on_commit(lambda: invalidate_latest(hydroponics_ids))
+
+def validate_rows(rows, hydroponics_ids=None):
+    """
+    Validate a batch of raw readings.
+
+    Every row is validated with the same serializer instance, and the referenced
+    hydroponics instances are checked for existence with a single query. When
+    hydroponics_ids is given, rows referencing any other system are rejected.
+
+    Returns a tuple of (readings, errors), where readings is a list of unsaved
+    SensorReading instances and errors is a list of {'index', 'errors'} dicts
+    describing the rejected rows. Readings without a measurement timestamp
+    are stamped with the current time.
+    """
+    serializer = SensorReadingBulkSerializer()
+    now = timezone.now()
+    validated = []
+    errors = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors.append({'index': index, 'errors': {'non_field_errors': ['Expected an object.']}})
+            continue
+        try:
+            validated.append((index, serializer.run_validation(row)))
+        except serializers.ValidationError as exc:
+            errors.append({'index': index, 'errors': exc.detail})
+
+    referenced = {data['hydroponics'] for _, data in validated}
+    existing = set(
+        Hydroponics.objects.filter(pk__in=referenced).values_list('pk', flat=True)
+    )
+
+    readings = []
+    for index, data in validated:
+        if hydroponics_ids is not None and data['hydroponics'] not in hydroponics_ids:
+            errors.append({'index': index, 'errors': OUT_OF_SCOPE_ERROR})
+            continue
+        if data['hydroponics'] not in existing:
+            errors.append({
+                'index': index,
+                'errors': {'hydroponics': ['Hydroponics instance does not exist.']},
+            })
+            continue
+        readings.append(SensorReading(
+            created=data.get('created') or now,
+            hydroponics_id=data['hydroponics'],
+            ph=data.get('ph'),
+            temperature=data.get('temperature'),
+            tds=data.get('tds'),
+            device_seq=data.get('device_seq'),
+        ))
+    errors.sort(key=lambda error: error['index'])
+    return readings, errors
+
+def insert_readings(readings, batch_size=None):
+    """
+    Insert unsaved readings in chunks of batch_size rows (HYDROPONICS_BULK_BATCH_SIZE by default)
+    with INSERT ... ON CONFLICT DO NOTHING, skipping the readings already stored under the same
+    system, device sequence number and measurement timestamp, or repeated within the batch.
+
+    Returns the inserted readings, as new instances with their primary keys set.
+    """
+    if batch_size is None:
+        batch_size = settings.HYDROPONICS_BULK_BATCH_SIZE
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in COPY_COLUMNS)
+    row = '({})'.format(', '.join(['%s'] * len(COPY_COLUMNS)))
+    # every column, in the order from_db expects them
+    attnames = [field.attname for field in SensorReading._meta.concrete_fields]
+    returning = ', '.join(quote(attname) for attname in attnames)
+    inserted = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(readings), batch_size):
+            chunk = readings[start:start + batch_size]
+            cursor.execute(
+                f'INSERT INTO {quote(SensorReading._meta.db_table)} ({columns}) '
+                f'VALUES {", ".join([row] * len(chunk))} '
+                f'ON CONFLICT DO NOTHING RETURNING {returning}',
+                [getattr(reading, column) for reading in chunk for column in COPY_COLUMNS],
+            )
+            inserted += [SensorReading.from_db(connection.alias, attnames, values) for values in cursor.fetchall()]
+    return inserted
+
+def bulk_ingest(rows, batch_size=None, hydroponics_ids=None):
+    """
+    Validate a batch of raw readings and insert the valid ones with insert_readings,
+    inside a single transaction, so invalid rows never block the rest of the batch.
+    The readings may be restricted to the systems in hydroponics_ids, see validate_rows.
+
+    Returns a tuple of (created readings, errors, duplicates), where created readings and
+    errors are described in validate_rows and duplicates is the number of valid readings
+    that were skipped because they are already stored.
+    """
+    readings, errors = validate_rows(rows, hydroponics_ids)
+    created = []
+    if readings:
+        with transaction.atomic():
+            created = insert_readings(readings, batch_size)
+            if created:
+                readings_created(created)
+    return created, errors, len(readings) - len(created)
+
+def iter_csv_rows(lines):
+    """
+    Decode an iterable of CSV text lines into raw readings.
+
+    The first line must be a header naming the columns, e.g. "hydroponics,ph,temperature,tds".
+    Empty cells are treated as missing values.
+    """
+    for row in csv.DictReader(lines):
+        yield {key: value for key, value in row.items() if key is not None and value != ''}
+
+def iter_ndjson_rows(lines):
+    """
+    Decode an iterable of NDJSON text lines into raw readings.
+
+    Lines that are not valid JSON are passed on as None,
+    so they get reported as rejected rows instead of aborting the load.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+@dataclass
+class CopyResult:
+    """
+    Outcome of a streamed COPY load.
+
+    Attributes:
+        created (int): The number of inserted readings.
+        duplicates (int): The number of valid rows skipped because they are already stored.
+        rejected (int): The number of rows that failed validation.
+        errors (list): Descriptions of the first MAX_REPORTED_ERRORS rejected rows.
+        hydroponics_ids (set): The hydroponics systems that received readings.
+    """
+    created: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    errors: list = field(default_factory=list)
+    hydroponics_ids: set = field(default_factory=set)
+
+    def reject(self, index, errors):
+        """
+        Record a rejected row.
+        """
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'index': index, 'errors': errors})
+
+def _copy_value(value):
+    """
+    Encode a single value for CSV formatted COPY input, where NULL is an empty field.
+    """
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return repr(value)
+
+def _iter_copy_chunks(rows, known, result, hydroponics_ids=None):
+    """
+    Validate raw readings one by one and yield them as chunks of CSV encoded COPY input.
+
+    The connection is busy for the whole COPY, so the ids of existing hydroponics
+    systems have to be passed in as the known set instead of being queried row by row.
+    Rows referencing systems outside of hydroponics_ids, when given, are rejected.
+    """
+    serializer = SensorReadingBulkSerializer()
+    now = timezone.now()
+    lines = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            result.reject(index, {'non_field_errors': ['Expected an object.']})
+            continue
+        try:
+            data = serializer.run_validation(row)
+        except serializers.ValidationError as exc:
+            result.reject(index, exc.detail)
+            continue
+
+        hydroponics_id = data['hydroponics']
+        if hydroponics_ids is not None and hydroponics_id not in hydroponics_ids:
+            result.reject(index, OUT_OF_SCOPE_ERROR)
+            continue
+        if hydroponics_id not in known:
+            result.reject(index, {'hydroponics': ['Hydroponics instance does not exist.']})
+            continue
+
+        # staged rows, the duplicates among them are subtracted once inserted
+        result.created += 1
+        result.hydroponics_ids.add(hydroponics_id)
+        lines.append(','.join((
+            _copy_value(data.get('created') or now),
+            str(hydroponics_id),
+            _copy_value(data.get('ph')),
+            _copy_value(data.get('temperature')),
+            _copy_value(data.get('tds')),
+            _copy_value(data.get('device_seq')),
+        )))
+        if len(lines) >= COPY_CHUNK_ROWS:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+def copy_ingest(rows, drop_indexes=False, hydroponics_ids=None):
+    """
+    Stream raw readings into the sensor_reading table using COPY FROM STDIN.
+
+    Rows are validated and encoded lazily, so the input is never held in memory as a whole.
+    Rejected rows are skipped and reported in the returned CopyResult, as are the rows
+    referencing systems outside of hydroponics_ids when it is given. Rows are copied
+    into a temporary staging table and inserted from there with a single INSERT ... SELECT
+    skipping the readings already stored.
+
+    When drop_indexes is set, the indexes declared on SensorReading.Meta.indexes are dropped
+    before the load and rebuilt afterwards, which is much faster for very large loads.
+    The unique constraint of numbered readings is kept, since duplicates are detected with it.
+    The load runs in a single transaction, so the table stays locked until it finishes.
+    """
+    result = CopyResult()
+    quote = connection.ops.quote_name
+    table = quote(SensorReading._meta.db_table)
+    staging = quote(f'{SensorReading._meta.db_table}_staging')
+    columns = ', '.join(quote(column) for column in COPY_COLUMNS)
+    indexes = SensorReading._meta.indexes if drop_indexes else []
+    with transaction.atomic():
+        known = set(Hydroponics.objects.values_list('pk', flat=True))
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.remove_index(SensorReading, index)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {staging} AS SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            copy_from(
+                cursor,
+                f'COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                _iter_copy_chunks(rows, known, result, hydroponics_ids),
+            )
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} ON CONFLICT DO NOTHING'
+            )
+            result.duplicates = result.created - cursor.rowcount
+            result.created = cursor.rowcount
+            cursor.execute(f'DROP TABLE {staging}')
+            if indexes:
+                # indexes cannot be built while deferred foreign key checks are pending
+                cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.add_index(SensorReading, index)
+        if result.created:
+            readings_changed(result.hydroponics_ids)
+            _schedule_rollup()
+    return result
@@ -0,0 +1,221 @@
+"""
+This module pushes newly ingested sensor readings to live subscribers.
+
+Readings are published after their transaction commits. With the "local" backend they are
+handed to the broadcaster of the current process, which is enough when the ingest endpoints
+and the live endpoint are served by the same process. With the "postgres" backend they are
+sent with NOTIFY, and every process serving subscribers runs a thread that LISTENs and feeds
+its own broadcaster, so any number of workers can be deployed.
+
+Every subscriber gets a bounded queue of ingest batches. Publishing never waits for
+subscribers: one whose queue is full is dropped and has to reconnect, instead of
+stalling ingestion.
+
+It contains:
+    - Subscription: The queue of readings delivered to one subscriber.
+    - Broadcaster: Fans published readings out to the subscriptions of the current process.
+    - broadcaster: The broadcaster of the current process.
+    - reading_event: Converts a sensor reading into the published representation.
+    - publish_readings: Publishes newly created readings through the configured backend.
+    - ensure_listener: Starts the LISTEN thread of the postgres backend.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from rest_framework import serializers
+
+from lunasci.database import Database, connect, wait_notifications
+
+logger = logging.getLogger(__name__)
+
+# Channel of the notifications sent by the postgres backend
+CHANNEL = 'sensor_readings'
+
+# Largest notification payload sent, PostgreSQL refuses payloads from 8000 bytes on
+MAX_NOTIFY_PAYLOAD = 7900
+
+# Seconds the listener waits before reconnecting after losing its connection
+LISTENER_RETRY_DELAY = 5
+
+class Subscription:
+    """
+    The queue of readings delivered to one subscriber.
+
+    Subscriptions are created and consumed on an event loop, while readings are
+    delivered from any thread through call_soon_threadsafe.
+
+    Attributes:
+        hydroponics_ids (frozenset): The ids of the systems whose readings are delivered.
+        loop (AbstractEventLoop): The event loop consuming the subscription.
+        queue (Queue): The batches of readings waiting to be consumed.
+        dropped (bool): Whether the subscriber fell behind and was dropped.
+    """
+
+    def __init__(self, hydroponics_ids, maxsize, loop):
+        self.hydroponics_ids = frozenset(hydroponics_ids)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = False
+
+    def deliver(self, events):
+        """
+        Queue a batch of readings, dropping the subscription when its queue is full.
+        Runs on the subscription's event loop.
+        """
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(events)
+        except asyncio.QueueFull:
+            self.dropped = True
+
+    async def get(self):
+        """
+        Return the next batch of readings, or None once the subscription was dropped
+        and the readings queued before were consumed.
+        """
+        if self.dropped and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+class Broadcaster:
+    """
+    Fans published readings out to the subscriptions of the current process.
+
+    Attributes:
+        subscriptions (dict): The subscriptions interested in every hydroponics id.
+    """
+
+    def __init__(self):
+        self.subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, hydroponics_ids, maxsize=None):
+        """
+        Subscribe to the readings of the given systems. Must be called on the event loop
+        consuming the subscription.
+        """
+        subscription = Subscription(
+            hydroponics_ids,
+            maxsize or settings.HYDROPONICS_LIVE_QUEUE_SIZE,
+            asyncio.get_running_loop(),
+        )
+        with self._lock:
+            for hydroponics_id in subscription.hydroponics_ids:
+                self.subscriptions.setdefault(hydroponics_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for hydroponics_id in subscription.hydroponics_ids:
+                subscribers = self.subscriptions.get(hydroponics_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscriptions[hydroponics_id]
+
+    def publish(self, events):
+        """
+        Deliver reading events to the interested subscriptions without waiting for them.
+        """
+        batches = {}
+        with self._lock:
+            for event in events:
+                for subscription in self.subscriptions.get(event['hydroponics'], ()):
+                    batches.setdefault(subscription, []).append(event)
+        for subscription, batch in batches.items():
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, batch)
+            except RuntimeError:
+                # the event loop of the subscriber is gone
+                self.unsubscribe(subscription)
+            if subscription.dropped:
+                self.unsubscribe(subscription)
+
+broadcaster = Broadcaster()
+
+def reading_event(reading):
+    """
+    Return the published representation of a sensor reading instance.
+    """
+    return {
+        'id': reading.id,
+        'created': serializers.DateTimeField().to_representation(reading.created),
+        'hydroponics': reading.hydroponics_id,
+        'ph': reading.ph,
+        'temperature': reading.temperature,
+        'tds': reading.tds,
+    }
+
+def _notify_payloads(events):
+    """
+    Split reading events into JSON arrays fitting in a notification payload.
+    """
+    payload = []
+    size = 2
+    for event in events:
+        encoded = json.dumps(event)
+        if payload and size + len(encoded) + 1 > MAX_NOTIFY_PAYLOAD:
+            yield '[' + ','.join(payload) + ']'
+            payload, size = [], 2
+        payload.append(encoded)
+        size += len(encoded) + 1
+    if payload:
+        yield '[' + ','.join(payload) + ']'
+
+def publish_readings(readings):
+    """
+    Publish newly created readings through HYDROPONICS_LIVE_BACKEND.
+    Meant to be called once the transaction creating them has committed.
+    """
+    backend = settings.HYDROPONICS_LIVE_BACKEND
+    if not backend or (backend == 'local' and not broadcaster.subscriptions):
+        return
+    events = [reading_event(reading) for reading in readings]
+    if backend == 'postgres':
+        with connection.cursor() as cursor:
+            for payload in _notify_payloads(events):
+                cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, payload])
+    else:
+        broadcaster.publish(events)
+
+def _listen():
+    """
+    Relay the notifications of the postgres backend to the broadcaster, reconnecting on failures.
+    """
+    while True:
+        listener = None
+        try:
+            listener = connect()
+            with listener.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            while True:
+                for payload in wait_notifications(listener, LISTENER_RETRY_DELAY):
+                    broadcaster.publish(json.loads(payload))
+        except (Database.Error, OSError, ValueError):
+            logger.exception('Live reading listener failed, reconnecting.')
+            if listener is not None:
+                listener.close()
+            time.sleep(LISTENER_RETRY_DELAY)
+
+_listener_thread = None
+_listener_lock = threading.Lock()
+
+def ensure_listener():
+    """
+    Start the thread relaying notifications to the broadcaster, if the postgres backend
+    is configured and it is not running yet.
+    """
+    global _listener_thread
+    if settings.HYDROPONICS_LIVE_BACKEND != 'postgres':
+        return
+    with _listener_lock:
+        if _listener_thread is None or not _listener_thread.is_alive():
+            _listener_thread = threading.Thread(target=_listen, name='live-readings-listener', daemon=True)
+            _listener_thread.start()
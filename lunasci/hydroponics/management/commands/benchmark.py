@@ -0,0 +1,189 @@
+"""
+Management command running the benchmarks of the hydroponics application.
+"""
+
+import json
+import platform
+import subprocess
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from lunasci.hydroponics import benchmarks
+from lunasci.hydroponics.fleet import FleetSpec
+
+CONNECTION_BENCHMARK = 'serve_requests'
+
+def _git_commit():
+    """
+    Return the commit checked out in the project directory, if known.
+    """
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=False,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+class Command(BaseCommand):
+    """
+    Runs the given benchmarks, or all of them.
+
+    Micro-benchmarks report the best time of every variant, its throughput and its speedup
+    over the first variant. Fleet benchmarks run against a synthetic fleet shaped by the fleet
+    options and report the best time and the number of queries of every variant. The connection
+    benchmark, serve_requests, reports the requests per second of --clients concurrent clients
+    with new, persistent and pooled connections.
+
+    With --json, a report including the commit, the versions and the options is written
+    instead, so runs can be compared across commits with --compare.
+
+    Benchmarks insert their own data in a transaction that is rolled back,
+    but they do load the database, so avoid running them against production.
+    """
+    help = 'Run the hydroponics benchmarks.'
+
+    def add_arguments(self, parser):
+        names = [*benchmarks.BENCHMARKS, *benchmarks.FLEET_BENCHMARKS, CONNECTION_BENCHMARK]
+        parser.add_argument(
+            'names',
+            nargs='*',
+            help=f'Benchmarks to run, out of: {", ".join(names)}. Defaults to all.',
+        )
+        parser.add_argument('--rows', type=int, default=10000, help='Number of rows per micro-benchmark.')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs per variant.')
+        parser.add_argument('--users', type=int, default=10, help='Number of owners in the fleet.')
+        parser.add_argument('--systems', type=int, default=10, help='Number of systems per owner.')
+        parser.add_argument(
+            '--readings-per-second',
+            type=float,
+            default=1.0,
+            help='Number of readings produced by the whole fleet every second.',
+        )
+        parser.add_argument('--history-days', type=float, default=1.0, help='Days of readings in the fleet.')
+        parser.add_argument('--seed', type=float, default=0.0, help='Seed of the fleet, between -1 and 1.')
+        parser.add_argument('--requests', type=int, default=2000, help='Number of requests per connection variant.')
+        parser.add_argument(
+            '--clients',
+            type=int,
+            default=benchmarks.CONNECTION_CLIENTS,
+            help='Number of concurrent clients sending the requests.',
+        )
+        parser.add_argument('--json', action='store_true', help='Write the results as JSON.')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare the results with.')
+
+    def handle(self, *args, **options):
+        names = options['names'] or [*benchmarks.BENCHMARKS, *benchmarks.FLEET_BENCHMARKS, CONNECTION_BENCHMARK]
+        unknown = set(names) - set(benchmarks.BENCHMARKS) - set(benchmarks.FLEET_BENCHMARKS) - {CONNECTION_BENCHMARK}
+        if unknown:
+            raise CommandError(f'Unknown benchmarks: {", ".join(sorted(unknown))}.')
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        # with --json, stdout only carries the report
+        out = self.stderr if options['json'] else self.stdout
+        results = {}
+
+        for name in names:
+            if name not in benchmarks.BENCHMARKS:
+                continue
+            timings = benchmarks.run(name, rows=options['rows'], repeat=options['repeat'])
+            results[name] = {variant: {'seconds': seconds} for variant, seconds in timings.items()}
+            if options['json']:
+                continue
+            baseline_time = next(iter(timings.values()))
+            out.write(f'{name} ({options["rows"]} rows, best of {options["repeat"]}):')
+            for variant, seconds in timings.items():
+                out.write(
+                    f'  {variant}: {seconds * 1000:.1f} ms, '
+                    f'{options["rows"] / seconds:,.0f} rows/s, {baseline_time / seconds:.1f}x'
+                )
+
+        fleet = None
+        fleet_names = [name for name in names if name in benchmarks.FLEET_BENCHMARKS]
+        if fleet_names:
+            spec = FleetSpec(
+                users=options['users'],
+                systems_per_user=options['systems'],
+                readings_per_second=options['readings_per_second'],
+                history=timedelta(days=options['history_days']),
+                seed=options['seed'],
+            )
+            generated_fleet, generated, fleet_results = benchmarks.run_fleet(fleet_names, spec, options['repeat'])
+            fleet = {
+                'users': spec.users,
+                'systems_per_user': spec.systems_per_user,
+                'readings_per_second': spec.readings_per_second,
+                'history_days': options['history_days'],
+                'seed': spec.seed,
+                'readings': generated_fleet.readings,
+                'generation_seconds': generated,
+            }
+            results.update(fleet_results)
+            if not options['json']:
+                out.write(
+                    f'fleet: {spec.systems} systems, {generated_fleet.readings:,} readings, '
+                    f'generated in {generated:.1f} s'
+                )
+                for name, variants in fleet_results.items():
+                    out.write(f'{name} (best of {options["repeat"]}):')
+                    for variant, timing in variants.items():
+                        out.write(f'  {variant}: {timing["seconds"] * 1000:.1f} ms, {timing["queries"]} queries')
+
+        if CONNECTION_BENCHMARK in names:
+            results[CONNECTION_BENCHMARK] = timings = benchmarks.serve_requests(
+                requests=options['requests'], clients=options['clients'], repeat=options['repeat'],
+            )
+            if not options['json']:
+                out.write(
+                    f'{CONNECTION_BENCHMARK} ({options["requests"]} requests, {options["clients"]} clients, '
+                    f'best of {options["repeat"]}):'
+                )
+                for variant, timing in timings.items():
+                    out.write(
+                        f'  {variant}: {timing["requests_per_second"]:,.0f} requests/s, '
+                        f'{timing["connections"]} connections'
+                    )
+
+        if baseline is not None:
+            self._compare(out, baseline, results)
+        if options['json']:
+            report = {
+                'timestamp': timezone.now().isoformat(),
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': f'{connection.vendor} {getattr(connection, "pg_version", "")}'.strip(),
+                'rows': options['rows'],
+                'repeat': options['repeat'],
+                'requests': options['requests'],
+                'clients': options['clients'],
+                'fleet': fleet,
+                'benchmarks': results,
+            }
+            self.stdout.write(json.dumps(report, indent=2))
+
+    def _compare(self, out, baseline, results):
+        """
+        Write the change of every variant measured in both runs.
+        """
+        out.write(f'compared with {baseline.get("commit") or "the baseline"}:')
+        for name, variants in results.items():
+            for variant, timing in variants.items():
+                previous = baseline.get('benchmarks', {}).get(name, {}).get(variant)
+                if not previous:
+                    continue
+                change = (timing['seconds'] / previous['seconds'] - 1) * 100
+                line = (
+                    f'  {name}, {variant}: {previous["seconds"] * 1000:.1f} ms -> '
+                    f'{timing["seconds"] * 1000:.1f} ms ({change:+.1f}%)'
+                )
+                if 'queries' in timing and previous.get('queries') != timing['queries']:
+                    line += f', {previous.get("queries")} -> {timing["queries"]} queries'
+                out.write(line)
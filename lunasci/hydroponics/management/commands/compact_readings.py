@@ -0,0 +1,43 @@
+"""
+Management command compacting raw sensor readings older than their retention into the rollups.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from lunasci.hydroponics import retention, rollups
+
+class Command(BaseCommand):
+    """
+    Folds pending readings into the rollups, then deletes the raw readings older than
+    the retention of their system in short batches.
+
+    Meant to be run periodically, e.g. daily from cron. It can run during production hours,
+    since no transaction deletes more than --batch-size readings.
+    """
+    help = 'Compact sensor readings older than their retention into the rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=retention.COMPACTION_BATCH_SIZE,
+            help='Number of readings deleted per transaction.',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to wait between batches, e.g. to let replicas catch up.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rollups.catch_up()
+        result = retention.compact(options['batch_size'], options['pause'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {result.deleted} readings of {len(result.hydroponics_ids)} systems '
+            f'in {result.batches} batches in {elapsed:.2f}s.'
+        ))
@@ -0,0 +1,59 @@
+"""
+Management command creating, listing and revoking the device keys of hydroponics systems.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lunasci.hydroponics.authentication import invalidate_device_keys
+from lunasci.hydroponics.models import DeviceKey, Hydroponics
+
+class Command(BaseCommand):
+    """
+    Manages the keys devices authenticate with to write the readings of a hydroponics system:
+      - create HYDROPONICS_ID [--name NAME] prints a new key, which cannot be retrieved later.
+      - list [HYDROPONICS_ID] lists the keys by prefix, of all systems or of one.
+      - revoke PREFIX deletes the keys starting with a prefix. Other processes may accept
+        them for up to HYDROPONICS_DEVICE_KEY_CACHE_TTL seconds.
+    """
+    help = 'Create, list and revoke the device keys of hydroponics systems.'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='command', required=True)
+        create = subparsers.add_parser('create', help='Create a key and print it.')
+        create.add_argument('hydroponics', type=int, help='Id of the hydroponics system the key writes to.')
+        create.add_argument('--name', default='', help='Name of the key, e.g. the device using it.')
+        listing = subparsers.add_parser('list', help='List the keys.')
+        listing.add_argument('hydroponics', type=int, nargs='?', help='Id of a hydroponics system.')
+        revoke = subparsers.add_parser('revoke', help='Delete the keys starting with a prefix.')
+        revoke.add_argument('prefix', help='Prefix of the keys, as listed.')
+
+    def handle(self, *args, **options):
+        if options['command'] == 'create':
+            hydroponics = Hydroponics.objects.filter(pk=options['hydroponics']).first()
+            if hydroponics is None:
+                raise CommandError(f'Hydroponics instance {options["hydroponics"]} does not exist.')
+            device_key, key = DeviceKey.generate(hydroponics, options['name'])
+            self.stderr.write(f'Created key {device_key.prefix} for {hydroponics}, it will not be shown again:')
+            self.stdout.write(key)
+
+        elif options['command'] == 'list':
+            keys = DeviceKey.objects.select_related('hydroponics').order_by('hydroponics', 'created')
+            if options['hydroponics'] is not None:
+                keys = keys.filter(hydroponics=options['hydroponics'])
+            for device_key in keys:
+                self.stdout.write(
+                    f'{device_key.prefix}  {device_key.hydroponics_id} {device_key.hydroponics}  '
+                    f'{device_key.created:%Y-%m-%d %H:%M}  {device_key.name}'.rstrip()
+                )
+
+        else:
+            prefix = options['prefix']
+            if len(prefix) < DeviceKey.PREFIX_LENGTH:
+                raise CommandError(f'Pass the {DeviceKey.PREFIX_LENGTH} characters of the prefix.')
+            keys = DeviceKey.objects.filter(prefix=prefix[:DeviceKey.PREFIX_LENGTH])
+            digests = list(keys.values_list('digest', flat=True))
+            if not digests:
+                raise CommandError(f'No key starts with {prefix}.')
+            keys.delete()
+            invalidate_device_keys(digests)
+            self.stdout.write(f'Revoked {len(digests)} key{"s" if len(digests) > 1 else ""}.')
@@ -0,0 +1,81 @@
+"""
+Management command streaming sensor readings from the database into a CSV, NDJSON or binary file.
+"""
+
+import sys
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+
+from lunasci.hydroponics.export import EXPORT_FORMATS, export_readings
+from lunasci.hydroponics.models import SensorReading
+from lunasci.hydroponics.views import SensorReadingFilter
+
+class Command(BaseCommand):
+    """
+    Exports the sensor readings matching the given filters, ordered by creation time,
+    reporting the achieved throughput on stderr.
+
+    Filters are the ones of the sensor reading list endpoint, passed as name=value pairs,
+    e.g. --filter hydroponics=3 --filter created_after=2024-01-01.
+    """
+    help = 'Stream sensor readings from the database into a CSV, NDJSON or binary file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the output file, or - to write to stdout.')
+        parser.add_argument(
+            '--format',
+            choices=list(EXPORT_FORMATS),
+            help='Output format. Guessed from the file extension when omitted.',
+        )
+        parser.add_argument(
+            '--filter',
+            action='append',
+            default=[],
+            metavar='NAME=VALUE',
+            help='A sensor reading list filter, may be repeated.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Number of rows fetched per round trip to the database.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        output_format = options['format']
+        if output_format is None:
+            extensions = {export_format.extension: name for name, export_format in EXPORT_FORMATS.items()}
+            output_format = extensions.get(path.rpartition('.')[2])
+            if output_format is None:
+                raise CommandError('Cannot guess the output format, please pass --format.')
+
+        data = QueryDict(mutable=True)
+        for item in options['filter']:
+            name, separator, value = item.partition('=')
+            if not separator:
+                raise CommandError(f'Invalid filter {item!r}, expected NAME=VALUE.')
+            data.appendlist(name, value)
+        filterset = SensorReadingFilter(data, queryset=SensorReading.objects.order_by('created', 'id'))
+        if not filterset.is_valid():
+            raise CommandError(f'Invalid filters: {dict(filterset.errors)}')
+
+        try:
+            output = nullcontext(sys.stdout.buffer) if path == '-' else open(path, 'wb')
+        except OSError as exc:
+            raise CommandError(f'Cannot open {path}: {exc}') from exc
+
+        start = time.perf_counter()
+        size = 0
+        with output as stream:
+            for chunk in export_readings(filterset.qs, output_format, options['chunk_size']):
+                stream.write(chunk)
+                size += len(chunk)
+        elapsed = time.perf_counter() - start
+
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {size / 1e6:.1f} MB of {output_format} in {elapsed:.2f}s '
+            f'({size / 1e6 / elapsed if elapsed else 0:.1f} MB/s).'
+        ))
@@ -0,0 +1,63 @@
+"""
+Management command streaming sensor readings from a CSV or NDJSON file into the database.
+"""
+
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lunasci.hydroponics.ingest import copy_ingest, iter_csv_rows, iter_ndjson_rows
+
+class Command(BaseCommand):
+    """
+    Loads sensor readings with COPY FROM STDIN, reporting the achieved throughput.
+
+    CSV input must start with a header line naming its columns
+    (hydroponics, ph, temperature, tds and optionally created),
+    NDJSON input holds one reading object per line.
+    """
+    help = 'Stream sensor readings from a CSV or NDJSON file into the database using COPY.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the input file, or - to read from stdin.')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'ndjson'],
+            help='Input format. Guessed from the file extension when omitted.',
+        )
+        parser.add_argument(
+            '--drop-indexes',
+            action='store_true',
+            help='Drop the sensor_reading indexes during the load and rebuild them afterwards.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format']
+        if input_format is None:
+            if path.endswith('.csv'):
+                input_format = 'csv'
+            elif path.endswith(('.ndjson', '.jsonl')):
+                input_format = 'ndjson'
+            else:
+                raise CommandError('Cannot guess the input format, please pass --format.')
+        decode_rows = iter_csv_rows if input_format == 'csv' else iter_ndjson_rows
+
+        try:
+            lines = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        except OSError as exc:
+            raise CommandError(f'Cannot open {path}: {exc}') from exc
+
+        start = time.perf_counter()
+        with lines:
+            result = copy_ingest(decode_rows(lines), drop_indexes=options['drop_indexes'])
+        elapsed = time.perf_counter() - start
+
+        for error in result.errors:
+            self.stderr.write(f"Row {error['index']} rejected: {error['errors']}")
+        rate = result.created / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {result.created} readings in {elapsed:.2f}s ({rate:.0f} rows/s), '
+            f'{result.duplicates} duplicates skipped, {result.rejected} rows rejected.'
+        ))
@@ -0,0 +1,44 @@
+"""
+Management command maintaining the partitions of the sensor_reading table.
+"""
+
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lunasci.hydroponics import partitions
+
+class Command(BaseCommand):
+    """
+    Creates the partitions for upcoming periods ahead of time and, when a retention
+    is configured, drops the partitions holding only expired readings.
+
+    Meant to be run periodically, e.g. daily from cron.
+    """
+    help = 'Create upcoming sensor_reading partitions and drop expired ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ahead',
+            type=int,
+            default=settings.HYDROPONICS_PARTITION_AHEAD,
+            help='Number of periods after the current one to create partitions for.',
+        )
+        parser.add_argument(
+            '--retain',
+            type=int,
+            default=settings.HYDROPONICS_PARTITION_RETAIN,
+            help='Number of past periods to keep besides the current one. Nothing is dropped when omitted.',
+        )
+
+    def handle(self, *args, **options):
+        for partition in partitions.create_partitions(options['ahead']):
+            self.stdout.write(f'Created {partition.name} [{partition.start}, {partition.end})')
+
+        if options['retain'] is not None:
+            cutoff = partitions.period_start(datetime.now(dt_timezone.utc))
+            for _ in range(options['retain']):
+                cutoff = partitions.previous_period(cutoff)
+            for partition in partitions.drop_partitions(cutoff):
+                self.stdout.write(f'Dropped {partition.name} [{partition.start}, {partition.end})')
@@ -0,0 +1,43 @@
+"""
+Management command folding sensor readings into the hourly and daily rollups.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from lunasci.hydroponics import rollups
+
+class Command(BaseCommand):
+    """
+    Folds the readings ingested since the last run into the rollups,
+    or rebuilds all rollups from scratch with --rebuild.
+
+    Meant to be run periodically, e.g. every few minutes from cron.
+    """
+    help = 'Update the hourly and daily sensor reading rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Drop all rollups and recompute them, e.g. after readings were edited or deleted.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=rollups.CATCH_UP_BATCH_SIZE,
+            help='Number of reading ids processed per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['rebuild']:
+            processed = rollups.rebuild(options['batch_size'])
+        else:
+            processed = rollups.catch_up(options['batch_size'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up {processed} readings in {elapsed:.2f}s, '
+            f'watermark at reading {rollups.get_watermark()}.'
+        ))
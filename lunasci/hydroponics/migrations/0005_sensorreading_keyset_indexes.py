@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydroponics', '0004_hydroponics_hydroponics_created_7e2fcf_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='sensorreading',
+            name='sensor_read_created_d176ab_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='sensorreading',
+            name='sensor_read_hydropo_47683b_idx',
+        ),
+        migrations.AlterField(
+            model_name='sensorreading',
+            name='hydroponics',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='readings', to='hydroponics.hydroponics'),
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['created', 'id'], name='sensor_read_created_364312_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['hydroponics', 'created', 'id'], name='sensor_read_hydropo_dc08a8_idx'),
+        ),
+    ]
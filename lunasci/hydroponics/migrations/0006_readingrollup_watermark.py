@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydroponics', '0005_sensorreading_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'watermark',
+            },
+        ),
+        migrations.CreateModel(
+            name='ReadingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('ph_count', models.BigIntegerField(default=0)),
+                ('ph_sum', models.FloatField(default=0)),
+                ('ph_sum_sq', models.FloatField(default=0)),
+                ('ph_min', models.FloatField(blank=True, null=True)),
+                ('ph_max', models.FloatField(blank=True, null=True)),
+                ('temperature_count', models.BigIntegerField(default=0)),
+                ('temperature_sum', models.FloatField(default=0)),
+                ('temperature_sum_sq', models.FloatField(default=0)),
+                ('temperature_min', models.FloatField(blank=True, null=True)),
+                ('temperature_max', models.FloatField(blank=True, null=True)),
+                ('tds_count', models.BigIntegerField(default=0)),
+                ('tds_sum', models.FloatField(default=0)),
+                ('tds_sum_sq', models.FloatField(default=0)),
+                ('tds_min', models.FloatField(blank=True, null=True)),
+                ('tds_max', models.FloatField(blank=True, null=True)),
+                ('hydroponics', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='hydroponics.hydroponics')),
+            ],
+            options={
+                'db_table': 'sensor_reading_rollup',
+                'indexes': [models.Index(fields=['period', 'bucket'], name='sensor_read_period_b31953_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hydroponics', 'period', 'bucket'), name='sensor_reading_rollup_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Converts sensor_reading into a table range partitioned by created.
+#
+# PostgreSQL requires the partition key to be part of the primary key, so the primary
+# key becomes (id, created); ids keep coming from the identity sequence and stay unique.
+# Monthly partitions are created for the existing data up to two months ahead, anything
+# outside of them lands in sensor_reading_default. Further partitions are created with
+# the manage_partitions command.
+
+from django.db import migrations
+
+INDEXES = """
+ALTER TABLE sensor_reading ADD CONSTRAINT sensor_reading_hydroponics_id_390ba87a_fk_hydroponics_id
+    FOREIGN KEY (hydroponics_id) REFERENCES hydroponics (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX sensor_read_created_364312_idx ON sensor_reading (created, id);
+CREATE INDEX sensor_read_hydropo_dc08a8_idx ON sensor_reading (hydroponics_id, created, id);
+CREATE INDEX sensor_read_ph_83c560_idx ON sensor_reading (ph);
+CREATE INDEX sensor_read_tempera_26e5b3_idx ON sensor_reading (temperature);
+CREATE INDEX sensor_read_tds_29b7a1_idx ON sensor_reading (tds);
+"""
+
+COLUMNS = """
+    id bigint GENERATED BY DEFAULT AS IDENTITY,
+    created timestamp with time zone NOT NULL,
+    ph double precision NULL,
+    temperature double precision NULL,
+    tds double precision NULL,
+    hydroponics_id bigint NOT NULL
+"""
+
+COPY_ROWS = """
+INSERT INTO sensor_reading (id, created, ph, temperature, tds, hydroponics_id)
+SELECT id, created, ph, temperature, tds, hydroponics_id FROM {source};
+SELECT setval(
+    pg_get_serial_sequence('sensor_reading', 'id'),
+    coalesce((SELECT max(id) FROM sensor_reading), 0) + 1,
+    false
+);
+DROP TABLE {source};
+"""
+
+PARTITION = f"""
+ALTER TABLE sensor_reading RENAME TO sensor_reading_unpartitioned;
+ALTER SEQUENCE sensor_reading_id_seq RENAME TO sensor_reading_unpartitioned_id_seq;
+
+CREATE TABLE sensor_reading ({COLUMNS}) PARTITION BY RANGE (created);
+CREATE TABLE sensor_reading_default PARTITION OF sensor_reading DEFAULT;
+
+DO $$
+DECLARE
+    month timestamp with time zone := date_trunc(
+        'month', coalesce((SELECT min(created) FROM sensor_reading_unpartitioned), now()), 'UTC'
+    );
+BEGIN
+    WHILE month <= date_trunc('month', now(), 'UTC') + interval '2 months' LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF sensor_reading FOR VALUES FROM (%L) TO (%L)',
+            'sensor_reading_p' || to_char(month AT TIME ZONE 'UTC', 'YYYYMM'),
+            month,
+            month + interval '1 month'
+        );
+        month := month + interval '1 month';
+    END LOOP;
+END $$;
+
+{COPY_ROWS.format(source='sensor_reading_unpartitioned')}
+
+ALTER TABLE sensor_reading ADD PRIMARY KEY (id, created);
+{INDEXES}
+"""
+
+UNPARTITION = f"""
+ALTER TABLE sensor_reading RENAME TO sensor_reading_partitioned;
+ALTER TABLE sensor_reading_partitioned
+    DROP CONSTRAINT sensor_reading_hydroponics_id_390ba87a_fk_hydroponics_id;
+DROP INDEX sensor_read_created_364312_idx, sensor_read_hydropo_dc08a8_idx,
+    sensor_read_ph_83c560_idx, sensor_read_tempera_26e5b3_idx, sensor_read_tds_29b7a1_idx;
+ALTER SEQUENCE sensor_reading_id_seq RENAME TO sensor_reading_partitioned_id_seq;
+
+CREATE TABLE sensor_reading ({COLUMNS});
+
+{COPY_ROWS.format(source='sensor_reading_partitioned')}
+
+ALTER TABLE sensor_reading ADD PRIMARY KEY (id);
+{INDEXES}
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydroponics', '0006_readingrollup_watermark'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION, reverse_sql=UNPARTITION),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydroponics', '0007_partition_sensor_reading'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hydroponics',
+            name='last_reading_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            'UPDATE hydroponics SET last_reading_at = ('
+            'SELECT max(created) FROM sensor_reading WHERE hydroponics_id = hydroponics.id'
+            ')',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='hydroponics',
+            index=models.Index(fields=['last_reading_at'], name='hydroponics_last_re_307f5a_idx'),
+        ),
+    ]
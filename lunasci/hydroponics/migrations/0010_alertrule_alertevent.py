@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:50
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydroponics', '0009_hydroponics_version_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('name', models.CharField(blank=True, default='', max_length=512)),
+                ('metric', models.CharField(choices=[('ph', 'Ph'), ('temperature', 'Temperature'), ('tds', 'Tds')], max_length=16)),
+                ('comparator', models.CharField(choices=[('gt', 'Gt'), ('lt', 'Lt')], max_length=2)),
+                ('threshold', models.FloatField()),
+                ('hysteresis', models.FloatField(default=0)),
+                ('min_duration', models.DurationField(default=datetime.timedelta)),
+                ('enabled', models.BooleanField(default=True)),
+                ('state', models.CharField(choices=[('ok', 'Ok'), ('pending', 'Pending'), ('firing', 'Firing')], default='ok', editable=False, max_length=8)),
+                ('breached_since', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('hydroponics', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alert_rules', to='hydroponics.hydroponics')),
+            ],
+            options={
+                'db_table': 'alert_rule',
+            },
+        ),
+        migrations.CreateModel(
+            name='AlertEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('kind', models.CharField(choices=[('triggered', 'Triggered'), ('resolved', 'Resolved')], max_length=16)),
+                ('metric', models.CharField(choices=[('ph', 'Ph'), ('temperature', 'Temperature'), ('tds', 'Tds')], max_length=16)),
+                ('comparator', models.CharField(choices=[('gt', 'Gt'), ('lt', 'Lt')], max_length=2)),
+                ('threshold', models.FloatField()),
+                ('value', models.FloatField()),
+                ('reading_id', models.BigIntegerField()),
+                ('hydroponics', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='alert_events', to='hydroponics.hydroponics')),
+                ('rule', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='events', to='hydroponics.alertrule')),
+            ],
+            options={
+                'db_table': 'alert_event',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='alertrule',
+            constraint=models.CheckConstraint(condition=models.Q(('hysteresis__gte', 0)), name='alert_rule_hysteresis_non_negative'),
+        ),
+        migrations.AddIndex(
+            model_name='alertevent',
+            index=models.Index(fields=['created', 'id'], name='alert_event_created_e2bbca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alertevent',
+            index=models.Index(fields=['rule', 'created', 'id'], name='alert_event_rule_id_f9f0b8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alertevent',
+            index=models.Index(fields=['hydroponics', 'created', 'id'], name='alert_event_hydropo_539318_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:19
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydroponics', '0010_alertrule_alertevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hydroponics',
+            name='compacted_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='hydroponics',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydroponics', '0011_hydroponics_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensorreading',
+            name='device_seq',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='sensorreading',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddConstraint(
+            model_name='sensorreading',
+            constraint=models.UniqueConstraint(condition=models.Q(('device_seq__isnull', False)), fields=('hydroponics', 'device_seq', 'created'), name='sensor_reading_device_seq_unique'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydroponics', '0012_sensorreading_device_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('name', models.CharField(blank=True, default='', max_length=512)),
+                ('prefix', models.CharField(max_length=8)),
+                ('digest', models.CharField(editable=False, max_length=64, unique=True)),
+                ('hydroponics', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='device_keys', to='hydroponics.hydroponics')),
+            ],
+            options={
+                'db_table': 'device_key',
+            },
+        ),
+    ]
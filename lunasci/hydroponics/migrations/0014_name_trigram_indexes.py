@@ -0,0 +1,32 @@
+# Adds pg_trgm GIN indexes serving the case-insensitive substring and prefix filters on the
+# names of the hydroponics systems and on usernames, which Django compiles to
+# UPPER(column::text) LIKE UPPER(pattern). The indexes are built on the same expression.
+#
+# pg_trgm is a trusted extension, so the owner of the database may create it.
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydroponics', '0013_devicekey'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='hydroponics',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='hydroponics_name_trgm'),
+        ),
+        # auth_user belongs to django.contrib.auth, so its index is only declared here
+        migrations.RunSQL(
+            'CREATE INDEX auth_user_username_trgm ON auth_user USING gin ((UPPER(username::text)) gin_trgm_ops);',
+            'DROP INDEX auth_user_username_trgm;',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hydroponics', '0014_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='watermark',
+            name='pending_horizon',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='watermark',
+            name='pending_position',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -4,10 +4,23 @@ This module defines the data models for the hydroponics system.
 It contains:
     - Hydroponics: Represents a hydroponic system, including the owner, creation time, and name.
     - SensorReading: Represents sensor data (pH, temperature, TDS) recorded in a hydroponics system.
+    - ReadingRollup: Represents hourly or daily statistics of the sensor readings of a hydroponics system.
+    - Watermark: Represents the progress of an incremental background job.
+    - AlertRule: Represents a threshold on a sensor metric of a hydroponics system.
+    - AlertEvent: Represents an alert rule being triggered or resolved.
+    - DeviceKey: Represents an API key a device writes the sensor readings of a hydroponics system with.
 """
 
+import secrets
+from datetime import timedelta
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models.functions import Upper
 from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
 
 class Hydroponics(models.Model):
     """
@@ -17,6 +30,15 @@ class Hydroponics(models.Model):
         created (datetime): The timestamp when the hydroponic system was created.
         owner (ForeignKey): The user who owns this hydroponic system.
         name (str): A human-readable name for the hydroponic system.
+        last_reading_at (datetime): The creation timestamp of the latest sensor reading,
+            denormalized so systems can be filtered by freshness.
+        version (int): A counter incremented whenever the system or its sensor readings change,
+            used to validate HTTP conditional requests.
+        modified (datetime): The timestamp of the latest change to the system or its sensor readings.
+        retention_days (int): The number of days raw sensor readings are kept before being compacted
+            into the rollups, HYDROPONICS_RETENTION_DAYS when unset.
+        compacted_until (datetime): The start of the local day before which raw readings are compacted,
+            so the rollups of older buckets are the only record of them.
     """
     created = models.DateTimeField(auto_now_add=True)
     owner = models.ForeignKey(
@@ -25,6 +47,15 @@ class Hydroponics(models.Model):
         on_delete=models.CASCADE
     )
     name = models.CharField(max_length=512, default="Hydroponics")
+    last_reading_at = models.DateTimeField(null=True, blank=True, editable=False)
+    version = models.PositiveBigIntegerField(default=1, editable=False)
+    modified = models.DateTimeField(auto_now=True)
+    retention_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(1)],
+    )
+    compacted_until = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         """
@@ -37,31 +68,324 @@ class Hydroponics(models.Model):
         indexes = [
             models.Index(fields=["created"]),
             models.Index(fields=["owner"]),
+            models.Index(fields=["last_reading_at"]),
+            # trigram index serving the case-insensitive name filters, which compare UPPER(name) with LIKE
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="hydroponics_name_trgm"),
         ]
 
 class SensorReading(models.Model):
     """
     Represents a sensor reading taken in a hydroponic system.
 
+    Devices may number their readings, so that readings sent again after a timeout or
+    a network failure are recognized and ingested only once: a reading is unique by its
+    system, device sequence number and measurement timestamp. The timestamp is part of
+    the constraint because sensor_reading is partitioned by created, and PostgreSQL
+    requires unique constraints on partitioned tables to include the partition key.
+
     Attributes:
-        created (datetime): The timestamp when the sensor reading was recorded.
+        created (datetime): The timestamp when the sensor reading was measured,
+            defaulting to when it was received.
         hydroponics (ForeignKey): The hydroponic system to which this sensor reading belongs.
         ph (float): The pH value recorded by the sensor.
         temperature (float): The temperature recorded by the sensor.
         tds (float): The total dissolved solids recorded by the sensor.
+        device_seq (int): The sequence number the device gave the reading, if any.
     """
-    created = models.DateTimeField(auto_now_add=True)
-    hydroponics = models.ForeignKey(Hydroponics, related_name='readings', on_delete=models.CASCADE)
+    created = models.DateTimeField(default=timezone.now)
+    # covered by the (hydroponics, created, id) index, no separate foreign key index is needed
+    hydroponics = models.ForeignKey(
+        Hydroponics,
+        related_name='readings',
+        on_delete=models.CASCADE,
+        db_index=False
+    )
     ph = models.FloatField(null=True, blank=True)
     temperature = models.FloatField(null=True, blank=True)
     tds = models.FloatField(null=True, blank=True)
+    device_seq = models.BigIntegerField(null=True, blank=True)
 
     class Meta:
         db_table = 'sensor_reading'
+        constraints = [
+            # also the conflict target of INSERT ... ON CONFLICT DO NOTHING, see ingest.insert_readings
+            models.UniqueConstraint(
+                fields=["hydroponics", "device_seq", "created"],
+                condition=models.Q(device_seq__isnull=False),
+                name="sensor_reading_device_seq_unique",
+            ),
+        ]
         indexes = [
-            models.Index(fields=["created"]),
-            models.Index(fields=["hydroponics"]),
+            # keyset pagination over all readings and over the readings of one system
+            models.Index(fields=["created", "id"]),
+            models.Index(fields=["hydroponics", "created", "id"]),
             models.Index(fields=["ph"]),
             models.Index(fields=["temperature"]),
             models.Index(fields=["tds"]),
         ]
+
+class ReadingRollup(models.Model):
+    """
+    Represents the statistics of the sensor readings of a hydroponic system over an hour or a day.
+
+    Only mergeable statistics are stored, so rollups can be updated incrementally
+    and combined into larger buckets; averages and standard deviations are derived from them.
+
+    Attributes:
+        hydroponics (ForeignKey): The hydroponic system the statistics belong to.
+        period (str): The length of the bucket, either hour or day.
+        bucket (datetime): The start of the bucket, truncated in the current time zone.
+        count (int): The number of readings in the bucket.
+        <metric>_count (int): The number of readings with a value for the metric.
+        <metric>_sum (float): The sum of the metric values.
+        <metric>_sum_sq (float): The sum of the squared metric values.
+        <metric>_min (float): The smallest metric value.
+        <metric>_max (float): The largest metric value.
+    """
+    class Period(models.TextChoices):
+        HOUR = 'hour'
+        DAY = 'day'
+
+    # covered by the unique (hydroponics, period, bucket) constraint
+    hydroponics = models.ForeignKey(
+        Hydroponics,
+        related_name='rollups',
+        on_delete=models.CASCADE,
+        db_index=False
+    )
+    period = models.CharField(max_length=4, choices=Period.choices)
+    bucket = models.DateTimeField()
+    count = models.BigIntegerField(default=0)
+
+    ph_count = models.BigIntegerField(default=0)
+    ph_sum = models.FloatField(default=0)
+    ph_sum_sq = models.FloatField(default=0)
+    ph_min = models.FloatField(null=True, blank=True)
+    ph_max = models.FloatField(null=True, blank=True)
+
+    temperature_count = models.BigIntegerField(default=0)
+    temperature_sum = models.FloatField(default=0)
+    temperature_sum_sq = models.FloatField(default=0)
+    temperature_min = models.FloatField(null=True, blank=True)
+    temperature_max = models.FloatField(null=True, blank=True)
+
+    tds_count = models.BigIntegerField(default=0)
+    tds_sum = models.FloatField(default=0)
+    tds_sum_sq = models.FloatField(default=0)
+    tds_min = models.FloatField(null=True, blank=True)
+    tds_max = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'sensor_reading_rollup'
+        constraints = [
+            models.UniqueConstraint(
+                fields=["hydroponics", "period", "bucket"],
+                name="sensor_reading_rollup_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["period", "bucket"]),
+        ]
+
+class Watermark(models.Model):
+    """
+    Represents how far an incremental background job has progressed.
+
+    Attributes:
+        name (str): The unique name of the job.
+        position (int): The last processed position, e.g. the highest processed primary key.
+        pending_position (int): A position that may not be processed yet, because transactions
+            writing up to it may still be running.
+        pending_horizon (int): The transaction id below which all transactions must have ended
+            before pending_position may be processed.
+        updated (datetime): The timestamp of the last update.
+    """
+    name = models.CharField(max_length=64, unique=True)
+    position = models.BigIntegerField(default=0)
+    pending_position = models.BigIntegerField(null=True, blank=True)
+    pending_horizon = models.BigIntegerField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """
+        Returns the name of the job.
+        """
+        return self.name
+
+    class Meta:
+        db_table = 'watermark'
+
+class AlertRule(models.Model):
+    """
+    Represents a threshold on a sensor metric of a hydroponic system,
+    evaluated against every reading as it is ingested.
+
+    A rule is breached while the metric is on the wrong side of the threshold, and triggers
+    once it stayed breached for min_duration. It resolves once the metric is back past
+    the threshold by at least the hysteresis, so values hovering around the threshold
+    do not make it flap.
+
+    Attributes:
+        created (datetime): The timestamp when the rule was created.
+        hydroponics (ForeignKey): The hydroponic system the rule watches.
+        name (str): A human-readable name for the rule.
+        metric (str): The watched measurement, one of ph, temperature or tds.
+        comparator (str): Whether values above (gt) or below (lt) the threshold breach the rule.
+        threshold (float): The value the measurement is compared with.
+        hysteresis (float): How far back past the threshold the measurement must go to resolve.
+        min_duration (timedelta): How long the rule must stay breached before it triggers.
+        enabled (bool): Whether the rule is evaluated.
+        state (str): ok, pending while breached for less than min_duration, or firing.
+        breached_since (datetime): The time of the reading that started the current breach.
+    """
+    class Metric(models.TextChoices):
+        PH = 'ph'
+        TEMPERATURE = 'temperature'
+        TDS = 'tds'
+
+    class Comparator(models.TextChoices):
+        GT = 'gt'
+        LT = 'lt'
+
+    class State(models.TextChoices):
+        OK = 'ok'
+        PENDING = 'pending'
+        FIRING = 'firing'
+
+    created = models.DateTimeField(auto_now_add=True)
+    hydroponics = models.ForeignKey(
+        Hydroponics,
+        related_name='alert_rules',
+        on_delete=models.CASCADE
+    )
+    name = models.CharField(max_length=512, blank=True, default='')
+    metric = models.CharField(max_length=16, choices=Metric.choices)
+    comparator = models.CharField(max_length=2, choices=Comparator.choices)
+    threshold = models.FloatField()
+    hysteresis = models.FloatField(default=0)
+    min_duration = models.DurationField(default=timedelta)
+    enabled = models.BooleanField(default=True)
+    state = models.CharField(max_length=8, choices=State.choices, default=State.OK, editable=False)
+    breached_since = models.DateTimeField(null=True, blank=True, editable=False)
+
+    def __str__(self):
+        """
+        Returns the name of the rule, or its condition when it has none.
+        """
+        return self.name or f'{self.metric} {self.comparator} {self.threshold}'
+
+    class Meta:
+        db_table = 'alert_rule'
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(hysteresis__gte=0),
+                name='alert_rule_hysteresis_non_negative',
+            ),
+        ]
+
+class AlertEvent(models.Model):
+    """
+    Represents an alert rule being triggered or resolved by a sensor reading.
+
+    The condition of the rule is copied into the event, so past events keep
+    describing what happened after the rule is edited.
+
+    Attributes:
+        created (datetime): The creation timestamp of the reading that caused the event.
+        rule (ForeignKey): The rule that changed state.
+        hydroponics (ForeignKey): The hydroponic system of the rule.
+        kind (str): triggered or resolved.
+        metric (str): The metric of the rule at the time of the event.
+        comparator (str): The comparator of the rule at the time of the event.
+        threshold (float): The threshold of the rule at the time of the event.
+        value (float): The measured value that caused the event.
+        reading_id (int): The id of the reading that caused the event. It is not a foreign key,
+            since sensor_reading is partitioned and its primary key includes created.
+    """
+    class Kind(models.TextChoices):
+        TRIGGERED = 'triggered'
+        RESOLVED = 'resolved'
+
+    created = models.DateTimeField()
+    # covered by the (rule, created, id) index
+    rule = models.ForeignKey(
+        AlertRule,
+        related_name='events',
+        on_delete=models.CASCADE,
+        db_index=False
+    )
+    # covered by the (hydroponics, created, id) index
+    hydroponics = models.ForeignKey(
+        Hydroponics,
+        related_name='alert_events',
+        on_delete=models.CASCADE,
+        db_index=False
+    )
+    kind = models.CharField(max_length=16, choices=Kind.choices)
+    metric = models.CharField(max_length=16, choices=AlertRule.Metric.choices)
+    comparator = models.CharField(max_length=2, choices=AlertRule.Comparator.choices)
+    threshold = models.FloatField()
+    value = models.FloatField()
+    reading_id = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'alert_event'
+        indexes = [
+            models.Index(fields=["created", "id"]),
+            models.Index(fields=["rule", "created", "id"]),
+            models.Index(fields=["hydroponics", "created", "id"]),
+        ]
+
+class DeviceKey(models.Model):
+    """
+    Represents an API key a device, e.g. a sensor gateway, authenticates with to write
+    the sensor readings of a single hydroponic system, see lunasci.hydroponics.authentication.
+
+    Keys are random, so a fast keyed hash is as safe to store as a slow password hash
+    and can be checked on every reading. The key itself is only known when it is generated.
+
+    Attributes:
+        created (datetime): The timestamp when the key was generated.
+        hydroponics (ForeignKey): The hydroponic system the key may write readings of.
+        name (str): A human-readable name for the key, e.g. the device using it.
+        prefix (str): The first characters of the key, telling keys apart in listings.
+        digest (str): The HMAC-SHA256 of the key, keyed with SECRET_KEY.
+    """
+    PREFIX_LENGTH = 8
+
+    created = models.DateTimeField(auto_now_add=True)
+    hydroponics = models.ForeignKey(
+        Hydroponics,
+        related_name='device_keys',
+        on_delete=models.CASCADE
+    )
+    name = models.CharField(max_length=512, blank=True, default='')
+    prefix = models.CharField(max_length=PREFIX_LENGTH)
+    digest = models.CharField(max_length=64, unique=True, editable=False)
+
+    def __str__(self):
+        """
+        Returns the prefix of the key, followed by its name if it has one.
+        """
+        return f'{self.prefix} {self.name}'.strip()
+
+    @staticmethod
+    def hash_key(key):
+        """
+        Returns the digest of a key.
+        """
+        return salted_hmac('lunasci.hydroponics.DeviceKey', key, algorithm='sha256').hexdigest()
+
+    @classmethod
+    def generate(cls, hydroponics, name=''):
+        """
+        Creates a key for a hydroponic system, and returns the saved DeviceKey along with the key.
+        """
+        key = secrets.token_urlsafe(32)
+        device_key = cls.objects.create(
+            hydroponics=hydroponics, name=name, prefix=key[:cls.PREFIX_LENGTH], digest=cls.hash_key(key),
+        )
+        return device_key, key
+
+    class Meta:
+        db_table = 'device_key'
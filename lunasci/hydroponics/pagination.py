@@ -0,0 +1,37 @@
+"""
+This module provides custom pagination classes for the hydroponics application.
+
+It includes:
+    - CreatedCursorPagination: Keyset pagination over the creation timestamp.
+"""
+
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+class CreatedCursorPagination(CursorPagination):
+    """
+    Cursor pagination ordered by creation time, with the primary key as a tie-breaker.
+
+    Pages are fetched with a keyset condition on the first ordering field instead of
+    an OFFSET, and no total count is computed, so deep pages cost the same as the first one
+    and stay stable while new rows are being inserted.
+
+    The keyset condition compares the first ordering field with the cursor position, which
+    is never true for NULL, so viewsets only allow ordering by columns that cannot be NULL.
+
+    Clients may request up to HYDROPONICS_MAX_PAGE_SIZE rows per page with `page_size`.
+    """
+    ordering = ('created', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = settings.HYDROPONICS_MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Append the primary key to the requested ordering, so rows sharing
+        the same ordering value are always returned in the same order.
+        """
+        ordering = super().get_ordering(request, queryset, view)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            tie_breaker = '-id' if ordering[0].startswith('-') else 'id'
+            ordering = (*ordering, tie_breaker)
+        return ordering
@@ -0,0 +1,37 @@
+"""
+This module provides custom request parsers for the hydroponics application.
+
+It includes:
+    - NDJSONParser: Parses newline delimited JSON bodies into a list of objects.
+"""
+
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+class NDJSONParser(BaseParser):
+    """
+    Parses a newline delimited JSON body, one JSON document per line.
+
+    Blank lines are ignored. The result is a list of the decoded documents,
+    so views can treat it the same way as a JSON array body.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        rows = []
+        if stream is None:
+            return rows
+        for lineno, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line.decode(encoding)))
+            except ValueError as exc:
+                raise ParseError(f'NDJSON parse error on line {lineno} - {exc}') from exc
+        return rows
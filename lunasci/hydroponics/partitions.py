@@ -0,0 +1,173 @@
+"""
+This module manages the range partitions of the sensor_reading table.
+
+The table is partitioned by created, with one partition per month (or per week or day,
+see HYDROPONICS_PARTITION_INTERVAL) and a default partition catching everything else.
+Partition bounds are aligned to UTC.
+
+It contains:
+    - Partition: Describes an existing partition and its bounds.
+    - list_partitions: Lists the range partitions of the sensor_reading table.
+    - create_partition: Creates a single partition, taking over its rows from the default partition.
+    - create_partitions: Creates the partitions for the current and upcoming periods.
+    - drop_partitions: Drops the partitions holding only readings older than a cutoff.
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from lunasci.hydroponics.ingest import readings_changed
+from lunasci.hydroponics.models import SensorReading
+
+TABLE = SensorReading._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+_BOUND_RE = re.compile(r"FOR VALUES FROM \('(?P<start>[^']+)'\) TO \('(?P<end>[^']+)'\)")
+
+@dataclass(frozen=True)
+class Partition:
+    """
+    Describes a range partition of the sensor_reading table.
+
+    Attributes:
+        name (str): The name of the partition table.
+        start (datetime): The inclusive lower bound of created.
+        end (datetime): The exclusive upper bound of created.
+    """
+    name: str
+    start: datetime
+    end: datetime
+
+def period_start(moment, interval=None):
+    """
+    Return the start of the partition period containing the given moment, in UTC.
+    """
+    interval = interval or settings.HYDROPONICS_PARTITION_INTERVAL
+    moment = moment.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == 'month':
+        return moment.replace(day=1)
+    if interval == 'week':
+        return moment - timedelta(days=moment.weekday())
+    return moment
+
+def next_period(start, interval=None):
+    """
+    Return the start of the partition period following the one starting at start.
+    """
+    interval = interval or settings.HYDROPONICS_PARTITION_INTERVAL
+    if interval == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    if interval == 'week':
+        return start + timedelta(weeks=1)
+    return start + timedelta(days=1)
+
+def previous_period(start, interval=None):
+    """
+    Return the start of the partition period preceding the one starting at start.
+    """
+    return period_start(start - timedelta(seconds=1), interval)
+
+def partition_name(start, interval=None):
+    """
+    Return the name of the partition of the period starting at start.
+    """
+    interval = interval or settings.HYDROPONICS_PARTITION_INTERVAL
+    suffix = start.strftime('%Y%m') if interval == 'month' else start.strftime('%Y%m%d')
+    return f'{TABLE}_p{suffix}'
+
+def list_partitions():
+    """
+    Return the range partitions of the sensor_reading table ordered by their bounds,
+    leaving out the default partition.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [TABLE],
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_RE.match(bound)
+        if match is None:
+            continue
+        partitions.append(Partition(
+            name=name,
+            start=datetime.fromisoformat(match['start']),
+            end=datetime.fromisoformat(match['end']),
+        ))
+    return sorted(partitions, key=lambda partition: partition.start)
+
+def create_partition(start, end, name):
+    """
+    Create a partition for [start, end), moving the matching readings out of the default partition.
+    """
+    quote = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE {quote(name)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS)'
+        )
+        cursor.execute(
+            f'WITH moved AS ('
+            f'DELETE FROM {quote(DEFAULT_PARTITION)} WHERE created >= %s AND created < %s RETURNING *'
+            f') INSERT INTO {quote(name)} SELECT * FROM moved',
+            [start, end],
+        )
+        cursor.execute(
+            f'ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)',
+            [start, end],
+        )
+
+def create_partitions(ahead=None, start=None):
+    """
+    Create the missing partitions from the period containing start (now by default)
+    up to and including the period ahead periods later.
+
+    Periods overlapping an existing partition are skipped. Returns the created partitions.
+    """
+    if ahead is None:
+        ahead = settings.HYDROPONICS_PARTITION_AHEAD
+    existing = list_partitions()
+    period = period_start(start or datetime.now(dt_timezone.utc))
+    created = []
+    for _ in range(ahead + 1):
+        end = next_period(period)
+        overlaps = any(p.start < end and period < p.end for p in existing)
+        if not overlaps:
+            partition = Partition(partition_name(period), period, end)
+            create_partition(partition.start, partition.end, partition.name)
+            created.append(partition)
+        period = end
+    return created
+
+def drop_partitions(before):
+    """
+    Drop the partitions whose upper bound is not later than before, so that old readings
+    are removed without row-level deletes, and update the state derived from the readings
+    of the affected systems, see readings_changed. Returns the dropped partitions.
+    """
+    quote = connection.ops.quote_name
+    dropped = []
+    for partition in list_partitions():
+        if partition.end > before:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(partition.name)}')
+            # detached, so no reading can be added anymore
+            cursor.execute(f'SELECT DISTINCT hydroponics_id FROM {quote(partition.name)}')
+            hydroponics_ids = {row[0] for row in cursor.fetchall()}
+            cursor.execute(f'DROP TABLE {quote(partition.name)}')
+            readings_changed(hydroponics_ids)
+        dropped.append(partition)
+    return dropped
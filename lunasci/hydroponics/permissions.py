@@ -3,10 +3,17 @@ This module provides custom permission classes for the hydroponics application.
 
 It includes:
     - IsOwnerOrReadOnly: A permission class that only allows owners of an object to modify it.
+    - IsHydroponicsOwnerOrReadOnly: A permission class that only allows owners of the related
+      hydroponics system to modify an object.
+    - IsSelfOrReadOnly: A permission class that only allows users to modify their own profile.
+    - IsAuthenticatedOrDeviceOrReadOnly: A permission class that allows authenticated users to modify
+      objects, and devices to run the actions of a view open to them.
 """
 
 from rest_framework import permissions
 
+from lunasci.hydroponics.models import DeviceKey
+
 class IsOwnerOrReadOnly(permissions.BasePermission):
     """
     Custom permission to only allow owners of an object to edit it.
@@ -21,6 +28,16 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         # Write permissions are only allowed to the owner of the snippet.
         return obj.owner == request.user
 
+class IsHydroponicsOwnerOrReadOnly(permissions.BasePermission):
+    """
+    Custom permission to only allow owners of the related hydroponics system to edit an object.
+    """
+
+    def has_object_permission(self, request, view, obj):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return obj.hydroponics.owner_id == request.user.pk
+
 class IsSelfOrReadOnly(permissions.BasePermission):
     """
     Custom permission to allow:
@@ -39,4 +56,19 @@ class IsSelfOrReadOnly(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         # For detail endpoints (retrieve, update, partial_update, destroy), only allow if the object is the user.
-        return obj == request.user
\ No newline at end of file
+        return obj == request.user
+
+class IsAuthenticatedOrDeviceOrReadOnly(permissions.BasePermission):
+    """
+    Custom permission to allow:
+      - Anyone to read.
+      - Authenticated users to write.
+      - Devices authenticated with a DeviceKey to run the actions listed in the device_actions
+        of the view. Which systems they write to is up to the view, see DeviceKey.
+    """
+    def has_permission(self, request, view):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        if isinstance(request.auth, DeviceKey):
+            return view.action in getattr(view, 'device_actions', ())
+        return bool(request.user and request.user.is_authenticated)
@@ -0,0 +1,113 @@
+"""
+This module compacts old raw sensor readings into the rollups.
+
+Raw readings are kept for the retention of their system, Hydroponics.retention_days or
+HYDROPONICS_RETENTION_DAYS, counted in whole local days so that compacted ranges line up with
+the hourly and daily rollup buckets. Older readings are deleted once they have been rolled up,
+leaving the rollups as their only record, see rollups.rebuild.
+
+Readings are deleted in batches of at most batch_size, each in its own short transaction,
+selected through the (hydroponics, created, id) index and deleted by primary key, with an
+optional pause between batches to let replicas keep up. Progress is checkpointed in a Watermark
+holding the last compacted system, so an interrupted run resumes where it stopped.
+
+It contains:
+    - CompactionResult: Outcome of a compaction run.
+    - compaction_cutoff: Returns the time before which readings are compacted for a retention.
+    - compact: Compacts the expired readings of every system with a retention.
+"""
+
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from lunasci.hydroponics.ingest import readings_changed
+from lunasci.hydroponics.models import Hydroponics, SensorReading, Watermark
+from lunasci.hydroponics.rollups import get_watermark
+
+WATERMARK_NAME = 'reading_compaction'
+
+# Number of readings deleted per transaction
+COMPACTION_BATCH_SIZE = 5000
+
+@dataclass
+class CompactionResult:
+    """
+    Outcome of a compaction run.
+
+    Attributes:
+        deleted (int): The number of deleted readings.
+        batches (int): The number of delete transactions.
+        hydroponics_ids (set): The hydroponics systems that had readings deleted.
+    """
+    deleted: int = 0
+    batches: int = 0
+    hydroponics_ids: set = field(default_factory=set)
+
+def compaction_cutoff(retention_days, now=None):
+    """
+    Return the start of the local day retention_days before now,
+    before which readings are compacted.
+    """
+    day = timezone.localtime(now) - timedelta(days=retention_days)
+    return day.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _compact_system(hydroponics_id, cutoff, rolled_up, batch_size, pause, result):
+    """
+    Delete the rolled up readings of one system created before cutoff, batch by batch.
+    """
+    # recorded first, so rebuilding the rollups keeps the compacted range even if this run is interrupted
+    Hydroponics.objects.filter(pk=hydroponics_id).update(
+        compacted_until=Greatest(Coalesce('compacted_until', Value(cutoff)), Value(cutoff)),
+    )
+    expired = SensorReading.objects.filter(hydroponics_id=hydroponics_id, created__lt=cutoff, id__lte=rolled_up)
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(expired.order_by('created', 'id').values_list('id', flat=True)[:batch_size])
+            if ids:
+                deleted += expired.filter(id__in=ids).delete()[0]
+                result.batches += 1
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    if deleted:
+        result.deleted += deleted
+        result.hydroponics_ids.add(hydroponics_id)
+        readings_changed({hydroponics_id})
+
+def compact(batch_size=COMPACTION_BATCH_SIZE, pause=0, now=None):
+    """
+    Delete the rolled up readings older than the retention of their system.
+
+    Only readings up to the rollup watermark are deleted, the others are picked up by a later
+    run once rolled up. Systems are processed in id order, starting after the last system
+    compacted by an interrupted run. Returns a CompactionResult.
+    """
+    result = CompactionResult()
+    rolled_up = get_watermark()
+    if rolled_up is None:
+        return result
+    systems = Hydroponics.objects.order_by('pk')
+    if settings.HYDROPONICS_RETENTION_DAYS is None:
+        systems = systems.filter(retention_days__isnull=False)
+
+    checkpoint, _ = Watermark.objects.get_or_create(name=WATERMARK_NAME)
+    pending = [
+        *systems.filter(pk__gt=checkpoint.position).values_list('pk', 'retention_days'),
+        *systems.filter(pk__lte=checkpoint.position).values_list('pk', 'retention_days'),
+    ]
+    for hydroponics_id, retention_days in pending:
+        cutoff = compaction_cutoff(retention_days or settings.HYDROPONICS_RETENTION_DAYS, now)
+        _compact_system(hydroponics_id, cutoff, rolled_up, batch_size, pause, result)
+        Watermark.objects.filter(name=WATERMARK_NAME).update(position=hydroponics_id, updated=timezone.now())
+    # the pass is complete, the next run starts over from the first system
+    Watermark.objects.filter(name=WATERMARK_NAME).update(position=0, updated=timezone.now())
+    return result
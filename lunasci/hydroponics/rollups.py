@@ -0,0 +1,409 @@
+"""
+This module maintains the hourly and daily rollups of sensor readings and answers
+aggregation queries from them.
+
+It contains:
+    - PERIODS: The rollup period backing each aggregation bucket size.
+    - catch_up: Folds readings newer than the stored watermark into the rollups.
+    - rebuild: Recomputes the rollups from the raw readings, except for compacted ranges.
+    - refresh_buckets: Updates the rollups of the buckets of edited or deleted readings.
+    - aggregate_rollups: Computes per-bucket statistics from rollups and not yet rolled up readings.
+"""
+
+import math
+import time
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.utils import timezone
+
+from lunasci.hydroponics.aggregates import METRICS, bucket_expression
+from lunasci.hydroponics.models import Hydroponics, ReadingRollup, SensorReading, Watermark
+
+PERIODS = {
+    '1h': ReadingRollup.Period.HOUR,
+    '1d': ReadingRollup.Period.DAY,
+}
+
+WATERMARK_NAME = 'reading_rollup'
+
+# Number of reading ids folded into the rollups per transaction
+CATCH_UP_BATCH_SIZE = 100000
+
+# Seconds a waiting catch-up waits for the transactions writing the latest readings to end
+SETTLE_TIMEOUT = 60
+
+# Seconds between two checks while waiting
+SETTLE_POLL_INTERVAL = 0.05
+
+# The id the next transaction will get, and the id of the oldest running transaction
+# other than the current one, if any
+_SNAPSHOT_SQL = """
+SELECT
+    pg_snapshot_xmax(snapshot)::text::bigint,
+    (SELECT min(xid)::text::bigint FROM pg_snapshot_xip(snapshot) AS running (xid))
+FROM pg_current_snapshot() AS snapshot
+"""
+
+_UPSERT_SQL = """
+INSERT INTO {rollup} AS r (hydroponics_id, period, bucket, count, {metric_columns})
+SELECT
+    hydroponics_id,
+    %(period)s,
+    date_trunc(%(period)s, created AT TIME ZONE %(tz)s) AT TIME ZONE %(tz)s,
+    count(*),
+    {metric_selects}
+FROM {reading}
+WHERE {condition}{compaction_filter}
+GROUP BY 1, 3
+ON CONFLICT (hydroponics_id, period, bucket) DO UPDATE SET
+    count = r.count + EXCLUDED.count,
+    {metric_updates}
+"""
+
+# Readings of an id range, folded in by catch_up
+_RANGE_CONDITION = 'id > %(low)s AND id <= %(high)s'
+
+# The bucket of a timestamp in the period and time zone of the statement
+_BUCKET = 'date_trunc(%(period)s, {created} AT TIME ZONE %(tz)s) AT TIME ZONE %(tz)s'
+
+# Rolled up readings in the bucket of a timestamp, around which the created range is widened
+# by an hour for buckets spanning a daylight saving time change
+_BUCKET_CONDITION = """id <= %(high)s AND hydroponics_id = %(hydroponics)s
+    AND created >= %(created)s - ('1 ' || %(period)s)::interval - interval '1 hour'
+    AND created < %(created)s + ('1 ' || %(period)s)::interval + interval '1 hour'
+    AND """ + _BUCKET.format(created='created') + ' = ' + _BUCKET.format(created='%(created)s')
+
+# A single reading, added to a compacted bucket
+_READING_CONDITION = 'id = %(id)s'
+
+# Bucket rows are deleted before being recomputed from the raw readings
+_DELETE_BUCKET_SQL = """
+DELETE FROM {rollup}
+WHERE hydroponics_id = %(hydroponics)s AND period = %(period)s
+    AND bucket = """ + _BUCKET.format(created='%(created)s')
+
+# Subtracts a reading from a compacted bucket, whose minimum and maximum are kept
+_SUBTRACT_SQL = """
+UPDATE {rollup} SET
+    count = count - 1,
+    {metric_updates}
+WHERE hydroponics_id = %(hydroponics)s AND period = %(period)s
+    AND bucket = """ + _BUCKET.format(created='%(created)s')
+
+# Skips readings in compacted ranges, whose rollups are kept when rebuilding
+_COMPACTION_FILTER = """
+    AND NOT EXISTS (
+        SELECT 1 FROM {hydroponics} h
+        WHERE h.id = {reading}.hydroponics_id AND {reading}.created < h.compacted_until
+    )"""
+
+def _upsert_sql(skip_compacted=False, condition=_RANGE_CONDITION):
+    """
+    Build the statement adding the readings matching a condition, those of an id range by default,
+    to the rollups of one period, optionally skipping the readings in compacted ranges.
+    """
+    columns, selects, updates = [], [], []
+    for metric in METRICS:
+        columns += [f'{metric}_{name}' for name in ('count', 'sum', 'sum_sq', 'min', 'max')]
+        selects += [
+            f'count({metric})',
+            f'coalesce(sum({metric}), 0)',
+            f'coalesce(sum({metric} * {metric}), 0)',
+            f'min({metric})',
+            f'max({metric})',
+        ]
+        updates += [
+            f'{metric}_count = r.{metric}_count + EXCLUDED.{metric}_count',
+            f'{metric}_sum = r.{metric}_sum + EXCLUDED.{metric}_sum',
+            f'{metric}_sum_sq = r.{metric}_sum_sq + EXCLUDED.{metric}_sum_sq',
+            # LEAST and GREATEST ignore NULL arguments
+            f'{metric}_min = LEAST(r.{metric}_min, EXCLUDED.{metric}_min)',
+            f'{metric}_max = GREATEST(r.{metric}_max, EXCLUDED.{metric}_max)',
+        ]
+    return _UPSERT_SQL.format(
+        rollup=ReadingRollup._meta.db_table,
+        reading=SensorReading._meta.db_table,
+        metric_columns=', '.join(columns),
+        metric_selects=',\n    '.join(selects),
+        metric_updates=',\n    '.join(updates),
+        condition=condition,
+        compaction_filter=(
+            _COMPACTION_FILTER.format(
+                hydroponics=Hydroponics._meta.db_table,
+                reading=SensorReading._meta.db_table,
+            ) if skip_compacted else ''
+        ),
+    )
+
+def _snapshot():
+    """
+    Return the id the next transaction will get and the id of the oldest other running transaction.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(_SNAPSHOT_SQL)
+        return cursor.fetchone()
+
+def _settled_target(watermark, wait):
+    """
+    Return the highest reading id up to which every reading is either visible or rolled back,
+    and keep the candidate that is not settled yet on the watermark, for the next run.
+
+    Ids are drawn when a reading is inserted, not when its transaction commits, so a reading with
+    a lower id may be committed after one with a higher id. The highest visible id is therefore only
+    a candidate: it settles once no transaction that was running when it was read is running anymore,
+    i.e. once the oldest running transaction is not older than the horizon read right after it.
+    A transaction gets its id when it writes its first row, right after drawing the id of that row.
+
+    A candidate kept by an earlier run is checked first, so the rollups advance even when ingest
+    transactions always overlap. With wait, the latest candidate is waited for up to SETTLE_TIMEOUT.
+    """
+    high = SensorReading.objects.aggregate(high=Max('id'))['high'] or 0
+    horizon, oldest = _snapshot()
+    candidates = [(high, horizon)]
+    if watermark.pending_horizon is not None:
+        candidates.insert(0, (watermark.pending_position, watermark.pending_horizon))
+    target = watermark.position
+    deadline = time.monotonic() + SETTLE_TIMEOUT
+    while True:
+        while candidates and (oldest is None or oldest >= candidates[0][1]):
+            target = max(target, candidates.pop(0)[0])
+        if not candidates or not wait or time.monotonic() >= deadline:
+            break
+        time.sleep(SETTLE_POLL_INTERVAL)
+        oldest = _snapshot()[1]
+    watermark.pending_position, watermark.pending_horizon = candidates[0] if candidates else (None, None)
+    return target
+
+def _fold(target, batch_size=CATCH_UP_BATCH_SIZE, wait=True, skip_compacted=False):
+    """
+    Fold the readings with an id between the watermark and target into the rollups,
+    in id ranges of batch_size, and return the number of processed readings.
+    """
+    sql = _upsert_sql(skip_compacted)
+    tz = timezone.get_current_timezone_name()
+    processed = 0
+    while True:
+        with transaction.atomic():
+            watermarks = Watermark.objects.select_for_update(skip_locked=not wait)
+            watermark = watermarks.filter(name=WATERMARK_NAME).first()
+            if watermark is None or watermark.position >= target:
+                return processed
+            low, high = watermark.position, min(watermark.position + batch_size, target)
+            with connection.cursor() as cursor:
+                for period in PERIODS.values():
+                    cursor.execute(sql, {'period': period, 'tz': tz, 'low': low, 'high': high})
+            processed += SensorReading.objects.filter(id__gt=low, id__lte=high).count()
+            watermark.position = high
+            watermark.save(update_fields=['position', 'updated'])
+
+def catch_up(batch_size=CATCH_UP_BATCH_SIZE, wait=True, skip_compacted=False):
+    """
+    Fold the readings with an id above the watermark into the hourly and daily rollups,
+    up to the highest id below which no reading can be committed anymore, see _settled_target.
+
+    Readings are processed in id ranges of batch_size, each in its own transaction together
+    with the watermark update, so an interrupted run loses no work and counts nothing twice.
+    When wait is unset, readings of transactions still running are left to a later run,
+    and nothing is done when another catch-up holds the watermark.
+    With skip_compacted, readings in compacted ranges are left out, see rebuild.
+
+    Returns the number of processed readings.
+    """
+    Watermark.objects.get_or_create(name=WATERMARK_NAME)
+    with transaction.atomic():
+        watermarks = Watermark.objects.select_for_update(skip_locked=not wait)
+        watermark = watermarks.filter(name=WATERMARK_NAME).first()
+        if watermark is None:
+            return 0
+        target = _settled_target(watermark, wait)
+        watermark.save(update_fields=['pending_position', 'pending_horizon', 'updated'])
+    return _fold(target, batch_size, wait, skip_compacted)
+
+def rebuild(batch_size=CATCH_UP_BATCH_SIZE):
+    """
+    Drop the rollups and recompute them from the raw readings.
+
+    Only needed when readings were changed without refresh_buckets, e.g. directly in the database,
+    since catch_up only accounts for new readings.
+    The rollups of the ranges compacted by lunasci.hydroponics.retention are kept, since they
+    are the only record of those readings, so pending readings are folded in first.
+    Returns the number of processed readings.
+    """
+    catch_up(batch_size)
+    with transaction.atomic():
+        watermark, _ = Watermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+        target = watermark.position
+        ReadingRollup.objects.filter(
+            Q(hydroponics__compacted_until__isnull=True) | Q(bucket__gte=F('hydroponics__compacted_until'))
+        ).delete()
+        watermark.position = 0
+        watermark.save(update_fields=['position', 'updated'])
+    return _fold(target, batch_size, skip_compacted=True)
+
+def _subtract_sql():
+    """
+    Build the statement subtracting a reading, given as parameters, from a rollup bucket.
+    """
+    updates = []
+    for metric in METRICS:
+        updates += [
+            # typed, since NULL parameters are of unknown type
+            f'{metric}_count = {metric}_count - (%({metric})s::float8 IS NOT NULL)::int',
+            f'{metric}_sum = {metric}_sum - coalesce(%({metric})s::float8, 0)',
+            f'{metric}_sum_sq = {metric}_sum_sq - coalesce(%({metric})s::float8 ^ 2, 0)',
+        ]
+    return _SUBTRACT_SQL.format(
+        rollup=ReadingRollup._meta.db_table,
+        metric_updates=',\n    '.join(updates),
+    )
+
+def refresh_buckets(removed=(), added=()):
+    """
+    Update the hourly and daily rollups after readings were edited or deleted, in the current
+    transaction. removed holds the readings as they were, added the readings as they are now.
+
+    Readings above the watermark are not rolled up yet, catch_up folds them in as they are.
+    The buckets of the others are recomputed from the raw readings up to the watermark, except
+    for compacted buckets, which have no raw readings left: the old reading is subtracted from
+    those, keeping their minimum and maximum, and the new one is added like by catch_up.
+    The watermark stays locked until the transaction ends, so no catch-up runs meanwhile.
+    """
+    watermark = Watermark.objects.select_for_update().filter(name=WATERMARK_NAME).first()
+    if watermark is None:
+        return
+    removed = [reading for reading in removed if reading.id <= watermark.position]
+    added = [reading for reading in added if reading.id <= watermark.position]
+    if not removed and not added:
+        return
+    compacted_until = dict(
+        Hydroponics.objects
+        .filter(pk__in={reading.hydroponics_id for reading in [*removed, *added]})
+        .exclude(compacted_until=None)
+        .values_list('id', 'compacted_until')
+    )
+    rollup = ReadingRollup._meta.db_table
+    tz = timezone.get_current_timezone_name()
+    with connection.cursor() as cursor:
+        for period in PERIODS.values():
+            changes = [(reading, True) for reading in removed]
+            changes += [(reading, False) for reading in added]
+            for reading, was_removed in changes:
+                params = {
+                    'period': period, 'tz': tz, 'high': watermark.position, 'id': reading.id,
+                    'hydroponics': reading.hydroponics_id, 'created': reading.created,
+                    **{metric: getattr(reading, metric) for metric in METRICS},
+                }
+                until = compacted_until.get(reading.hydroponics_id)
+                if until is None or reading.created >= until:
+                    cursor.execute(_DELETE_BUCKET_SQL.format(rollup=rollup), params)
+                    cursor.execute(_upsert_sql(condition=_BUCKET_CONDITION), params)
+                elif was_removed:
+                    cursor.execute(_subtract_sql(), params)
+                else:
+                    cursor.execute(_upsert_sql(condition=_READING_CONDITION), params)
+
+def get_watermark():
+    """
+    Return the id of the last rolled up reading, or None if rollups were never computed.
+    """
+    return Watermark.objects.filter(name=WATERMARK_NAME).values_list('position', flat=True).first()
+
+def _merge(totals, key, count, metrics):
+    """
+    Add the mergeable statistics of one group to the running totals of its bucket.
+    """
+    total = totals.setdefault(key, {
+        'count': 0,
+        **{metric: {'count': 0, 'sum': 0.0, 'sum_sq': 0.0, 'min': None, 'max': None} for metric in METRICS},
+    })
+    total['count'] += count
+    for metric, values in metrics.items():
+        merged = total[metric]
+        merged['count'] += values['count']
+        merged['sum'] += values['sum'] or 0.0
+        merged['sum_sq'] += values['sum_sq'] or 0.0
+        for name, pick in (('min', min), ('max', max)):
+            if values[name] is not None:
+                merged[name] = values[name] if merged[name] is None else pick(merged[name], values[name])
+
+def _statistics(values):
+    """
+    Derive the statistics reported by the aggregation endpoints from mergeable ones.
+    """
+    count = values['count']
+    if not count:
+        return {'min': None, 'max': None, 'avg': None, 'stddev': None, 'count': 0}
+    avg = values['sum'] / count
+    # population standard deviation, like StdDev on the raw readings
+    variance = max(values['sum_sq'] / count - avg * avg, 0.0)
+    return {
+        'min': values['min'],
+        'max': values['max'],
+        'avg': avg,
+        'stddev': math.sqrt(variance),
+        'count': count,
+    }
+
+def aggregate_rollups(rollups, readings, bucket, watermark, per_system=False, limit=None):
+    """
+    Compute per-bucket statistics like aggregate_readings, but from rollups.
+
+    rollups is a queryset of ReadingRollup covering the requested systems and range, and readings
+    the equivalent queryset of raw readings. Readings above the watermark have not been rolled up
+    yet, so they are aggregated from the raw table and merged into the rollup buckets.
+    """
+    group_by = ['bucket', 'hydroponics'] if per_system else ['bucket']
+    sums = {'group_count': Sum('count')}
+    for metric in METRICS:
+        sums[f'{metric}_count'] = Sum(f'{metric}_count')
+        sums[f'{metric}_sum'] = Sum(f'{metric}_sum')
+        sums[f'{metric}_sum_sq'] = Sum(f'{metric}_sum_sq')
+        sums[f'{metric}_min'] = Min(f'{metric}_min')
+        sums[f'{metric}_max'] = Max(f'{metric}_max')
+    rollup_rows = (
+        rollups.filter(period=PERIODS[bucket])
+        .order_by()
+        .values(*group_by)
+        .annotate(**sums)
+        .order_by(*group_by)
+    )
+    if limit is not None:
+        rollup_rows = rollup_rows[:limit]
+
+    tail = {'group_count': Count('id')}
+    for metric in METRICS:
+        tail[f'{metric}_count'] = Count(metric)
+        tail[f'{metric}_sum'] = Sum(metric)
+        tail[f'{metric}_sum_sq'] = Sum(F(metric) * F(metric))
+        tail[f'{metric}_min'] = Min(metric)
+        tail[f'{metric}_max'] = Max(metric)
+    tail_rows = (
+        readings.filter(id__gt=watermark)
+        .order_by()
+        .values(*group_by[1:], bucket=bucket_expression(bucket))
+        .annotate(**tail)
+    )
+
+    totals = {}
+    for row in [*rollup_rows, *tail_rows]:
+        key = tuple(row[name] for name in group_by)
+        metrics = {
+            metric: {
+                name: row[f'{metric}_{name}'] for name in ('count', 'sum', 'sum_sq', 'min', 'max')
+            }
+            for metric in METRICS
+        }
+        _merge(totals, key, row['group_count'], metrics)
+
+    results = []
+    for key in sorted(totals):
+        total = totals[key]
+        result = {'bucket': timezone.localtime(key[0])}
+        if per_system:
+            result['hydroponics'] = key[1]
+        result['count'] = total['count']
+        for metric in METRICS:
+            result[metric] = _statistics(total[metric])
+        results.append(result)
+    return results[:limit] if limit is not None else results
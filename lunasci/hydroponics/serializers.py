@@ -5,16 +5,83 @@ It provides serializers for:
     - User: Serializing Django user instances.
     - Hydroponics: Serializing hydroponics system instances.
     - SensorReading: Serializing sensor reading instances.
+    - SensorReadingRow: Serializing sensor reading value rows on the list endpoint's fast path.
+    - LatestReading: Serializing cached snapshots of the latest sensor reading of a system.
+    - SensorReadingBulk: Validating rows submitted to the bulk ingest endpoints.
+    - AlertRule: Serializing alert rules of hydroponics systems.
+    - AlertEvent: Serializing the events recorded when alert rules trigger or resolve.
 """
+from datetime import timedelta
+from functools import cached_property, lru_cache
+from urllib.parse import urlparse
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.urls import Resolver404, resolve
+from django.utils import timezone
 
-from rest_framework import serializers
+from rest_framework import ISO_8601, serializers
 from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 
-from lunasci.hydroponics.models import Hydroponics, SensorReading
+from lunasci.hydroponics.cache import get_latest, reading_snapshot
+from lunasci.hydroponics.models import AlertEvent, AlertRule, Hydroponics, SensorReading
 
 User = get_user_model()
 
+# How far ahead of the server clock a measurement timestamp may be, to allow for device clock drift
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+def validate_measurement(attrs, instance=None):
+    """
+    Validate the measurement timestamp and device sequence number of a sensor reading.
+
+    Timestamps must not be in the future, and numbered readings must carry their timestamp,
+    which tells a reading sent again apart from a new one, see SensorReading.
+    """
+    created = attrs.get('created')
+    if created is not None and created > timezone.now() + MAX_CLOCK_SKEW:
+        raise serializers.ValidationError({'created': ['Measurement timestamps cannot be in the future.']})
+    if attrs.get('device_seq') is not None and created is None and instance is None:
+        raise serializers.ValidationError({'created': ['This field is required with device_seq.']})
+
+class DetailUrlTemplate:
+    """
+    Builds hyperlinks to a detail view by substituting primary keys into a URL
+    reversed once, instead of resolving the URL pattern for every instance.
+
+    Attributes:
+        prefix (str): The part of the URL preceding the primary key.
+        suffix (str): The part of the URL following the primary key.
+    """
+    # Reversed in place of a real primary key and split on afterwards
+    PLACEHOLDER = 918273645546372819
+
+    def __init__(self, view_name, request=None):
+        url = reverse(view_name, kwargs={'pk': self.PLACEHOLDER}, request=request)
+        self.prefix, _, self.suffix = url.rpartition(str(self.PLACEHOLDER))
+
+    def __call__(self, pk):
+        return f'{self.prefix}{pk}{self.suffix}'
+
+class LatestReadingSerializer(serializers.Serializer):
+    """
+    Serializer for snapshots of the latest sensor reading of a hydroponics system,
+    as stored in the latest reading cache.
+    """
+    url = serializers.SerializerMethodField()
+    id = serializers.IntegerField()
+    created = serializers.DateTimeField()
+    ph = serializers.FloatField(allow_null=True)
+    temperature = serializers.FloatField(allow_null=True)
+    tds = serializers.FloatField(allow_null=True)
+
+    def get_url(self, obj):
+        """
+        Build the hyperlink to the sensor reading detail view.
+        """
+        return reverse('sensorreading-detail', kwargs={'pk': obj['id']}, request=self.context.get('request'))
+
 class HydroponicsSerializer(serializers.HyperlinkedModelSerializer):
     """
     Serializer for the Hydroponics model.
@@ -23,27 +90,53 @@ class HydroponicsSerializer(serializers.HyperlinkedModelSerializer):
         - The detail view URL.
         - Instance ID, creation timestamp, and name.
         - The username of the owner.
+        - The timestamp and values of the latest sensor reading.
         - A list of hyperlinks to the latest sensor readings.
+        - The retention of raw sensor readings and the time before which they were compacted.
     """
     owner = serializers.ReadOnlyField(source='owner.username')
+    latest_reading = serializers.SerializerMethodField()
     sensor_readings = serializers.SerializerMethodField()
 
+    def get_latest_reading(self, obj):
+        """
+        Retrieve the latest sensor reading, from the readings prefetched by the viewset
+        when available and from the latest reading cache otherwise.
+        """
+        latest_readings = getattr(obj, 'latest_readings', None)
+        if latest_readings is not None:
+            snapshot = reading_snapshot(latest_readings[0]) if latest_readings else None
+        else:
+            snapshot = get_latest(obj.pk)
+        if snapshot is None:
+            return None
+        return LatestReadingSerializer(snapshot, context=self.context).data
+
+    @cached_property
+    def _reading_url(self):
+        return DetailUrlTemplate('sensorreading-detail', self.context.get('request'))
+
     def get_sensor_readings(self, obj):
         """
         Retrieve hyperlinks for the latest sensor readings associated with the Hydroponics instance.
         """
-        request = self.context.get('request')
-        # Limit the sensor readings to the first 10
-        sensor_readings = obj.readings.all().order_by('-created')[:10]
+        limit = self.context.get('readings_limit', settings.HYDROPONICS_READINGS_LIMIT)
+        # Use the readings prefetched by the view when available
+        sensor_readings = getattr(obj, 'latest_readings', None)
+        if sensor_readings is not None:
+            sensor_readings = sensor_readings[:limit]
+        else:
+            sensor_readings = obj.readings.all().order_by('-created', '-id')[:limit]
         # Return a list of hyperlinks to the sensor reading detail views
-        return [
-            reverse('sensorreading-detail', kwargs={'pk': reading.pk}, request=request)
-            for reading in sensor_readings
-        ]
+        return [self._reading_url(reading.pk) for reading in sensor_readings]
 
     class Meta:
         model = Hydroponics
-        fields = ['url', 'id', 'created', 'name', 'owner', 'sensor_readings']
+        fields = [
+            'url', 'id', 'created', 'name', 'owner',
+            'last_reading_at', 'latest_reading', 'sensor_readings',
+            'retention_days', 'compacted_until',
+        ]
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
     """
@@ -70,9 +163,205 @@ class SensorReadingSerializer(serializers.HyperlinkedModelSerializer):
 
     This serializer converts SensorReading instances into a JSON representation including:
         - The detail view URL.
-        - Instance ID, creation timestamp, and associated hydroponics instance.
+        - Instance ID, measurement timestamp, and associated hydroponics instance.
         - Sensor measurements: pH, temperature, and total dissolved solids (TDS).
+        - The sequence number given to the reading by its device.
+    The timestamp defaults to the time the reading is received. Creating a reading that
+    is already stored under the same device sequence number is handled by the viewset.
     """
+    device_seq = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+
+    def validate(self, attrs):
+        validate_measurement(attrs, self.instance)
+        device_seq = attrs.get('device_seq', getattr(self.instance, 'device_seq', None))
+        if self.instance is not None and device_seq is not None:
+            hydroponics = attrs.get('hydroponics')
+            duplicates = SensorReading.objects.filter(
+                hydroponics_id=self.instance.hydroponics_id if hydroponics is None else hydroponics.pk,
+                device_seq=device_seq,
+                created=attrs.get('created', self.instance.created),
+            )
+            if duplicates.exclude(pk=self.instance.pk).exists():
+                raise serializers.ValidationError(
+                    'A reading with this hydroponics, device_seq and created already exists.'
+                )
+        return attrs
+
     class Meta:
         model = SensorReading
-        fields = ['url', 'id', 'created', 'hydroponics', 'ph', 'temperature', 'tds']
+        fields = ['url', 'id', 'created', 'hydroponics', 'ph', 'temperature', 'tds', 'device_seq']
+        # duplicates are checked in validate, and skipped on creation instead of being rejected
+        validators = []
+
+class SensorReadingRowSerializer(serializers.BaseSerializer):
+    """
+    Read-only serializer producing the same representation as SensorReadingSerializer
+    from value rows, as returned by SensorReading.objects.values(*ROW_FIELDS).
+
+    Hyperlinks are built with DetailUrlTemplate and timestamps are formatted directly,
+    which skips the per-field machinery of ModelSerializer on large list pages.
+    """
+    ROW_FIELDS = ('id', 'created', 'hydroponics', 'ph', 'temperature', 'tds', 'device_seq')
+
+    @cached_property
+    def _reading_url(self):
+        return DetailUrlTemplate('sensorreading-detail', self.context.get('request'))
+
+    @cached_property
+    def _hydroponics_url(self):
+        return DetailUrlTemplate('hydroponics-detail', self.context.get('request'))
+
+    @cached_property
+    def _format_datetime(self):
+        """
+        Return a function formatting timestamps like serializers.DateTimeField.
+        """
+        field = serializers.DateTimeField()
+        output_format = api_settings.DATETIME_FORMAT
+        tz = field.default_timezone()
+        if output_format is None or output_format.lower() != ISO_8601 or tz is None:
+            return field.to_representation
+
+        def format_datetime(value):
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return format_datetime
+
+    def to_representation(self, row):
+        ph, temperature, tds = row['ph'], row['temperature'], row['tds']
+        return {
+            'url': self._reading_url(row['id']),
+            'id': row['id'],
+            'created': self._format_datetime(row['created']),
+            'hydroponics': self._hydroponics_url(row['hydroponics']),
+            'ph': None if ph is None else float(ph),
+            'temperature': None if temperature is None else float(temperature),
+            'tds': None if tds is None else float(tds),
+            'device_seq': row['device_seq'],
+        }
+
+
+@lru_cache(maxsize=1024)
+def _resolve_hydroponics_path(path):
+    """
+    Resolve a hydroponics detail path to its primary key, or None if the path
+    does not point at a hydroponics instance.
+    """
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None
+    if match.url_name != 'hydroponics-detail':
+        return None
+    try:
+        return int(match.kwargs['pk'])
+    except ValueError:
+        return None
+
+class HydroponicsReferenceField(serializers.Field):
+    """
+    Accepts a hydroponics instance either as a primary key or as a hyperlink
+    and returns the primary key, without loading the instance from the database.
+
+    Existence of the referenced instance has to be checked by the caller,
+    which lets a whole batch be checked with a single query.
+    """
+    default_error_messages = {
+        'invalid': 'Expected a hydroponics id or hyperlink.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('invalid')
+        if isinstance(data, int):
+            return data
+        if isinstance(data, str):
+            if data.isascii() and data.isdigit():
+                return int(data)
+            try:
+                path = urlparse(data).path
+            except ValueError:
+                self.fail('invalid')
+            pk = _resolve_hydroponics_path(path)
+            if pk is not None:
+                return pk
+        self.fail('invalid')
+
+    def to_representation(self, value):
+        return value
+
+class SensorReadingBulkSerializer(serializers.Serializer):
+    """
+    Serializer for a single row of a bulk or streamed COPY sensor reading upload.
+
+    A single instance is reused to validate every row of a batch,
+    so field instances are only built once per request.
+    Rows may carry their measurement timestamp, e.g. when a device flushes its backlog
+    or historical data is backfilled, and a device sequence number, see SensorReading.
+    """
+    hydroponics = HydroponicsReferenceField()
+    created = serializers.DateTimeField(required=False)
+    ph = serializers.FloatField(required=False, allow_null=True)
+    temperature = serializers.FloatField(required=False, allow_null=True)
+    tds = serializers.FloatField(required=False, allow_null=True)
+    device_seq = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+
+    def validate(self, attrs):
+        validate_measurement(attrs)
+        return attrs
+
+class AlertRuleSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    Serializer for the AlertRule model.
+
+    This serializer converts AlertRule instances into a JSON representation including:
+        - The detail view URL.
+        - Instance ID, creation timestamp, name and associated hydroponics instance.
+        - The condition: metric, comparator, threshold, hysteresis and minimum duration.
+        - Whether the rule is enabled, and its current state.
+    Rules can only be attached to hydroponics instances owned by the requesting user.
+    """
+
+    def validate_hydroponics(self, value):
+        request = self.context.get('request')
+        if request is not None and value.owner_id != request.user.pk:
+            raise serializers.ValidationError('Alert rules can only be added to your own hydroponics systems.')
+        return value
+
+    def validate_hysteresis(self, value):
+        if value < 0:
+            raise serializers.ValidationError('Ensure this value is greater than or equal to 0.')
+        return value
+
+    class Meta:
+        model = AlertRule
+        fields = [
+            'url', 'id', 'created', 'hydroponics', 'name', 'metric', 'comparator',
+            'threshold', 'hysteresis', 'min_duration', 'enabled', 'state', 'breached_since',
+        ]
+
+class AlertEventSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    Serializer for the AlertEvent model.
+
+    This serializer converts AlertEvent instances into a JSON representation including:
+        - The detail view URL.
+        - Instance ID, the creation timestamp of the causing reading, and the kind of event.
+        - Hyperlinks to the rule, the hydroponics instance and the sensor reading.
+        - The condition of the rule at the time of the event and the measured value.
+    """
+    reading = serializers.SerializerMethodField()
+
+    @cached_property
+    def _reading_url(self):
+        return DetailUrlTemplate('sensorreading-detail', self.context.get('request'))
+
+    def get_reading(self, obj):
+        return self._reading_url(obj.reading_id)
+
+    class Meta:
+        model = AlertEvent
+        fields = [
+            'url', 'id', 'created', 'kind', 'rule', 'hydroponics', 'reading',
+            'metric', 'comparator', 'threshold', 'value',
+        ]
@@ -0,0 +1,23 @@
+"""
+This module keeps state derived from the models up to date when instances are deleted
+outside of the viewsets, e.g. by cascades from the deletion of their owner.
+
+It contains:
+    - hydroponics_deleted: Drops the cached latest reading of deleted hydroponics systems.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from lunasci.hydroponics.cache import invalidate_latest
+from lunasci.hydroponics.models import Hydroponics
+
+@receiver(post_delete, sender=Hydroponics)
+def hydroponics_deleted(sender, instance, using, **kwargs):
+    """
+    Drop the cached latest reading of a deleted hydroponics system once the deletion commits,
+    however it was deleted, so the latest endpoint stops serving it.
+    """
+    hydroponics_id = instance.pk
+    transaction.on_commit(lambda: invalidate_latest([hydroponics_id]), using=using)
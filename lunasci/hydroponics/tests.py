@@ -1,9 +1,46 @@
+import asyncio
+import csv
+import json
+import math
+import pstats
+import re
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from pathlib import Path
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest.mock import patch
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
 from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+
+from lunasci import instrumentation, routers
 
-from lunasci.hydroponics.models import Hydroponics, SensorReading
+from lunasci.hydroponics import (
+    alerts, analysis, authentication, benchmarks, budgets, cache as latest_cache, downsample, live, partitions,
+    retention, rollups, views,
+)
+from lunasci.hydroponics.export import iter_binary_blocks
+from lunasci.hydroponics.fleet import FleetSpec, generate_fleet
+from lunasci.hydroponics.models import (
+    AlertEvent, AlertRule, DeviceKey, Hydroponics, ReadingRollup, SensorReading,
+)
+from lunasci.hydroponics.serializers import SensorReadingSerializer
+from lunasci.hydroponics.views import HydroponicsFilter, SensorReadingFilter, UserFilter
 
 User = get_user_model()
 
@@ -44,6 +81,36 @@ class HydroponicsAPITests(APITestCase):
         self.hydro1.refresh_from_db()
         self.assertEqual(self.hydro1.name, 'Updated System')
 
+    def test_list_hydroponics_query_count(self):
+        url = reverse('hydroponics-list')
+        for page_size in (1, 10):
+            Hydroponics.objects.exclude(pk=self.hydro1.pk).delete()
+            for index in range(page_size - 1):
+                hydro = Hydroponics.objects.create(owner=self.user2, name=f'System {index}')
+                SensorReading.objects.bulk_create(
+                    SensorReading(hydroponics=hydro, ph=6.0) for _ in range(15)
+                )
+            # ETag validators, hydroponics with their owners, latest readings
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_list_hydroponics_readings_limit(self):
+        readings = SensorReading.objects.bulk_create(
+            SensorReading(hydroponics=self.hydro1, ph=6.0) for _ in range(5)
+        )
+        url = reverse('hydroponics-list')
+        response = self.client.get(url, {'readings_limit': 3})
+        sensor_readings = response.data['results'][0]['sensor_readings']
+        self.assertEqual(len(sensor_readings), 3)
+        self.assertTrue(sensor_readings[0].endswith(f'/sensor_readings/{readings[-1].pk}/'))
+        response = self.client.get(url, {'readings_limit': 'many'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # only read by list and retrieve
+        self.client.login(username='testuser1', password='pass123')
+        response = self.client.post(url + '?readings_limit=many', {'name': 'Another System'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
     def test_update_hydroponics_non_owner(self):
         url = reverse('hydroponics-detail', kwargs={'pk': self.hydro1.pk})
         self.client.login(username='testuser2', password='pass123')
@@ -52,6 +119,65 @@ class HydroponicsAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class NameFilterTests(APITestCase):
+    def setUp(self):
+        self.grower = User.objects.create_user(username='greengrower', password='pass123')
+        self.other = User.objects.create_user(username='someoneelse', password='pass123')
+        self.lettuce = Hydroponics.objects.create(owner=self.grower, name='Lettuce Tower')
+        self.basil = Hydroponics.objects.create(owner=self.grower, name='Basil Tower')
+        self.tomato = Hydroponics.objects.create(owner=self.other, name='Tomato Bed')
+        for hydro in (self.lettuce, self.basil, self.tomato):
+            SensorReading.objects.create(hydroponics=hydro, ph=6.0)
+
+    def explain(self, queryset):
+        with connection.cursor() as cursor:
+            # the tables are tiny, only an unusable index would make a sequential scan necessary,
+            # and plain index scans would walk the primary keys and filter the rows instead
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_indexscan = off')
+        return queryset.explain()
+
+    def test_trigram_indexes_are_used(self):
+        for queryset, index in [
+            (HydroponicsFilter({'name__icontains': 'ettuc'}).qs, 'hydroponics_name_trgm'),
+            (HydroponicsFilter({'name__istartswith': 'lettu'}).qs, 'hydroponics_name_trgm'),
+            # owner__username__icontains joins the users filtered like this
+            (User.objects.filter(username__icontains='grower'), 'auth_user_username_trgm'),
+            (UserFilter({'username__istartswith': 'green'}, queryset=User.objects.all()).qs, 'auth_user_username_trgm'),
+        ]:
+            with self.subTest(query=str(queryset.query)):
+                self.assertIn(index, self.explain(queryset))
+        filterset = HydroponicsFilter({'owner__username__icontains': 'grower'})
+        self.assertEqual(set(filterset.qs), {self.lettuce, self.basil})
+
+    def test_reading_name_filters_resolve_ids(self):
+        readings = SensorReading.objects.all()
+        filterset = SensorReadingFilter({'hydroponics__name__icontains': 'tower'}, queryset=readings)
+        with CaptureQueriesContext(connection) as queries:
+            found = list(filterset.qs)
+        self.assertEqual({reading.hydroponics_id for reading in found}, {self.lettuce.pk, self.basil.pk})
+        _, select = queries.captured_queries
+        self.assertIn('hydroponics_name_trgm', self.explain(Hydroponics.objects.filter(name__icontains='tower')))
+        self.assertNotIn('JOIN', select['sql'])
+        self.assertIn('"sensor_reading"."hydroponics_id" IN', select['sql'])
+
+        filterset = SensorReadingFilter({'hydroponics__name': 'Tomato Bed'}, queryset=readings)
+        self.assertEqual([reading.hydroponics_id for reading in filterset.qs], [self.tomato.pk])
+        filterset = SensorReadingFilter({'hydroponics__name__icontains': 'nothing'}, queryset=readings)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(filterset.qs), [])
+
+    def test_reading_name_filter_with_many_systems(self):
+        readings = SensorReading.objects.all()
+        with patch.object(views.HydroponicsNameFilter, 'max_ids', 1):
+            filterset = SensorReadingFilter({'hydroponics__name__istartswith': 'lettuce'}, queryset=readings)
+            self.assertEqual([reading.hydroponics_id for reading in filterset.qs], [self.lettuce.pk])
+            filterset = SensorReadingFilter({'hydroponics__name__icontains': 'tower'}, queryset=readings)
+            with self.assertNumQueries(2):
+                self.assertEqual(filterset.qs.count(), 2)
+            self.assertIn('SELECT', str(filterset.qs.query).partition('IN')[2])
+
+
 class SensorReadingAPITests(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='pass123')
@@ -65,6 +191,60 @@ class SensorReadingAPITests(APITestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_sensor_readings_cursor_pagination(self):
+        SensorReading.objects.bulk_create(
+            SensorReading(hydroponics=self.hydro, ph=6.0) for _ in range(24)
+        )
+        url = reverse('sensorreading-list')
+        response = self.client.get(url, {'page_size': 20})
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertNotIn('count', response.data)
+        # rows inserted between requests must not shift the next page
+        SensorReading.objects.create(hydroponics=self.hydro, ph=7.0)
+        seen = [reading['id'] for reading in response.data['results']]
+        # ETag validators and the page itself
+        with self.assertNumQueries(2):
+            response = self.client.get(response.data['next'])
+        seen += [reading['id'] for reading in response.data['results']]
+        self.assertEqual(seen, list(
+            SensorReading.objects.order_by('created', 'id').values_list('id', flat=True)
+        ))
+
+    def test_list_pages_with_null_values(self):
+        SensorReading.objects.bulk_create(
+            SensorReading(hydroponics=self.hydro, ph=None if index % 2 else 6.0 + index) for index in range(5)
+        )
+        Hydroponics.objects.create(owner=self.user, name='Idle System')
+        for url, expected in (
+            (reverse('sensorreading-list'), set(SensorReading.objects.values_list('id', flat=True))),
+            (reverse('hydroponics-list'), set(Hydroponics.objects.values_list('id', flat=True))),
+        ):
+            for ordering in ('ph', '-ph', 'last_reading_at', '-last_reading_at', '-created', 'name'):
+                seen = []
+                page = self.client.get(url, {'ordering': ordering, 'page_size': 2}).data
+                seen += [item['id'] for item in page['results']]
+                while page['next']:
+                    page = self.client.get(page['next']).data
+                    seen += [item['id'] for item in page['results']]
+                self.assertEqual(len(seen), len(expected), (url, ordering))
+                self.assertEqual(set(seen), expected)
+
+    def test_list_matches_model_serializer(self):
+        SensorReading.objects.create(hydroponics=self.hydro, ph=None, temperature=19, tds=None)
+        response = self.client.get(reverse('sensorreading-list'), {'ordering': '-created'})
+        expected = SensorReadingSerializer(
+            SensorReading.objects.order_by('-created', '-id'),
+            many=True,
+            context={'request': response.wsgi_request},
+        ).data
+        self.assertEqual(response.json()['results'], json.loads(JSONRenderer().render(expected)))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark', 'serialize_readings', rows=20, repeat=1, stdout=out)
+        self.assertIn('SensorReadingRowSerializer', out.getvalue())
+        self.assertEqual(SensorReading.objects.count(), 1)
+
     def test_create_sensor_reading_authenticated(self):
         self.client.login(username='testuser', password='pass123')
         url = reverse('sensorreading-list')
@@ -99,6 +279,1286 @@ class SensorReadingAPITests(APITestCase):
         self.assertEqual(float(self.reading.ph), 6.8)
 
 
+class SensorReadingBulkAPITests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro1 = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.hydro2 = Hydroponics.objects.create(owner=self.user, name='System 2')
+        self.url = reverse('sensorreading-bulk')
+
+    def test_bulk_create_json(self):
+        self.client.login(username='testuser', password='pass123')
+        data = [
+            {'hydroponics': self.hydro1.pk, 'ph': 6.1, 'temperature': 21.0, 'tds': 500},
+            {'hydroponics': reverse('hydroponics-detail', kwargs={'pk': self.hydro2.pk}), 'ph': 5.9},
+        ]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 2, 'duplicates': 0, 'errors': []})
+        self.assertEqual(self.hydro1.readings.count(), 1)
+        self.assertEqual(self.hydro2.readings.get().ph, 5.9)
+
+    def test_bulk_create_ndjson(self):
+        self.client.login(username='testuser', password='pass123')
+        body = (
+            f'{{"hydroponics": {self.hydro1.pk}, "ph": 6.0}}\n'
+            '\n'
+            f'{{"hydroponics": {self.hydro2.pk}, "tds": 420}}\n'
+        )
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(SensorReading.objects.count(), 2)
+
+    def test_bulk_create_partial_failure(self):
+        self.client.login(username='testuser', password='pass123')
+        data = [
+            {'hydroponics': self.hydro1.pk, 'ph': 6.1},
+            {'hydroponics': self.hydro1.pk, 'ph': 'acidic'},
+            {'hydroponics': 999999, 'ph': 6.2},
+            {'hydroponics': self.hydro2.pk, 'ph': 6.3},
+        ]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('ph', response.data['errors'][0]['errors'])
+        self.assertIn('hydroponics', response.data['errors'][1]['errors'])
+        self.assertEqual(SensorReading.objects.count(), 2)
+
+    def test_bulk_create_invalid_references(self):
+        self.client.login(username='testuser', password='pass123')
+        data = [
+            {'hydroponics': '/hydroponics/abc/', 'ph': 6.1},
+            {'hydroponics': '²', 'ph': 6.2},
+            {'hydroponics': self.hydro1.pk, 'ph': 6.3},
+        ]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [0, 1])
+        for error in response.data['errors']:
+            self.assertEqual(error['errors']['hydroponics'][0].code, 'invalid')
+
+        body = 'hydroponics,ph\n/hydroponics/abc/,6.1\n²,6.2\n'
+        response = self.client.post(self.url + '?mode=copy', body.encode(), content_type='text/csv')
+        self.assertEqual(response.data['rejected'], 2)
+
+    def test_bulk_create_single_insert_query(self):
+        self.client.login(username='testuser', password='pass123')
+        data = [{'hydroponics': self.hydro1.pk, 'ph': 6.0} for _ in range(50)]
+        # alert rules are only reloaded every HYDROPONICS_ALERT_RULES_TTL seconds
+        alerts.invalidate_rule_index()
+        alerts.get_rule_index()
+        # session, user, existence check, savepoint pair, a single INSERT
+        # and the last_reading_at UPDATE
+        with self.assertNumQueries(7):
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_create_unauthenticated(self):
+        data = [{'hydroponics': self.hydro1.pk, 'ph': 6.0}]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SensorReadingCopyTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+
+    def test_copy_upload_csv(self):
+        self.client.login(username='testuser', password='pass123')
+        body = (
+            'hydroponics,ph,temperature,tds,created\n'
+            f'{self.hydro.pk},6.1,21.5,500,2024-01-01T12:00:00Z\n'
+            f'{self.hydro.pk},,22.0,,\n'
+            f'{self.hydro.pk},not-a-number,22.0,510,\n'
+        )
+        url = reverse('sensorreading-bulk') + '?mode=copy'
+        response = self.client.post(url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['rejected'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 2)
+        backfilled = self.hydro.readings.get(ph=6.1)
+        self.assertEqual(backfilled.created.year, 2024)
+        self.assertIsNone(self.hydro.readings.get(ph__isnull=True).tds)
+
+    def test_copy_upload_unsupported_media_type(self):
+        self.client.login(username='testuser', password='pass123')
+        url = reverse('sensorreading-bulk') + '?mode=copy'
+        response = self.client.post(url, [], format='json')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_load_readings_command(self):
+        with NamedTemporaryFile('w', suffix='.ndjson') as source:
+            for value in range(5):
+                source.write(f'{{"hydroponics": {self.hydro.pk}, "ph": {value}}}\n')
+            source.write('{broken\n')
+            source.flush()
+            out, err = StringIO(), StringIO()
+            call_command('load_readings', source.name, '--drop-indexes', stdout=out, stderr=err)
+        self.assertEqual(self.hydro.readings.count(), 5)
+        self.assertIn('Loaded 5 readings', out.getvalue())
+        self.assertIn('Row 5 rejected', err.getvalue())
+
+
+class IdempotentIngestTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.other = Hydroponics.objects.create(owner=self.user, name='System 2')
+        self.client.login(username='testuser', password='pass123')
+        self.measured = timezone.now() - timedelta(hours=1)
+
+    def rows(self, hydro, count):
+        return [
+            {
+                'hydroponics': hydro.pk,
+                'device_seq': seq,
+                'created': (self.measured + timedelta(minutes=seq)).isoformat(),
+                'ph': 6.0,
+            }
+            for seq in range(count)
+        ]
+
+    def test_bulk_retry_skips_duplicates(self):
+        url = reverse('sensorreading-bulk')
+        response = self.client.post(url, self.rows(self.hydro, 3), format='json')
+        self.assertEqual(response.data, {'created': 3, 'duplicates': 0, 'errors': []})
+        version = Hydroponics.objects.get(pk=self.hydro.pk).version
+
+        # the retry overlaps the first batch and repeats a reading within itself
+        rows = self.rows(self.hydro, 4)
+        rows += rows[-1:] + self.rows(self.other, 1)
+        response = self.client.post(url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 2, 'duplicates': 4, 'errors': []})
+        self.assertEqual(self.hydro.readings.count(), 4)
+        self.assertEqual(self.other.readings.count(), 1)
+        self.hydro.refresh_from_db()
+        self.assertEqual(self.hydro.version, version + 1)
+        self.assertEqual(self.hydro.last_reading_at, self.measured + timedelta(minutes=3))
+
+        response = self.client.post(url, self.rows(self.hydro, 2), format='json')
+        self.assertEqual(response.data, {'created': 0, 'duplicates': 2, 'errors': []})
+        self.assertEqual(Hydroponics.objects.get(pk=self.hydro.pk).version, version + 1)
+
+    def test_same_sequence_number_at_another_time(self):
+        url = reverse('sensorreading-bulk')
+        self.client.post(url, self.rows(self.hydro, 1), format='json')
+        # a device restarting its sequence produces new readings
+        row = {**self.rows(self.hydro, 1)[0], 'created': timezone.now().isoformat()}
+        response = self.client.post(url, [row, {'hydroponics': self.hydro.pk, 'ph': 6.0}], format='json')
+        self.assertEqual(response.data, {'created': 2, 'duplicates': 0, 'errors': []})
+
+    def test_create_retry_returns_stored_reading(self):
+        url = reverse('sensorreading-list')
+        data = {
+            'hydroponics': reverse('hydroponics-detail', kwargs={'pk': self.hydro.pk}),
+            'device_seq': 7,
+            'created': self.measured.isoformat(),
+            'ph': 6.2,
+        }
+        first = self.client.post(url, data, format='json')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        retry = self.client.post(url, {**data, 'ph': 6.3}, format='json')
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(retry.data['ph'], 6.2)
+        self.assertEqual(self.hydro.readings.get().created, self.measured)
+
+    def test_update_to_a_stored_reading_is_rejected(self):
+        self.client.post(reverse('sensorreading-bulk'), self.rows(self.hydro, 2), format='json')
+        reading = self.hydro.readings.get(device_seq=1)
+        response = self.client.patch(
+            reverse('sensorreading-detail', kwargs={'pk': reading.pk}),
+            {'device_seq': 0, 'created': self.measured.isoformat()},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_measurements(self):
+        rows = [
+            {'hydroponics': self.hydro.pk, 'device_seq': 1},
+            {'hydroponics': self.hydro.pk, 'created': (timezone.now() + timedelta(hours=1)).isoformat()},
+            {'hydroponics': self.hydro.pk, 'device_seq': -1, 'created': self.measured.isoformat()},
+        ]
+        response = self.client.post(reverse('sensorreading-bulk'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['index'] for error in response.data['errors']], [0, 1, 2])
+        self.assertIn('created', response.data['errors'][0]['errors'])
+        self.assertIn('created', response.data['errors'][1]['errors'])
+        self.assertIn('device_seq', response.data['errors'][2]['errors'])
+
+    def test_copy_retry_skips_duplicates(self):
+        body = 'hydroponics,device_seq,created,ph\n' + ''.join(
+            f'{self.hydro.pk},{seq},{(self.measured + timedelta(minutes=seq)).isoformat()},6.0\n'
+            for seq in range(3)
+        )
+        url = reverse('sensorreading-bulk') + '?mode=copy'
+        response = self.client.post(url, body, content_type='text/csv')
+        self.assertEqual((response.data['created'], response.data['duplicates']), (3, 0))
+        body += f'{self.hydro.pk},,,6.5\n'
+        response = self.client.post(url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['created'], response.data['duplicates']), (1, 3))
+        self.assertEqual(self.hydro.readings.count(), 4)
+
+
+class DeviceKeyTests(APITestCase):
+    def setUp(self):
+        authentication.invalidate_device_keys()
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.other = Hydroponics.objects.create(owner=self.user, name='System 2')
+        self.device_key, self.key = DeviceKey.generate(self.hydro, 'gateway')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Device {self.key}')
+
+    def tearDown(self):
+        authentication.invalidate_device_keys()
+
+    def reading(self, hydro, **data):
+        return {'hydroponics': reverse('hydroponics-detail', kwargs={'pk': hydro.pk}), 'ph': 6.1, **data}
+
+    def test_key_is_hashed(self):
+        self.assertEqual(self.device_key.prefix, self.key[:DeviceKey.PREFIX_LENGTH])
+        self.assertNotIn(self.key, self.device_key.digest)
+        self.assertEqual(DeviceKey.objects.get(digest=DeviceKey.hash_key(self.key)), self.device_key)
+
+    def test_create_without_auth_queries(self):
+        url = reverse('sensorreading-list')
+        self.assertEqual(self.client.post(url, self.reading(self.hydro), format='json').status_code, 201)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, self.reading(self.hydro, ph=6.2), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        tables = [DeviceKey._meta.db_table, 'django_session', User._meta.db_table]
+        for query in queries:
+            self.assertFalse(any(f'"{table}"' in query['sql'] for table in tables), query['sql'])
+        self.assertEqual(self.hydro.readings.count(), 2)
+
+    def test_create_for_other_system(self):
+        response = self.client.post(reverse('sensorreading-list'), self.reading(self.other), format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(SensorReading.objects.exists())
+
+    def test_invalid_key(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Device not-a-key')
+        response = self.client.post(reverse('sensorreading-list'), self.reading(self.hydro), format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_scoped_to_writing_readings(self):
+        reading = SensorReading.objects.create(hydroponics=self.hydro, ph=6.0)
+        url = reverse('sensorreading-detail', kwargs={'pk': reading.pk})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.patch(url, {'ph': 7.0}, format='json').status_code, 403)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_403_FORBIDDEN)
+        hydro_url = reverse('hydroponics-detail', kwargs={'pk': self.hydro.pk})
+        self.assertEqual(self.client.patch(hydro_url, {'name': 'Renamed'}, format='json').status_code, 403)
+
+    def test_bulk_rejects_other_systems(self):
+        rows = [{'hydroponics': self.hydro.pk, 'ph': 6.0}, {'hydroponics': self.other.pk, 'ph': 6.1}]
+        response = self.client.post(reverse('sensorreading-bulk'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertFalse(self.other.readings.exists())
+
+        body = f'hydroponics,ph\n{self.other.pk},6.2\n{self.hydro.pk},6.3\n'
+        response = self.client.post(reverse('sensorreading-bulk') + '?mode=copy', body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual((response.data['created'], response.data['rejected']), (1, 1))
+        self.assertFalse(self.other.readings.exists())
+
+    def test_cache(self):
+        _, other_key = DeviceKey.generate(self.other)
+        with self.assertNumQueries(1):
+            self.assertEqual(authentication.get_device_key(self.key), self.device_key)
+        with self.assertNumQueries(0):
+            self.assertEqual(authentication.get_device_key(self.key).hydroponics_id, self.hydro.pk)
+        with override_settings(HYDROPONICS_DEVICE_KEY_CACHE_SIZE=1):
+            authentication.get_device_key(other_key)
+        with self.assertNumQueries(1):
+            authentication.get_device_key(self.key)
+        authentication.invalidate_device_keys([DeviceKey.hash_key(other_key)])
+        with override_settings(HYDROPONICS_DEVICE_KEY_CACHE_TTL=0):
+            authentication.get_device_key(other_key)
+            with self.assertNumQueries(1):
+                authentication.get_device_key(other_key)
+        self.assertIsNone(authentication.get_device_key('not-a-key'))
+
+    def test_device_keys_command(self):
+        out = StringIO()
+        call_command('device_keys', 'create', str(self.other.pk), '--name', 'probe', stdout=out, stderr=StringIO())
+        key = out.getvalue().strip()
+        self.assertEqual(authentication.get_device_key(key).hydroponics_id, self.other.pk)
+
+        out = StringIO()
+        call_command('device_keys', 'list', str(self.other.pk), stdout=out)
+        self.assertIn(key[:DeviceKey.PREFIX_LENGTH], out.getvalue())
+        self.assertNotIn(self.device_key.prefix, out.getvalue())
+
+        url = reverse('sensorreading-list')
+        self.assertEqual(self.client.post(url, self.reading(self.hydro), format='json').status_code, 201)
+        call_command('device_keys', 'revoke', self.device_key.prefix, stdout=StringIO())
+        self.assertFalse(DeviceKey.objects.filter(pk=self.device_key.pk).exists())
+        self.assertEqual(self.client.post(url, self.reading(self.hydro), format='json').status_code, 403)
+
+
+class SensorReadingExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro1 = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.hydro2 = Hydroponics.objects.create(owner=self.user, name='System 2')
+        SensorReading.objects.bulk_create(
+            SensorReading(hydroponics=self.hydro1, ph=6.0, temperature=20.0 + i, tds=None if i % 2 else 400)
+            for i in range(7)
+        )
+        SensorReading.objects.create(hydroponics=self.hydro2, ph=7.5)
+        self.readings = SensorReading.objects.filter(hydroponics=self.hydro1).order_by('created', 'id')
+        self.url = reverse('sensorreading-export')
+
+    def get_export(self, **params):
+        response = self.client.get(self.url, {'hydroponics': self.hydro1.pk, **params}, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content)
+
+    def test_export_csv(self):
+        with patch.object(settings, 'HYDROPONICS_EXPORT_CHUNK_SIZE', 3):
+            rows = list(csv.DictReader(StringIO(self.get_export().decode())))
+        self.assertEqual([int(row['id']) for row in rows], [r.pk for r in self.readings])
+        self.assertEqual(rows[0]['tds'], '400.0')
+        self.assertEqual(rows[1]['tds'], '')
+        self.assertTrue(rows[0]['created'].endswith('Z'))
+
+    def test_export_ndjson(self):
+        content = self.get_export(export_format='ndjson', ordering='-id')
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [r.pk for r in self.readings.order_by('-id')])
+        self.assertEqual(rows[0]['hydroponics'], self.hydro1.pk)
+
+    def test_export_binary(self):
+        with patch.object(settings, 'HYDROPONICS_EXPORT_CHUNK_SIZE', 4):
+            blocks = list(iter_binary_blocks(BytesIO(self.get_export(export_format='binary'))))
+        self.assertEqual([len(block['id']) for block in blocks], [4, 3])
+        ids = [pk for block in blocks for pk in block['id']]
+        self.assertEqual(ids, [r.pk for r in self.readings])
+        first = self.readings.first()
+        created = datetime(1970, 1, 1, tzinfo=dt_timezone.utc) + timedelta(microseconds=blocks[0]['created'][0])
+        self.assertEqual(created, first.created)
+        self.assertEqual(blocks[0]['temperature'][1], 21.0)
+        self.assertTrue(math.isnan(blocks[0]['tds'][1]))
+
+    def test_export_invalid_format(self):
+        response = self.client.get(self.url, {'export_format': 'xlsx'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_command(self):
+        with NamedTemporaryFile(suffix='.ndjson') as output:
+            call_command(
+                'export_readings', output.name, filter=[f'hydroponics={self.hydro2.pk}'],
+                stderr=StringIO(),
+            )
+            rows = [json.loads(line) for line in output.read().decode().splitlines()]
+        self.assertEqual([row['ph'] for row in rows], [7.5])
+
+
+class FleetBenchmarkTests(APITestCase):
+    def test_generate_fleet(self):
+        spec = FleetSpec(users=2, systems_per_user=3, readings_per_second=0.01, history=timedelta(days=2), seed=0.5)
+        end = datetime(2025, 3, 3, tzinfo=dt_timezone.utc)
+        fleet = generate_fleet(spec, end=end)
+        self.assertEqual(spec.readings, 2 * 24 * 36)
+        self.assertEqual(len(fleet.hydroponics_ids), 6)
+        readings = SensorReading.objects.order_by('id')
+        self.assertEqual(readings.count(), spec.readings)
+        created = list(readings.values_list('created', flat=True))
+        self.assertEqual(created, sorted(created))
+        self.assertEqual(created[-1], end)
+        self.assertGreaterEqual(created[0], fleet.start)
+        self.assertEqual(Hydroponics.objects.get(pk=fleet.hydroponics_ids[0]).last_reading_at, end)
+
+        # temperatures peak in the afternoon, local time
+        local = [
+            (timezone.localtime(moment).hour, value)
+            for moment, value in readings.values_list('created', 'temperature')
+        ]
+        afternoon = [value for hour, value in local if 13 <= hour <= 16]
+        night = [value for hour, value in local if 1 <= hour <= 4]
+        self.assertGreater(sum(afternoon) / len(afternoon), sum(night) / len(night) + 3)
+        for value in readings.values_list('ph', flat=True):
+            self.assertTrue(5.5 < value < 6.5)
+
+        # the same seed generates the same readings
+        values = list(readings.values_list('ph', 'temperature', 'tds'))
+        SensorReading.objects.all().delete()
+        generate_fleet(spec, name='again', end=end)
+        self.assertEqual(list(readings.values_list('ph', 'temperature', 'tds')), values)
+
+    def test_fleet_benchmarks_json(self):
+        options = {'users': 2, 'systems': 2, 'readings_per_second': 0.05, 'history_days': 0.5, 'repeat': 1}
+        out = StringIO()
+        call_command(
+            'benchmark', 'list_readings', 'aggregate_readings', '--json', stdout=out, stderr=StringIO(), **options
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['fleet']['readings'], 2160)
+        self.assertEqual(set(report['benchmarks']), {'list_readings', 'aggregate_readings'})
+        for variant in report['benchmarks']['list_readings'].values():
+            self.assertGreater(variant['seconds'], 0)
+            self.assertGreater(variant['queries'], 0)
+        self.assertFalse(SensorReading.objects.exists())
+
+        with NamedTemporaryFile('w', suffix='.json') as baseline:
+            json.dump(report, baseline)
+            baseline.flush()
+            out = StringIO()
+            call_command('benchmark', 'list_hydroponics', 'list_readings', compare=baseline.name, stdout=out, **options)
+        self.assertIn('list_hydroponics (best of 1):', out.getvalue())
+        self.assertIn('list_readings, deep page: ', out.getvalue())
+        self.assertNotIn('list_hydroponics, ', out.getvalue())
+
+    def test_serve_requests(self):
+        database = dict(connection.settings_dict)
+        results = benchmarks.serve_requests(requests=10, clients=2, repeat=1)
+        self.assertEqual(connection.settings_dict, database)
+        self.assertEqual(results['new connections']['connections'], 10)
+        self.assertEqual(results['persistent connections']['connections'], 2)
+        if 'pooled connections' in results:
+            self.assertEqual(results['pooled connections']['connections'], 2)
+        for variant in results.values():
+            self.assertGreater(variant['requests_per_second'], 0)
+
+
+class AnalysisAPITests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.start = datetime(2025, 3, 1, 10, 0, tzinfo=dt_timezone.utc)
+        self.ph = [6.0 + 0.01 * (i % 5) for i in range(40)]
+        self.ph[30] = 9.0
+        readings = SensorReading.objects.bulk_create(
+            SensorReading(hydroponics=self.hydro, ph=ph, tds=None if i == 5 else 500.0 + i)
+            for i, ph in enumerate(self.ph)
+        )
+        for i, reading in enumerate(readings):
+            SensorReading.objects.filter(pk=reading.pk).update(created=self.start + timedelta(seconds=i))
+        self.url = reverse('hydroponics-analysis', kwargs={'pk': self.hydro.pk})
+
+    def test_load_window(self):
+        window = analysis.load_window(SensorReading.objects.filter(hydroponics=self.hydro), 100)
+        self.assertEqual(len(window), 40)
+        self.assertFalse(window.truncated)
+        self.assertEqual(window.seconds[0], self.start.timestamp())
+        self.assertEqual(window.values['ph'].tolist(), self.ph)
+        self.assertTrue(math.isnan(window.values['tds'][5]))
+        self.assertTrue(all(math.isnan(value) for value in window.values['temperature']))
+
+        window = analysis.load_window(SensorReading.objects.filter(hydroponics=self.hydro), 10)
+        self.assertTrue(window.truncated)
+        self.assertEqual(window.values['ph'].tolist(), self.ph[-10:])
+
+    def test_analysis(self):
+        response = self.client.get(self.url, {'window': 10, 'alpha': 0.5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 40)
+        self.assertEqual(datetime.fromisoformat(response.data['start']), self.start)
+
+        ph = response.data['metrics']['ph']
+        self.assertEqual(ph['outlier_count'], 1)
+        self.assertEqual(datetime.fromisoformat(ph['outliers'][0]['created']), self.start + timedelta(seconds=30))
+        self.assertEqual(ph['outliers'][0]['value'], 9.0)
+        self.assertAlmostEqual(ph['rolling_mean'], sum(self.ph[-10:]) / 10)
+        average = self.ph[0]
+        for value in self.ph[1:]:
+            average = 0.5 * average + 0.5 * value
+        self.assertAlmostEqual(ph['ewma'], average)
+        self.assertAlmostEqual(ph['drift'], average - sum(self.ph[:10]) / 10)
+        self.assertAlmostEqual(ph['max_rate_of_change']['value'], (self.ph[31] - 9.0) * 3600)
+
+        self.assertEqual(response.data['metrics']['tds']['count'], 39)
+        self.assertAlmostEqual(response.data['metrics']['tds']['rate_of_change'], 3600)
+        self.assertEqual(response.data['metrics']['temperature'], {'count': 0})
+
+    def test_analysis_filters(self):
+        response = self.client.get(self.url, {'ph__lte': 7, 'window': 10})
+        self.assertEqual(response.data['count'], 39)
+        self.assertEqual(response.data['metrics']['ph']['outlier_count'], 0)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark', 'analyze_readings', rows=200, repeat=1, stdout=out)
+        self.assertIn('numpy', out.getvalue())
+        self.assertEqual(SensorReading.objects.count(), 40)
+
+    def test_invalid_options(self):
+        response = self.client.get(self.url, {'window': 1, 'alpha': 'high'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'window', 'alpha'})
+
+    def test_tiny_alpha(self):
+        # 1 - alpha rounds to 1
+        response = self.client.get(self.url, {'alpha': 1e-20})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        values = np.array([6.0, 9.0, 3.0])
+        np.testing.assert_allclose(analysis.ewma(values, 1e-20), [6.0, 6.0, 6.0])
+        np.testing.assert_allclose(analysis.ewma(values, 0.0), [6.0, 6.0, 6.0])
+
+    def test_downsamplers_keep_spikes(self):
+        x = [float(i) for i in range(1000)]
+        y = [math.sin(i / 50) for i in range(1000)]
+        y[500] = 10.0
+        for method in ('lttb', 'minmax'):
+            selected = downsample.DOWNSAMPLERS[method](np.array(x), np.array(y), 50).tolist()
+            self.assertLessEqual(len(selected), 50)
+            self.assertEqual(selected, sorted(set(selected)))
+            self.assertIn(500, selected)
+        selected = downsample.lttb(np.array(x), np.array(y), 50)
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+
+    def test_series(self):
+        url = reverse('hydroponics-series', kwargs={'pk': self.hydro.pk})
+        response = self.client.get(url, {'max_points': 10, 'metrics': 'ph,tds'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 40)
+        self.assertEqual(set(response.data['series']), {'ph', 'tds'})
+        ph = response.data['series']['ph']
+        self.assertEqual(len(ph), 10)
+        self.assertEqual(ph[0], [int(self.start.timestamp() * 1000), self.ph[0]])
+        self.assertIn([int(self.start.timestamp() * 1000) + 30000, 9.0], ph)
+
+        response = self.client.get(url, {'max_points': 100, 'method': 'minmax'})
+        self.assertEqual(len(response.data['series']['ph']), 40)
+        self.assertEqual(len(response.data['series']['tds']), 39)
+        self.assertEqual(response.data['series']['temperature'], [])
+
+        response = self.client.get(url, {'max_points': 2, 'method': 'spline', 'metrics': 'ph,humidity'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'max_points', 'method', 'metrics'})
+
+
+class SensorReadingAggregateAPITests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro1 = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.hydro2 = Hydroponics.objects.create(owner=self.user, name='System 2')
+        for hydro, minute, ph in [
+            (self.hydro1, 1, 6.0),
+            (self.hydro1, 3, 6.4),
+            (self.hydro1, 7, 5.0),
+            (self.hydro1, 90, 7.0),
+            (self.hydro2, 2, 8.0),
+        ]:
+            reading = SensorReading.objects.create(hydroponics=hydro, ph=ph, tds=500)
+            SensorReading.objects.filter(pk=reading.pk).update(
+                created=datetime(2025, 3, 1, 10, 0, tzinfo=dt_timezone.utc) + timedelta(minutes=minute)
+            )
+
+    def test_aggregate_hydroponics(self):
+        url = reverse('hydroponics-aggregate', kwargs={'pk': self.hydro1.pk})
+        response = self.client.get(url, {'bucket': '5m'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['count'] for result in results], [2, 1, 1])
+        self.assertAlmostEqual(results[0]['ph']['avg'], 6.2)
+        self.assertEqual(results[0]['ph']['min'], 6.0)
+        self.assertEqual(results[0]['ph']['max'], 6.4)
+        self.assertAlmostEqual(results[0]['ph']['stddev'], 0.2)
+        self.assertEqual(results[0]['temperature']['count'], 0)
+        self.assertEqual(results[0]['bucket'], datetime(2025, 3, 1, 10, 0, tzinfo=dt_timezone.utc))
+
+    def test_aggregate_sensor_readings_filtered(self):
+        url = reverse('sensorreading-aggregate')
+        response = self.client.get(url, {'bucket': '1h', 'ph__gte': 6})
+        self.assertEqual([result['count'] for result in response.data['results']], [3, 1])
+        response = self.client.get(url, {
+            'bucket': '1h',
+            'group_by': 'hydroponics',
+            'hydroponics__in': f'{self.hydro1.pk},{self.hydro2.pk}',
+        })
+        self.assertEqual(
+            [(result['hydroponics'], result['count']) for result in response.data['results']],
+            [(self.hydro1.pk, 3), (self.hydro2.pk, 1), (self.hydro1.pk, 1)],
+        )
+
+    def test_aggregate_from_rollups(self):
+        url = reverse('sensorreading-aggregate')
+        params = {'bucket': '1h', 'group_by': 'hydroponics', 'created_after': '2025-03-01'}
+        raw = self.client.get(url, params)
+        self.assertEqual(raw.data['source'], 'raw')
+
+        call_command('rollup_readings', stdout=StringIO())
+        self.assertEqual(ReadingRollup.objects.filter(period='day').count(), 2)
+        # readings ingested after the catch-up are merged in from the raw table
+        reading = SensorReading.objects.create(hydroponics=self.hydro1, ph=6.6)
+        SensorReading.objects.filter(pk=reading.pk).update(
+            created=datetime(2025, 3, 1, 10, 30, tzinfo=dt_timezone.utc)
+        )
+        rolled_up = self.client.get(url, params)
+        self.assertEqual(rolled_up.data['source'], 'rollup')
+        self.assertEqual(rolled_up.data['results'][0]['count'], 4)
+        self.assertAlmostEqual(rolled_up.data['results'][0]['ph']['avg'], (6.0 + 6.4 + 5.0 + 6.6) / 4)
+
+        call_command('rollup_readings', '--rebuild', stdout=StringIO())
+        self.assertRollupsMatchRaw(params)
+
+    def assertRollupsMatchRaw(self, params):
+        url = reverse('sensorreading-aggregate')
+        rolled_up = self.client.get(url, params)
+        raw = self.client.get(url, {**params, 'ph__gte': 0})
+        self.assertEqual(rolled_up.data['source'], 'rollup')
+        self.assertEqual(raw.data['source'], 'raw')
+        self.assertEqual(len(rolled_up.data['results']), len(raw.data['results']))
+        for expected, actual in zip(raw.data['results'], rolled_up.data['results']):
+            self.assertEqual(expected['bucket'], actual['bucket'])
+            self.assertEqual(expected['count'], actual['count'])
+            for name in ('min', 'max', 'avg', 'stddev'):
+                self.assertAlmostEqual(expected['ph'][name], actual['ph'][name])
+
+    @override_settings(HYDROPONICS_QUERY_BUDGETS='raise')
+    def test_aggregate_from_rollups_after_edit(self):
+        call_command('rollup_readings', stdout=StringIO())
+        readings = list(SensorReading.objects.filter(hydroponics=self.hydro1).order_by('created'))
+        self.client.login(username='testuser', password='pass123')
+        for pk, data in [
+            (readings[0].pk, {'ph': 4.5}),
+            (readings[1].pk, {'created': '2025-03-01T12:15:00Z', 'ph': 9.0}),
+            (readings[2].pk, {'hydroponics': reverse('hydroponics-detail', kwargs={'pk': self.hydro2.pk})}),
+        ]:
+            url = reverse('sensorreading-detail', kwargs={'pk': pk})
+            self.assertEqual(self.client.patch(url, data, format='json').status_code, status.HTTP_200_OK)
+        response = self.client.delete(reverse('sensorreading-detail', kwargs={'pk': readings[3].pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        for bucket in ('1h', '1d'):
+            self.assertRollupsMatchRaw({'bucket': bucket, 'group_by': 'hydroponics'})
+        self.assertEqual(rollups.get_watermark(), SensorReading.objects.latest('id').pk)
+
+    def test_aggregate_invalid_bucket(self):
+        url = reverse('sensorreading-aggregate')
+        response = self.client.get(url, {'bucket': '2w'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RollupCatchUpTests(APITransactionTestCase):
+    """
+    Commits readings from a second connection, which is why the tests commit their data.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+
+    def test_lower_id_committed_after_catch_up(self):
+        other = connection.copy()
+        try:
+            other.set_autocommit(False)
+            with other.cursor() as cursor:
+                cursor.execute(
+                    'INSERT INTO sensor_reading (created, hydroponics_id, ph) VALUES (now(), %s, 6.0) RETURNING id',
+                    [self.hydro.pk],
+                )
+                early = cursor.fetchone()[0]
+            late = SensorReading.objects.create(hydroponics=self.hydro, ph=7.0)
+            self.assertLess(early, late.pk)
+
+            # the transaction of the lower id is still running
+            rollups.catch_up(wait=False)
+            with patch.object(rollups, 'SETTLE_TIMEOUT', 0):
+                rollups.catch_up()
+            self.assertLess(rollups.get_watermark(), early)
+
+            other.commit()
+            self.assertEqual(rollups.catch_up(wait=False), 2)
+            self.assertEqual(rollups.get_watermark(), late.pk)
+            rollup = ReadingRollup.objects.get(hydroponics=self.hydro, period='hour')
+            self.assertEqual((rollup.count, rollup.ph_sum), (2, 13.0))
+        finally:
+            other.close()
+
+    def test_aggregate_during_catch_up(self):
+        for ph in (6.0, 6.5, 7.0):
+            SensorReading.objects.create(hydroponics=self.hydro, ph=ph)
+        watermark = rollups.get_watermark
+
+        def get_watermark():
+            # a catch-up committing from another connection right after the watermark was read
+            position = watermark()
+            worker = threading.Thread(target=lambda: (rollups.catch_up(), connection.close()))
+            worker.start()
+            worker.join()
+            return position
+
+        call_command('rollup_readings', stdout=StringIO())
+        SensorReading.objects.create(hydroponics=self.hydro, ph=7.5)
+        with patch.object(views, 'get_watermark', get_watermark):
+            response = self.client.get(reverse('sensorreading-aggregate'), {'bucket': '1h'})
+        self.assertEqual(response.data['source'], 'rollup')
+        self.assertEqual(response.data['results'][0]['count'], 4)
+        self.assertEqual(rollups.get_watermark(), SensorReading.objects.latest('id').pk)
+
+
+class LatestReadingAPITests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.url = reverse('hydroponics-latest', kwargs={'pk': self.hydro.pk})
+
+    def post_readings(self, readings):
+        self.client.login(username='testuser', password='pass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('sensorreading-bulk'), readings, format='json')
+        self.client.logout()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_latest_without_readings(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('hydroponics-latest', kwargs={'pk': 999999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_latest_served_from_cache(self):
+        self.post_readings([{'hydroponics': self.hydro.pk, 'ph': 6.2}])
+        self.assertEqual(self.client.get(self.url).data['ph'], 6.2)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['ph'], 6.2)
+
+        self.post_readings([{'hydroponics': self.hydro.pk, 'ph': 5.8}])
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['ph'], 5.8)
+
+        latest = self.hydro.readings.latest('created')
+        self.assertEqual(response.data['id'], latest.pk)
+        self.hydro.refresh_from_db()
+        self.assertEqual(self.hydro.last_reading_at, latest.created)
+
+    def test_latest_invalidated_on_delete(self):
+        first = SensorReading.objects.create(hydroponics=self.hydro, ph=6.0)
+        second = SensorReading.objects.create(hydroponics=self.hydro, ph=6.5)
+        self.assertEqual(self.client.get(self.url).data['id'], second.pk)
+
+        self.client.login(username='testuser', password='pass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('sensorreading-detail', kwargs={'pk': second.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(self.url).data['id'], first.pk)
+        self.hydro.refresh_from_db()
+        self.assertEqual(self.hydro.last_reading_at, first.created)
+
+    def test_latest_invalidated_on_owner_delete(self):
+        SensorReading.objects.create(hydroponics=self.hydro, ph=6.0)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+        self.client.login(username='testuser', password='pass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('user-detail', kwargs={'pk': self.user.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_latest_recorded_under_lock(self):
+        first, second, third = (SensorReading.objects.create(hydroponics=self.hydro, ph=ph) for ph in (6.0, 6.5, 7.0))
+        key = latest_cache._key(self.hydro.pk)
+        # another writer caches the first reading, then the third one while recording the second one
+        with latest_cache._locked(self.hydro.pk):
+            cache.set(key, latest_cache.reading_snapshot(first), timeout=None)
+            worker = threading.Thread(target=latest_cache.record_latest, args=([second],))
+            worker.start()
+            worker.join(timeout=0.2)
+            self.assertTrue(worker.is_alive())
+            cache.set(key, latest_cache.reading_snapshot(third), timeout=None)
+        worker.join()
+        self.assertEqual(latest_cache.get_cached_latest(self.hydro.pk)['id'], third.pk)
+
+    def test_hydroponics_representation(self):
+        idle = Hydroponics.objects.create(owner=self.user, name='System 2')
+        self.post_readings([{'hydroponics': self.hydro.pk, 'ph': 6.0, 'tds': 480}])
+        reading = self.hydro.readings.get()
+
+        response = self.client.get(reverse('hydroponics-detail', kwargs={'pk': self.hydro.pk}))
+        self.assertEqual(response.data['latest_reading']['id'], reading.pk)
+        self.assertEqual(response.data['latest_reading']['tds'], 480)
+        response = self.client.get(reverse('hydroponics-list'), {'readings_limit': 0})
+        latest = {item['id']: item['latest_reading'] for item in response.data['results']}
+        self.assertEqual(latest[self.hydro.pk]['id'], reading.pk)
+        self.assertIsNone(latest[idle.pk])
+
+        response = self.client.get(reverse('hydroponics-list'), {'last_reading_at__isnull': True})
+        self.assertEqual([item['id'] for item in response.data['results']], [idle.pk])
+
+
+class ConditionalRequestTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.reading = SensorReading.objects.create(hydroponics=self.hydro, ph=6.0)
+        self.list_url = reverse('hydroponics-list')
+        self.detail_url = reverse('hydroponics-detail', kwargs={'pk': self.hydro.pk})
+
+    def test_list_not_modified(self):
+        for url in (self.list_url, reverse('sensorreading-list')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('Last-Modified', response)
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_modified_by_new_reading(self):
+        etag = self.client.get(reverse('sensorreading-list'))['ETag']
+        self.client.login(username='testuser', password='pass123')
+        self.client.post(reverse('sensorreading-bulk'), [
+            {'hydroponics': self.hydro.pk, 'ph': 6.1},
+        ], format='json')
+        response = self.client.get(reverse('sensorreading-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        Hydroponics.objects.create(owner=self.user, name='System 2')
+        response = self.client.get(reverse('sensorreading-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_detail_not_modified(self):
+        url = reverse('sensorreading-detail', kwargs={'pk': self.reading.pk})
+        for url in (self.detail_url, url):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(reverse('hydroponics-detail', kwargs={'pk': 999999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_modified_by_owner_rename(self):
+        etags = {url: self.client.get(url)['ETag'] for url in (self.list_url, self.detail_url)}
+        self.client.login(username='testuser', password='pass123')
+        response = self.client.patch(reverse('user-detail', kwargs={'pk': self.user.pk}), {'username': 'bob'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for url, etag in etags.items():
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['owner'], 'bob')
+
+    def test_if_match(self):
+        self.client.login(username='testuser', password='pass123')
+        etag = self.client.get(self.detail_url)['ETag']
+
+        response = self.client.patch(self.detail_url, {'name': 'Renamed'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        response = self.client.patch(self.detail_url, {'name': 'Stale'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.hydro.refresh_from_db()
+        self.assertEqual(self.hydro.name, 'Renamed')
+
+    def test_if_match_reading(self):
+        self.client.login(username='testuser', password='pass123')
+        url = reverse('sensorreading-detail', kwargs={'pk': self.reading.pk})
+        etag = self.client.get(url)['ETag']
+        self.client.post(reverse('sensorreading-list'), {
+            'hydroponics': reverse('hydroponics-detail', kwargs={'pk': self.hydro.pk}),
+            'ph': 6.4,
+        }, format='json')
+
+        response = self.client.delete(url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(url, HTTP_IF_MATCH=self.client.get(url)['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class AsyncAPITests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.empty = Hydroponics.objects.create(owner=self.user, name='System 2')
+        SensorReading.objects.bulk_create(
+            SensorReading(hydroponics=self.hydro, ph=6.0 + i / 10, temperature=20.0, tds=400)
+            for i in range(5)
+        )
+
+    async def test_detail_matches_sync(self):
+        for name, pk in (('hydroponics-detail', self.hydro.pk), ('hydroponics-latest', self.hydro.pk)):
+            expected = await sync_to_async(self.client.get)(reverse(name, kwargs={'pk': pk}))
+            response = await self.async_client.get(reverse(f'async-{name}', kwargs={'pk': pk}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), expected.json())
+
+        reading = await SensorReading.objects.afirst()
+        expected = await sync_to_async(self.client.get)(
+            reverse('sensorreading-detail', kwargs={'pk': reading.pk})
+        )
+        response = await self.async_client.get(reverse('async-sensorreading-detail', kwargs={'pk': reading.pk}))
+        self.assertEqual(response.json(), expected.json())
+
+    async def test_not_found(self):
+        response = await self.async_client.get(reverse('async-hydroponics-latest', kwargs={'pk': self.empty.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get(reverse('async-hydroponics-detail', kwargs={'pk': 999999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get(reverse('async-hydroponics-latest', kwargs={'pk': 999999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_list_pagination(self):
+        url = reverse('async-sensorreading-list')
+        response = await self.async_client.get(url, {'page_size': 2, 'hydroponics': self.hydro.pk})
+        seen = [reading['id'] for reading in response.json()['results']]
+        while response.json()['next']:
+            response = await self.async_client.get(response.json()['next'])
+            seen += [reading['id'] for reading in response.json()['results']]
+        expected = [pk async for pk in SensorReading.objects.order_by('created', 'id').values_list('id', flat=True)]
+        self.assertEqual(seen, expected)
+        response = await self.async_client.get(url, {'hydroponics__name__icontains': 'system 2'})
+        self.assertEqual(response.json()['results'], [])
+
+        response = await self.async_client.get(reverse('async-hydroponics-list'), {'readings_limit': 2})
+        results = response.json()['results']
+        self.assertEqual([system['id'] for system in results], [self.hydro.pk, self.empty.pk])
+        self.assertEqual(len(results[0]['sensor_readings']), 2)
+        self.assertIsNone(results[1]['latest_reading'])
+
+        response = await self.async_client.get(url, {'ph__gte': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    async def test_aggregate(self):
+        response = await self.async_client.get(
+            reverse('async-hydroponics-aggregate', kwargs={'pk': self.hydro.pk}), {'bucket': '1d'}
+        )
+        self.assertEqual(response.json()['results'][0]['count'], 5)
+        response = await self.async_client.get(reverse('async-sensorreading-aggregate'), {'bucket': '2h'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LiveReadingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.other = Hydroponics.objects.create(owner=self.user, name='System 2')
+        self.url = reverse('async-sensorreading-live')
+
+    def ingest(self, hydroponics, count=1):
+        self.client.login(username='testuser', password='pass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('sensorreading-bulk'), [
+                {'hydroponics': hydroponics.pk, 'ph': 6.0} for _ in range(count)
+            ], format='json')
+        return list(hydroponics.readings.order_by('-id')[:count])[::-1]
+
+    async def test_broadcaster_drops_slow_subscribers(self):
+        subscription = live.broadcaster.subscribe({self.hydro.pk}, maxsize=2)
+        try:
+            readings = await sync_to_async(self.ingest)(self.hydro)
+            await sync_to_async(self.ingest)(self.other)
+            batch = await asyncio.wait_for(subscription.get(), 1)
+            self.assertEqual([event['id'] for event in batch], [readings[0].pk])
+
+            for _ in range(3):
+                await sync_to_async(self.ingest)(self.hydro)
+            await asyncio.sleep(0)
+            self.assertTrue(subscription.dropped)
+            self.assertIsNotNone(await subscription.get())
+            self.assertIsNotNone(await subscription.get())
+            self.assertIsNone(await subscription.get())
+        finally:
+            live.broadcaster.unsubscribe(subscription)
+        self.assertEqual(live.broadcaster.subscriptions, {})
+
+    async def stream(self, response):
+        """
+        Consume a streaming response in a task, the way the ASGI handler does,
+        returning the task and a queue of the received chunks.
+        """
+        chunks = asyncio.Queue()
+
+        async def consume():
+            async for chunk in response.streaming_content:
+                await chunks.put(chunk.decode())
+        return asyncio.create_task(consume()), chunks
+
+    async def disconnect(self, task):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        self.assertEqual(live.broadcaster.subscriptions, {})
+
+    async def test_server_sent_events(self):
+        response = await self.async_client.get(self.url, {'hydroponics': f'{self.hydro.pk},{self.other.pk}'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        task, chunks = await self.stream(response)
+        self.assertTrue((await asyncio.wait_for(chunks.get(), 1)).startswith('retry:'))
+
+        readings = await sync_to_async(self.ingest)(self.other, count=2)
+        chunk = await asyncio.wait_for(chunks.get(), 1)
+        self.assertIn(f'id: {readings[0].pk}\nevent: reading\n', chunk)
+        data = [json.loads(line[6:]) for line in chunk.splitlines() if line.startswith('data: ')]
+        self.assertEqual([event['id'] for event in data], [reading.pk for reading in readings])
+        await self.disconnect(task)
+
+    async def test_replay_after_reconnect(self):
+        readings = await sync_to_async(self.ingest)(self.hydro, count=3)
+        response = await self.async_client.get(
+            self.url, {'hydroponics': self.hydro.pk}, headers={'Last-Event-ID': str(readings[0].pk)},
+        )
+        task, chunks = await self.stream(response)
+        replayed = [await asyncio.wait_for(chunks.get(), 1) for _ in range(3)][1:]
+        self.assertIn(f'id: {readings[1].pk}\n', replayed[0])
+        self.assertIn(f'id: {readings[2].pk}\n', replayed[1])
+        await self.disconnect(task)
+
+    async def test_invalid_subscription(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.get(self.url, {'hydroponics': f'{self.hydro.pk},999999'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AlertTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.other_user = User.objects.create_user(username='otheruser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.start = datetime(2024, 5, 1, 12, tzinfo=dt_timezone.utc)
+        self.reading_id = 0
+        alerts.invalidate_rule_index()
+
+    def tearDown(self):
+        alerts.invalidate_rule_index()
+
+    def rule(self, metric, comparator, threshold, **kwargs):
+        return AlertRule.objects.create(
+            hydroponics=self.hydro, metric=metric, comparator=comparator, threshold=threshold, **kwargs
+        )
+
+    def evaluate(self, *values, metric='ph', step=timedelta(minutes=1)):
+        """
+        Evaluate unsaved readings of the given values, one step apart, returning the kinds of the events.
+        """
+        readings = []
+        for value in values:
+            self.reading_id += 1
+            readings.append(SensorReading(
+                id=self.reading_id,
+                hydroponics=self.hydro,
+                created=self.start + step * self.reading_id,
+                **{metric: value},
+            ))
+        with self.captureOnCommitCallbacks(execute=True):
+            events = alerts.evaluate_readings(readings)
+        return [event.kind for event in events]
+
+    def test_ph_range_with_hysteresis(self):
+        high = self.rule('ph', 'gt', 6.5, hysteresis=0.1)
+        low = self.rule('ph', 'lt', 5.5, hysteresis=0.1)
+        self.assertEqual(self.evaluate(6.0, 6.7), ['triggered'])
+        # back under the threshold, but not by the hysteresis
+        self.assertEqual(self.evaluate(6.45), [])
+        self.assertEqual(self.evaluate(6.3, 5.4), ['resolved', 'triggered'])
+
+        events = AlertEvent.objects.order_by('id')
+        self.assertEqual(
+            [(event.rule_id, event.kind, event.value) for event in events],
+            [(high.pk, 'triggered', 6.7), (high.pk, 'resolved', 6.3), (low.pk, 'triggered', 5.4)],
+        )
+        high.refresh_from_db()
+        low.refresh_from_db()
+        self.assertEqual((high.state, low.state), ('ok', 'firing'))
+
+    def test_min_duration(self):
+        rule = self.rule('tds', 'gt', 1000, min_duration=timedelta(minutes=5))
+        # a short spike only makes the rule pending
+        self.assertEqual(self.evaluate(1500, 800, metric='tds'), [])
+        self.assertEqual(self.evaluate(1200, 1300, 1250, metric='tds', step=timedelta(minutes=2)), [])
+        rule.refresh_from_db()
+        self.assertEqual(rule.state, 'pending')
+        self.assertEqual(self.evaluate(1100, metric='tds', step=timedelta(minutes=2)), ['triggered'])
+
+    def test_stale_state_is_reloaded(self):
+        rule = self.rule('ph', 'gt', 6.5)
+        alerts.get_rule_index()
+        AlertRule.objects.filter(pk=rule.pk).update(state='firing')
+        self.assertEqual(self.evaluate(7.0), [])
+        self.assertEqual(self.evaluate(6.0), ['resolved'])
+
+    def test_evaluation_does_not_query_without_transitions(self):
+        other = Hydroponics.objects.create(owner=self.user, name='System 2')
+        AlertRule.objects.bulk_create(
+            AlertRule(hydroponics=other, metric='ph', comparator='gt', threshold=6.5) for _ in range(500)
+        )
+        self.rule('ph', 'gt', 6.5)
+        alerts.get_rule_index()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.evaluate(*[6.0] * 100), [])
+
+    def test_ingest_records_events(self):
+        rule = self.rule('ph', 'lt', 5.5)
+        self.client.login(username='testuser', password='pass123')
+        response = self.client.post(reverse('sensorreading-bulk'), [
+            {'hydroponics': self.hydro.pk, 'ph': 6.0},
+            {'hydroponics': self.hydro.pk, 'ph': 5.0},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get(reverse('alertevent-list'), {'hydroponics': self.hydro.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        event, = response.data['results']
+        reading = self.hydro.readings.get(ph=5.0)
+        self.assertEqual(event['kind'], 'triggered')
+        self.assertEqual(event['value'], 5.0)
+        self.assertTrue(event['rule'].endswith(reverse('alertrule-detail', kwargs={'pk': rule.pk})))
+        self.assertTrue(event['reading'].endswith(reverse('sensorreading-detail', kwargs={'pk': reading.pk})))
+
+    def test_rule_api(self):
+        url = reverse('alertrule-list')
+        data = {
+            'hydroponics': reverse('hydroponics-detail', kwargs={'pk': self.hydro.pk}),
+            'metric': 'ph',
+            'comparator': 'gt',
+            'threshold': 6.5,
+            'hysteresis': 0.2,
+        }
+        self.client.login(username='otheruser', password='pass123')
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('hydroponics', response.data)
+
+        self.client.login(username='testuser', password='pass123')
+        response = self.client.post(url, {**data, 'state': 'firing'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['state'], 'ok')
+        rule_url = response.data['url']
+        # the new rule is evaluated right away
+        self.assertEqual(self.evaluate(7.0), ['triggered'])
+
+        self.client.login(username='otheruser', password='pass123')
+        response = self.client.patch(rule_url, {'threshold': 7.5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.login(username='testuser', password='pass123')
+        response = self.client.patch(rule_url, {'enabled': False}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.evaluate(6.0), [])
+
+
+class PartitionTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+        self.reading = SensorReading.objects.create(hydroponics=self.hydro, ph=6.0)
+        SensorReading.objects.filter(pk=self.reading.pk).update(
+            created=datetime(2024, 1, 20, tzinfo=dt_timezone.utc)
+        )
+
+    def test_create_and_drop_partitions(self):
+        created = partitions.create_partitions(ahead=1, start=datetime(2024, 1, 15, tzinfo=dt_timezone.utc))
+        self.assertEqual(
+            [partition.name for partition in created],
+            ['sensor_reading_p202401', 'sensor_reading_p202402'],
+        )
+        # the reading was moved out of the default partition
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM sensor_reading_p202401')
+            self.assertEqual(cursor.fetchall(), [(self.reading.pk,)])
+        self.assertEqual(partitions.create_partitions(ahead=1, start=datetime(2024, 1, 15, tzinfo=dt_timezone.utc)), [])
+
+        self.hydro.refresh_from_db()
+        version = self.hydro.version
+        dropped = partitions.drop_partitions(datetime(2024, 2, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual([partition.name for partition in dropped], ['sensor_reading_p202401'])
+        self.assertFalse(SensorReading.objects.filter(pk=self.reading.pk).exists())
+        self.hydro.refresh_from_db()
+        self.assertEqual(self.hydro.version, version + 1)
+        self.assertIsNone(self.hydro.last_reading_at)
+
+    def test_created_filter_prunes_partitions(self):
+        partitions.create_partitions(ahead=2, start=datetime(2024, 1, 1, tzinfo=dt_timezone.utc))
+        filterset = SensorReadingFilter(
+            {'created_after': '2024-02-03', 'created_before': '2024-02-10'},
+            queryset=SensorReading.objects.all(),
+        )
+        plan = filterset.qs.explain()
+        self.assertIn('sensor_reading_p202402', plan)
+        self.assertNotIn('sensor_reading_p202401', plan)
+        self.assertNotIn('sensor_reading_p202403', plan)
+
+
+class RetentionTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro1 = Hydroponics.objects.create(owner=self.user, name='System 1', retention_days=30)
+        self.hydro2 = Hydroponics.objects.create(owner=self.user, name='System 2')
+        self.now = datetime(2025, 6, 1, 12, 0, tzinfo=dt_timezone.utc)
+        for hydro, created, ph in [
+            (self.hydro1, datetime(2025, 3, 1, 10, 1, tzinfo=dt_timezone.utc), 6.0),
+            (self.hydro1, datetime(2025, 3, 1, 10, 3, tzinfo=dt_timezone.utc), 6.4),
+            (self.hydro1, datetime(2025, 5, 20, 10, 0, tzinfo=dt_timezone.utc), 7.0),
+            (self.hydro2, datetime(2025, 3, 1, 10, 2, tzinfo=dt_timezone.utc), 8.0),
+        ]:
+            self.create_reading(hydro, created, ph)
+
+    def create_reading(self, hydro, created, ph):
+        reading = SensorReading.objects.create(hydroponics=hydro, ph=ph)
+        SensorReading.objects.filter(pk=reading.pk).update(created=created)
+        return reading
+
+    def daily_counts(self):
+        url = reverse('hydroponics-aggregate', kwargs={'pk': self.hydro1.pk})
+        response = self.client.get(url, {'bucket': '1d'})
+        self.assertEqual(response.data['source'], 'rollup')
+        return [result['count'] for result in response.data['results']]
+
+    def test_compaction_cutoff(self):
+        # start of the local day, Europe/Warsaw is UTC+2 in May
+        self.assertEqual(
+            retention.compaction_cutoff(30, self.now),
+            datetime(2025, 5, 1, 22, 0, tzinfo=dt_timezone.utc),
+        )
+
+    def test_compact_rolled_up_readings(self):
+        self.assertEqual(retention.compact(now=self.now).deleted, 0)
+        rollups.catch_up()
+        # not rolled up yet, kept until the next run
+        late = self.create_reading(self.hydro1, datetime(2025, 3, 1, 11, 0, tzinfo=dt_timezone.utc), 5.0)
+
+        result = retention.compact(batch_size=1, now=self.now)
+        self.assertEqual((result.deleted, result.batches, result.hydroponics_ids), (2, 2, {self.hydro1.pk}))
+        self.assertEqual(
+            set(SensorReading.objects.filter(created__lt=datetime(2025, 4, 1, tzinfo=dt_timezone.utc))
+                .values_list('hydroponics_id', 'ph')),
+            {(self.hydro1.pk, 5.0), (self.hydro2.pk, 8.0)},
+        )
+        self.hydro1.refresh_from_db()
+        self.assertEqual(self.hydro1.compacted_until, retention.compaction_cutoff(30, self.now))
+        self.assertEqual(self.daily_counts(), [3, 1])
+
+        # rebuilding keeps the rollups of compacted days and does not count the late reading twice
+        call_command('rollup_readings', '--rebuild', stdout=StringIO())
+        self.assertEqual(self.daily_counts(), [3, 1])
+        self.assertEqual(retention.compact(now=self.now).deleted, 1)
+        self.assertFalse(SensorReading.objects.filter(pk=late.pk).exists())
+        self.assertEqual(self.daily_counts(), [3, 1])
+
+    @override_settings(HYDROPONICS_RETENTION_DAYS=60)
+    def test_default_retention(self):
+        rollups.catch_up()
+        result = retention.compact(now=self.now)
+        self.assertEqual(result.hydroponics_ids, {self.hydro1.pk, self.hydro2.pk})
+        self.assertEqual(SensorReading.objects.count(), 1)
+        self.hydro2.refresh_from_db()
+        self.assertEqual(self.hydro2.compacted_until, retention.compaction_cutoff(60, self.now))
+
+    def test_compact_readings_command(self):
+        self.hydro1.retention_days = 1
+        self.hydro1.save()
+        out = StringIO()
+        call_command('compact_readings', '--batch-size', '10', stdout=out)
+        self.assertIn('Deleted 3 readings of 1 systems', out.getvalue())
+        self.assertEqual(self.daily_counts(), [2, 1])
+
+
 class UserAPITests(APITestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username='testuser1', password='pass123')
@@ -118,6 +1578,302 @@ class UserAPITests(APITestCase):
         self.assertEqual(response.data['username'], 'testuser1')
 
 
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        instrumentation.registry.clear()
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='System 1')
+        SensorReading.objects.create(hydroponics=self.hydro, ph=6.0)
+
+    def metrics(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_metrics_per_action(self):
+        with instrumentation.QueryCounter() as queries:
+            self.client.get(reverse('hydroponics-list'))
+            self.client.get(reverse('hydroponics-list'))
+        response = self.client.get(reverse('hydroponics-aggregate', kwargs={'pk': self.hydro.pk}))
+        self.client.get('/missing/')
+        metrics = self.metrics()
+
+        self.assertIn(
+            'lunasci_http_requests_total{view="HydroponicsViewSet.list",method="GET",status="200"} 2', metrics
+        )
+        self.assertIn(
+            'lunasci_http_requests_total{view="HydroponicsViewSet.aggregate",method="GET",status="200"} 1', metrics
+        )
+        self.assertIn('lunasci_http_requests_total{view="<unmatched>",method="GET",status="404"} 1', metrics)
+        self.assertIn(
+            'lunasci_http_request_duration_seconds_bucket{view="HydroponicsViewSet.list",le="+Inf"} 2', metrics
+        )
+        self.assertGreater(queries.count, 0)
+        self.assertIn(
+            f'lunasci_http_request_db_queries_sum{{view="HydroponicsViewSet.list"}} {queries.count}', metrics
+        )
+        self.assertIn(
+            f'lunasci_http_response_size_bytes_sum{{view="HydroponicsViewSet.aggregate"}} {len(response.content)}',
+            metrics,
+        )
+        render = re.search(
+            r'lunasci_http_request_render_seconds_sum\{view="HydroponicsViewSet.list"\} (\S+)', metrics
+        )
+        self.assertGreater(float(render.group(1)), 0)
+
+    async def test_async_view_metrics(self):
+        await self.async_client.get(reverse('async-hydroponics-list'))
+        metrics = await sync_to_async(self.metrics)()
+        self.assertIn(
+            'lunasci_http_requests_total{view="async_views.hydroponics_list",method="GET",status="200"} 1', metrics
+        )
+        self.assertNotIn('lunasci_http_request_db_queries_sum{view="async_views.hydroponics_list"} 0\n', metrics)
+
+    def test_connection_metrics(self):
+        self.client.get(reverse('hydroponics-list'))
+        connection_created.send(sender=type(connection), connection=connection)
+        stats = {'pool_size': 4, 'pool_available': 1, 'requests_waiting': 2, 'connections_num': 7}
+        with patch('lunasci.instrumentation.pool_stats', return_value={'default': stats}):
+            metrics = self.metrics()
+        self.assertIn('lunasci_db_connections_total{database="default"} 1', metrics)
+        self.assertIn('lunasci_db_pool_connections{database="default"} 4', metrics)
+        self.assertIn('lunasci_db_pool_connections_in_use{database="default"} 3', metrics)
+        self.assertIn('lunasci_db_pool_requests_waiting{database="default"} 2', metrics)
+        self.assertIn('lunasci_db_pool_connections_created_total{database="default"} 7', metrics)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_profile_slow_requests(self):
+        with TemporaryDirectory() as directory:
+            with override_settings(PROFILE_SLOW_REQUESTS=0, PROFILE_SAMPLE_RATE=1, PROFILE_DIR=directory):
+                with self.assertLogs('lunasci.instrumentation', 'WARNING'):
+                    self.client.get(reverse('hydroponics-list'))
+            with override_settings(PROFILE_SLOW_REQUESTS=60, PROFILE_SAMPLE_RATE=1, PROFILE_DIR=directory):
+                self.client.get(reverse('hydroponics-detail', kwargs={'pk': self.hydro.pk}))
+            profiles = list(Path(directory).iterdir())
+            self.assertEqual(len(profiles), 1)
+            self.assertIn('HydroponicsViewSet.list', profiles[0].name)
+            self.assertTrue(pstats.Stats(str(profiles[0])).total_calls)
+
+
+@override_settings(HYDROPONICS_QUERY_BUDGETS='raise')
+class QueryBudgetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        alerts.invalidate_rule_index()
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.add_systems(self.user, 1, 1)
+        self.hydro = Hydroponics.objects.get(owner=self.user)
+        self.client.login(username='testuser', password='pass123')
+
+    def tearDown(self):
+        alerts.invalidate_rule_index()
+
+    def add_systems(self, owner, systems, readings):
+        """
+        Add systems with readings, an alert rule and an alert event each.
+        """
+        for index in range(systems):
+            hydro = Hydroponics.objects.create(owner=owner, name=f'System {index}')
+            created = SensorReading.objects.bulk_create(
+                SensorReading(hydroponics=hydro, ph=6.0 + i / 100, temperature=21, tds=800) for i in range(readings)
+            )
+            rule = AlertRule.objects.create(hydroponics=hydro, metric='tds', comparator='gt', threshold=2000)
+            AlertEvent.objects.create(
+                created=created[0].created, rule=rule, hydroponics=hydro, kind='triggered',
+                metric='tds', comparator='gt', threshold=2000, value=2100, reading_id=created[0].pk,
+            )
+
+    def read_requests(self):
+        hydro = {'pk': self.hydro.pk}
+        reading = SensorReading.objects.filter(hydroponics=self.hydro).first()
+        rule = self.hydro.alert_rules.get()
+        event = AlertEvent.objects.get(rule=rule)
+        return [
+            ('UserViewSet.list', reverse('user-list'), {}),
+            ('UserViewSet.retrieve', reverse('user-detail', kwargs={'pk': self.user.pk}), {}),
+            ('HydroponicsViewSet.list', reverse('hydroponics-list'), {}),
+            ('HydroponicsViewSet.list', reverse('hydroponics-list'), {'readings_limit': 0}),
+            ('HydroponicsViewSet.retrieve', reverse('hydroponics-detail', kwargs=hydro), {}),
+            ('HydroponicsViewSet.latest', reverse('hydroponics-latest', kwargs=hydro), {}),
+            ('HydroponicsViewSet.aggregate', reverse('hydroponics-aggregate', kwargs=hydro), {}),
+            ('HydroponicsViewSet.analysis', reverse('hydroponics-analysis', kwargs=hydro), {}),
+            ('HydroponicsViewSet.series', reverse('hydroponics-series', kwargs=hydro), {}),
+            ('SensorReadingViewSet.list', reverse('sensorreading-list'), {'hydroponics__name__icontains': 'sys'}),
+            ('SensorReadingViewSet.retrieve', reverse('sensorreading-detail', kwargs={'pk': reading.pk}), {}),
+            ('SensorReadingViewSet.aggregate', reverse('sensorreading-aggregate'), {'group_by': 'hydroponics'}),
+            ('SensorReadingViewSet.export', reverse('sensorreading-export'), {}),
+            ('AlertRuleViewSet.list', reverse('alertrule-list'), {}),
+            ('AlertRuleViewSet.retrieve', reverse('alertrule-detail', kwargs={'pk': rule.pk}), {}),
+            ('AlertEventViewSet.list', reverse('alertevent-list'), {}),
+            ('AlertEventViewSet.retrieve', reverse('alertevent-detail', kwargs={'pk': event.pk}), {}),
+        ]
+
+    def count_queries(self, name, method, url, data=None):
+        """
+        Make a request to a budgeted action, failing if it is over budget, and return its number of queries.
+        """
+        viewset, action = name.split('.')
+        self.assertIn(action, getattr(views, viewset).query_budgets, f'{name} has no query budget')
+        with instrumentation.QueryCounter() as queries:
+            response = getattr(self.client, method)(url, data, format='json' if method != 'get' else None)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elif response.status_code >= 300:
+            self.fail(f'{name} returned {response.status_code}: {response.content[:200]}')
+        return queries.count
+
+    def test_read_budgets(self):
+        counts = [self.count_queries(name, 'get', url, data) for name, url, data in self.read_requests()]
+        # more users, systems, readings, rules and events do not run more queries
+        self.add_systems(self.user, 2, 5)
+        for index in range(3):
+            self.add_systems(User.objects.create_user(username=f'user{index}'), 3, 5)
+        cache.clear()
+        for (name, url, data), count in zip(self.read_requests(), counts):
+            self.assertEqual(self.count_queries(name, 'get', url, data), count, name)
+
+
+    def test_write_budgets(self):
+        self.add_systems(self.user, 2, 3)
+        hydro_url = reverse('hydroponics-detail', kwargs={'pk': self.hydro.pk})
+        reading = SensorReading.objects.filter(hydroponics=self.hydro).first()
+        reading_url = reverse('sensorreading-detail', kwargs={'pk': reading.pk})
+        rule_url = reverse('alertrule-detail', kwargs={'pk': self.hydro.alert_rules.get().pk})
+        systems = Hydroponics.objects.filter(owner=self.user)
+        requests = [
+            ('UserViewSet.partial_update', 'patch', reverse('user-detail', kwargs={'pk': self.user.pk}),
+             {'username': 'renamed'}),
+            ('HydroponicsViewSet.create', 'post', reverse('hydroponics-list'), {'name': 'New'}),
+            ('HydroponicsViewSet.update', 'put', hydro_url, {'name': 'Renamed'}),
+            ('HydroponicsViewSet.partial_update', 'patch', hydro_url, {'name': 'Renamed again'}),
+            ('SensorReadingViewSet.create', 'post', reverse('sensorreading-list'), {'hydroponics': hydro_url, 'ph': 6}),
+            ('SensorReadingViewSet.update', 'put', reading_url, {'hydroponics': hydro_url, 'ph': 6.1}),
+            ('SensorReadingViewSet.partial_update', 'patch', reading_url, {'ph': 6.2}),
+            ('SensorReadingViewSet.bulk', 'post', reverse('sensorreading-bulk'), [
+                {'hydroponics': system.pk, 'ph': 6.0} for system in systems for _ in range(3)
+            ]),
+            ('AlertRuleViewSet.create', 'post', reverse('alertrule-list'), {
+                'hydroponics': hydro_url, 'name': 'High pH', 'metric': 'ph', 'comparator': 'gt', 'threshold': 7,
+            }),
+            ('AlertRuleViewSet.partial_update', 'patch', rule_url, {'threshold': 2500}),
+            ('AlertRuleViewSet.destroy', 'delete', rule_url, None),
+            ('SensorReadingViewSet.destroy', 'delete', reading_url, None),
+            ('HydroponicsViewSet.destroy', 'delete', hydro_url, None),
+            ('UserViewSet.destroy', 'delete', reverse('user-detail', kwargs={'pk': self.user.pk}), None),
+        ]
+        for name, method, url, data in requests:
+            self.count_queries(name, method, url, data)
+
+    def test_over_budget(self):
+        url = reverse('alertevent-list')
+        with patch.object(views.AlertEventViewSet, 'query_budgets', {'list': 2}):
+            with self.assertRaisesMessage(budgets.QueryBudgetExceeded, 'AlertEventViewSet.list ran 3 queries'):
+                self.client.get(url)
+            with override_settings(HYDROPONICS_QUERY_BUDGETS='log'):
+                with self.assertLogs('lunasci.hydroponics.budgets', 'WARNING'):
+                    self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRoutingTests(APITransactionTestCase):
+    """
+    Routes reads to a second connection to the test database, standing in for a replica,
+    which is why the tests commit their data. The connection is only added once the test
+    runner checked the configured databases.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        connections.settings['replica'] = {**connection.settings_dict, 'TEST': {'MIRROR': DEFAULT_DB_ALIAS}}
+        cls.databases = {DEFAULT_DB_ALIAS, 'replica'}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        del cls.databases
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='pass123')
+        self.hydro = Hydroponics.objects.create(owner=self.user, name='Replicated System')
+        SensorReading.objects.create(hydroponics=self.hydro, ph=6.0, temperature=21, tds=800)
+        self.client.login(username='testuser', password='pass123')
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            with CaptureQueriesContext(connection) as primary:
+                response = self.client.get(url, params)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(replica), len(primary)
+
+    def test_safe_requests_read_from_replica(self):
+        for url, params in [
+            (reverse('user-list'), {}),
+            (reverse('hydroponics-list'), {}),
+            (reverse('hydroponics-detail', kwargs={'pk': self.hydro.pk}), {}),
+            (reverse('sensorreading-list'), {'hydroponics__name__icontains': 'replicated'}),
+            (reverse('sensorreading-aggregate'), {'group_by': 'hydroponics'}),
+            (reverse('sensorreading-export'), {}),
+        ]:
+            with self.subTest(url=url):
+                response, replica, _ = self.get(url, **params)
+                self.assertGreater(replica, 0)
+                self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_reads_stick_to_primary_after_write(self):
+        response = self.client.post(reverse('hydroponics-list'), {'name': 'New System'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        cookie = response.cookies[routers.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.POSTGRES_REPLICA_PIN_SECONDS)
+        response, replica, pinned = self.get(reverse('hydroponics-list'))
+        self.assertEqual(replica, 0)
+        self.assertIn('New System', [system['name'] for system in response.data['results']])
+
+        self.client.cookies.pop(routers.PIN_COOKIE)
+        _, replica, primary = self.get(reverse('hydroponics-list'))
+        self.assertGreater(replica, 0)
+        # the reads made on the replica once unpinned were made on the primary while pinned
+        self.assertGreater(pinned, primary)
+
+    def test_failed_write_does_not_pin(self):
+        response = self.client.post(reverse('hydroponics-list'), {'name': 'x' * 513}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_no_replicas(self):
+        with override_settings(REPLICA_DATABASES=[]):
+            _, replica, _ = self.get(reverse('hydroponics-list'))
+            response = self.client.post(reverse('hydroponics-list'), {'name': 'New System'}, format='json')
+        self.assertEqual(replica, 0)
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_router(self):
+        router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Hydroponics))
+        with routers.read_from_replica() as alias:
+            self.assertEqual(alias, 'replica')
+            self.assertEqual(router.db_for_read(Hydroponics), 'replica')
+            self.assertEqual(router.db_for_read(User), 'replica')
+            self.assertIsNone(router.db_for_read(Session))
+            self.assertEqual(router.db_for_write(Hydroponics), DEFAULT_DB_ALIAS)
+        self.assertIsNone(router.db_for_read(Hydroponics))
+        self.assertFalse(router.allow_migrate('replica', 'hydroponics'))
+        self.assertIsNone(router.allow_migrate(DEFAULT_DB_ALIAS, 'hydroponics'))
+
+
 class ModelTests(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='modeltester', password='pass123')
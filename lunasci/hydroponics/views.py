@@ -5,25 +5,72 @@ It includes viewsets for managing:
     - Users (UserViewSet)
     - Hydroponics systems (HydroponicsViewSet)
     - Sensor readings (SensorReadingViewSet)
+    - Alert rules (AlertRuleViewSet) and the events they record (AlertEventViewSet)
 
 It also defines custom filter classes for these resources to enable flexible query parameters.
 """
 
+from copy import copy
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 
-from rest_framework import permissions, viewsets, generics
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema, extend_schema_view
+from rest_framework import permissions, viewsets, generics, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied, UnsupportedMediaType, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 import django_filters
+from django_filters.constants import EMPTY_VALUES
 
-from lunasci.hydroponics.models import Hydroponics, SensorReading
+from lunasci.database import repeatable_read
+from lunasci.hydroponics.aggregates import BUCKETS, aggregate_readings
+from lunasci.hydroponics.alerts import invalidate_rule_index
+from lunasci.hydroponics.analysis import METRICS, analyze_window, load_window
+from lunasci.hydroponics.authentication import DeviceKeyAuthentication
+from lunasci.hydroponics.budgets import QueryBudgetMixin
+from lunasci.hydroponics.cache import get_cached_latest, get_latest
+from lunasci.hydroponics.conditional import ConditionalRequestMixin, ResourceState, fleet_state
+from lunasci.hydroponics.downsample import DOWNSAMPLERS, downsample_window
+from lunasci.hydroponics.export import EXPORT_FORMATS, ExportContentNegotiation, export_readings
+from lunasci.hydroponics.ingest import (
+    bulk_ingest,
+    copy_ingest,
+    insert_readings,
+    iter_csv_rows,
+    iter_ndjson_rows,
+    readings_changed,
+    readings_created,
+)
+from lunasci.hydroponics.models import (
+    AlertEvent, AlertRule, DeviceKey, Hydroponics, ReadingRollup, SensorReading,
+)
+from lunasci.hydroponics.pagination import CreatedCursorPagination
+from lunasci.hydroponics.parsers import NDJSONParser
 
 from lunasci.hydroponics.serializers import (
+    AlertEventSerializer,
+    AlertRuleSerializer,
     HydroponicsSerializer,
+    LatestReadingSerializer,
     UserSerializer,
-    SensorReadingSerializer
+    SensorReadingSerializer,
+    SensorReadingBulkSerializer,
+    SensorReadingRowSerializer,
 )
-from lunasci.hydroponics.permissions import IsOwnerOrReadOnly, IsSelfOrReadOnly
+from lunasci.hydroponics.permissions import (
+    IsAuthenticatedOrDeviceOrReadOnly, IsHydroponicsOwnerOrReadOnly, IsOwnerOrReadOnly, IsSelfOrReadOnly,
+)
+from lunasci.hydroponics.rollups import PERIODS, aggregate_rollups, get_watermark, refresh_buckets
+from lunasci.routers import ReplicaReadMixin
 
 User = get_user_model()
 
@@ -54,6 +101,10 @@ class HydroponicsFilter(django_filters.FilterSet):
         id: Allows filtering based on exact, greater than or equal, and less than or equal values.
         name: Allows filtering based on exact match and case-insensitive containment or prefix.
         owner__username: Allows filtering based on the owner's username.
+        last_reading_at: Allows filtering based on the time of the latest sensor reading,
+            e.g. to find systems that stopped reporting.
+
+    The case-insensitive name and username filters are served by trigram indexes.
     """
     created = django_filters.DateFromToRangeFilter()
 
@@ -63,8 +114,38 @@ class HydroponicsFilter(django_filters.FilterSet):
             'id': ['exact', 'gte', 'lte'],
             'name': ['exact', 'icontains', 'istartswith'],
             'owner__username': ['exact', 'icontains', 'istartswith'],
+            'last_reading_at': ['gte', 'lte', 'isnull'],
         }
 
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    """
+    Filters on a comma separated list of numbers.
+    """
+
+class HydroponicsNameFilter(django_filters.CharFilter):
+    """
+    Filters on the name of the related hydroponics system by resolving the name to the ids of
+    the matching systems first, with the trigram index on hydroponics names, and then filtering
+    on the indexed hydroponics_id column, instead of joining every row to hydroponics.
+
+    When more than max_ids systems match, the ids are left to a subquery instead of being listed.
+
+    Attributes:
+        max_ids (int): The largest number of ids listed in the query.
+    """
+    max_ids = 1000
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        # the filter may be applied to the readings and to the rollups, resolve the name once
+        resolved = getattr(self, '_resolved', None)
+        if resolved is None or resolved[0] != value:
+            systems = Hydroponics.objects.filter(**{f'name__{self.lookup_expr}': value}).values('pk')
+            ids = [row['pk'] for row in systems[:self.max_ids + 1]]
+            self._resolved = resolved = (value, systems if len(ids) > self.max_ids else ids)
+        return qs.filter(hydroponics_id__in=resolved[1])
+
 class SensorReadingFilter(django_filters.FilterSet):
     """
     Provides filtering options for the SensorReading model.
@@ -72,22 +153,195 @@ class SensorReadingFilter(django_filters.FilterSet):
     Filters:
         created: Allows filtering sensor readings based on a date range.
         id: Allows filtering based on exact, greater than or equal, and less than or equal values.
-        hydroponics__name: Allows filtering sensor readings by the name of the related hydroponics.
+        hydroponics: Allows filtering sensor readings by the id, or a list of ids, of the related hydroponics.
+        hydroponics__name: Allows filtering sensor readings by the name of the related hydroponics,
+            see HydroponicsNameFilter.
         ph, temperature, tds: Allows filtering based on ==, >= and <= operators.
     """
     created = django_filters.DateFromToRangeFilter()
+    # plain number filters, so that filtering by id does not load the hydroponics instance
+    hydroponics = django_filters.NumberFilter(field_name='hydroponics_id')
+    hydroponics__in = NumberInFilter(field_name='hydroponics_id')
+    hydroponics__name = HydroponicsNameFilter(field_name='hydroponics__name')
+    hydroponics__name__icontains = HydroponicsNameFilter(field_name='hydroponics__name', lookup_expr='icontains')
+    hydroponics__name__istartswith = HydroponicsNameFilter(field_name='hydroponics__name', lookup_expr='istartswith')
 
     class Meta:
         model = SensorReading
         fields = {
             'id': ['exact', 'gte', 'lte'],
-            'hydroponics__name': ['exact', 'icontains', 'istartswith'],
             'ph': ['exact', 'gte', 'lte'],
             'temperature': ['exact', 'gte', 'lte'],
             'tds': ['exact', 'gte', 'lte'],
         }
 
-class UserViewSet(viewsets.ModelViewSet):
+class AlertRuleFilter(django_filters.FilterSet):
+    """
+    Provides filtering options for the AlertRule model.
+
+    Filters:
+        hydroponics: Allows filtering alert rules by the id of the related hydroponics.
+        metric, comparator, state, enabled: Allows filtering based on exact match.
+    """
+    hydroponics = django_filters.NumberFilter(field_name='hydroponics_id')
+
+    class Meta:
+        model = AlertRule
+        fields = ['metric', 'comparator', 'state', 'enabled']
+
+class AlertEventFilter(django_filters.FilterSet):
+    """
+    Provides filtering options for the AlertEvent model.
+
+    Filters:
+        created: Allows filtering alert events based on a date range.
+        hydroponics, rule: Allows filtering alert events by the id of the related hydroponics or rule.
+        kind, metric: Allows filtering based on exact match.
+    """
+    created = django_filters.DateFromToRangeFilter()
+    hydroponics = django_filters.NumberFilter(field_name='hydroponics_id')
+    rule = django_filters.NumberFilter(field_name='rule_id')
+
+    class Meta:
+        model = AlertEvent
+        fields = ['kind', 'metric']
+
+# Sensor reading filters that can be applied to rollups as well
+ROLLUP_FILTERS = {
+    'created',
+    'hydroponics',
+    'hydroponics__in',
+    'hydroponics__name',
+    'hydroponics__name__icontains',
+    'hydroponics__name__istartswith',
+}
+
+def readings_limit(query_params):
+    """
+    Return the number of latest sensor readings to embed in hydroponics instances, taken from
+    the `readings_limit` query parameter and capped at HYDROPONICS_READINGS_LIMIT_MAX.
+    """
+    value = query_params.get('readings_limit', settings.HYDROPONICS_READINGS_LIMIT)
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({'readings_limit': ['A valid integer is required.']}) from None
+    if limit < 0:
+        raise ValidationError({'readings_limit': ['Ensure this value is greater than or equal to 0.']})
+    return min(limit, settings.HYDROPONICS_READINGS_LIMIT_MAX)
+
+def analysis_options(query_params):
+    """
+    Return the window, z_threshold and alpha of the analysis endpoint,
+    taken from the query parameters of the same names.
+    """
+    errors = {}
+    options = {}
+    for name, cast, default, valid, message in (
+        ('window', int, 60, lambda value: value >= 2, 'Ensure this value is greater than or equal to 2.'),
+        ('z_threshold', float, 3.0, lambda value: value > 0, 'Ensure this value is greater than 0.'),
+        ('alpha', float, 0.01, lambda value: 0 < value <= 1, 'Ensure this value is in the range (0, 1].'),
+    ):
+        try:
+            options[name] = cast(query_params.get(name, default))
+        except (TypeError, ValueError):
+            errors[name] = ['A valid number is required.']
+            continue
+        if not valid(options[name]):
+            errors[name] = [message]
+    if errors:
+        raise ValidationError(errors)
+    return options
+
+def series_options(query_params):
+    """
+    Return the metrics, max_points and method of the series endpoint, taken from the query
+    parameters of the same names, metrics being a comma separated list.
+    """
+    errors = {}
+    metrics = [metric.strip() for metric in query_params.get('metrics', ','.join(METRICS)).split(',')]
+    if not metrics or set(metrics) - set(METRICS):
+        errors['metrics'] = [f'Expected a comma separated list of: {", ".join(METRICS)}.']
+    try:
+        max_points = int(query_params.get('max_points', settings.HYDROPONICS_SERIES_POINTS))
+    except (TypeError, ValueError):
+        errors['max_points'] = ['A valid integer is required.']
+    else:
+        if not 3 <= max_points <= settings.HYDROPONICS_SERIES_MAX_POINTS:
+            errors['max_points'] = [
+                f'Ensure this value is between 3 and {settings.HYDROPONICS_SERIES_MAX_POINTS}.'
+            ]
+    method = query_params.get('method', 'lttb')
+    if method not in DOWNSAMPLERS:
+        errors['method'] = [f'Expected one of: {", ".join(DOWNSAMPLERS)}.']
+    if errors:
+        raise ValidationError(errors)
+    return {'metrics': list(dict.fromkeys(metrics)), 'max_points': max_points, 'method': method}
+
+def aggregate_data(query_params, filterset, rollups):
+    """
+    Compute the data of an aggregation endpoint over the readings selected by the filterset.
+
+    The bucket size is taken from the `bucket` query parameter, and the buckets are split
+    per hydroponics system when `group_by=hydroponics` is passed.
+
+    Hourly and daily buckets are served from the given rollups queryset when the filters
+    only narrow down the systems and the created range. The created filter works on whole
+    days, so its range always lines up with hour and day buckets. The watermark, the rollups
+    and the readings above the watermark are read in a single REPEATABLE READ snapshot.
+    """
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+    bucket = query_params.get('bucket', '1h')
+    if bucket not in BUCKETS:
+        raise ValidationError({'bucket': [f'Expected one of: {", ".join(BUCKETS)}.']})
+    per_system = query_params.get('group_by') == 'hydroponics'
+    max_buckets = settings.HYDROPONICS_AGGREGATE_MAX_BUCKETS
+
+    cleaned_data = {
+        name: value for name, value in filterset.form.cleaned_data.items()
+        if value not in (None, '', [])
+    }
+    results = None
+    if bucket in PERIODS and set(cleaned_data) <= ROLLUP_FILTERS:
+        for name, value in cleaned_data.items():
+            if name == 'created':
+                if value.start is not None:
+                    rollups = rollups.filter(bucket__gte=value.start)
+                if value.stop is not None:
+                    rollups = rollups.filter(bucket__lte=value.stop)
+            else:
+                rollups = filterset.filters[name].filter(rollups, value)
+        # a catch-up committing between the queries would count readings in the rollups and the tail
+        with repeatable_read(filterset.qs.db):
+            watermark = get_watermark()
+            if watermark is not None:
+                source = 'rollup'
+                results = aggregate_rollups(
+                    rollups, filterset.qs, bucket, watermark,
+                    per_system=per_system, limit=max_buckets + 1,
+                )
+    if results is None:
+        source = 'raw'
+        results = aggregate_readings(
+            filterset.qs, bucket,
+            per_system=per_system, limit=max_buckets + 1,
+        )
+
+    if len(results) > max_buckets:
+        raise ValidationError({'bucket': [
+            f'The query yields more than {max_buckets} buckets, '
+            'use a larger bucket or a narrower created range.'
+        ]})
+    return {'bucket': bucket, 'source': source, 'results': results}
+
+def aggregate_response(request, filterset, rollups):
+    """
+    Build the response of an aggregation endpoint, see aggregate_data.
+    """
+    return Response(aggregate_data(request.query_params, filterset, rollups))
+
+class UserViewSet(QueryBudgetMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing user accounts.
 
@@ -99,6 +353,8 @@ class UserViewSet(viewsets.ModelViewSet):
       - Creation of new users via this endpoint is disallowed.
 
     Adding and managing users can be done trough the admin panel at /admin
+
+    Safe requests read from a replica when replicas are configured, see ReplicaReadMixin.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -110,21 +366,182 @@ class UserViewSet(viewsets.ModelViewSet):
         'date_joined': ['exact', 'gte', 'lte'], 
         'username': ['exact', 'gte', 'lte'],
     }
+    query_budgets = {
+        'list': 5, 'retrieve': 4, 'update': 8, 'partial_update': 8, 'destroy': 17,
+    }
+
+    def get_queryset(self):
+        """
+        Prefetch the ids of the hydroponics systems linked from every user in one query.
+        """
+        return super().get_queryset().prefetch_related(
+            Prefetch('hydroponics', queryset=Hydroponics.objects.only('id', 'owner_id').order_by('id'))
+        )
 
-class HydroponicsViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        """
+        Bumps the versions of the user's hydroponics systems when the username changes,
+        since it is embedded in their representation as the owner.
+        """
+        username = serializer.instance.username
+        user = serializer.save()
+        if user.username != username:
+            Hydroponics.objects.filter(owner=user).update(version=F('version') + 1, modified=timezone.now())
+
+class HydroponicsViewSet(QueryBudgetMixin, ReplicaReadMixin, ConditionalRequestMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Hydroponics instances.
     
     Provides operations to list, retrieve, create, update, and delete hydroponics 
     systems. Only authenticated users can create or update, and only the owner 
     of a hydroponics instance is allowed to modify it.
+
+    The number of latest sensor readings embedded in every instance can be set
+    with the `readings_limit` query parameter. The readings of all instances
+    on a page are fetched with a single query.
+
+    Lists and instances carry ETag and Last-Modified headers derived from
+    Hydroponics.version, see ConditionalRequestMixin. Safe requests read from
+    a replica when replicas are configured, see ReplicaReadMixin.
     """
     queryset = Hydroponics.objects.all()
     serializer_class = HydroponicsSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-    ordering = ['created']
-    ordering_fields = '__all__'
+    pagination_class = CreatedCursorPagination
+    ordering = ['created', 'id']
+    # cursors skip rows whose ordering field is NULL, see CreatedCursorPagination
+    ordering_fields = ['id', 'created', 'name', 'modified']
     filterset_class = HydroponicsFilter
+    query_budgets = {
+        'list': 5, 'retrieve': 5, 'create': 5, 'update': 9, 'partial_update': 8, 'destroy': 13,
+        'latest': 4, 'aggregate': 6, 'analysis': 3, 'series': 3,
+    }
+
+    def get_readings_limit(self):
+        return readings_limit(self.request.query_params)
+
+    def get_queryset(self):
+        """
+        Fetch the owners along with the hydroponics instances and prefetch the latest
+        readings of every instance in one query. Django compiles the sliced prefetch into
+        ROW_NUMBER() OVER (PARTITION BY hydroponics_id ORDER BY created DESC).
+        The latest reading is prefetched even with a zero `readings_limit`, since it is
+        embedded as latest_reading, which would otherwise be loaded one instance at a time.
+        """
+        queryset = super().get_queryset().select_related('owner')
+        if self.action in ('list', 'retrieve'):
+            limit = max(self.get_readings_limit(), 1)
+            latest_readings = SensorReading.objects.order_by('-created', '-id')
+            queryset = queryset.prefetch_related(
+                Prefetch('readings', queryset=latest_readings[:limit], to_attr='latest_readings')
+            )
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'retrieve'):
+            context['readings_limit'] = self.get_readings_limit()
+        return context
+
+    def get_list_state(self):
+        return fleet_state()
+
+    def get_object_state(self, pk, lock=False):
+        systems = Hydroponics.objects.filter(pk=pk)
+        if lock:
+            systems = systems.select_for_update()
+        state = systems.values('version', 'modified').first()
+        if state is None:
+            return None
+        return ResourceState(f'hydroponics:{pk}:{state["version"]}', state['modified'])
+
+    @action(detail=True, methods=['get'])
+    def aggregate(self, request, pk=None):
+        """
+        Aggregate the sensor readings of this hydroponics system into time buckets.
+
+        Returns the count and the min, max, avg, stddev and count of pH, temperature
+        and TDS per bucket. The bucket size is set with `bucket` (1m, 5m, 1h or 1d),
+        and the readings can be narrowed down with the sensor reading filters.
+        """
+        hydroponics = self.get_object()
+        filterset = SensorReadingFilter(
+            request.query_params,
+            queryset=SensorReading.objects.filter(hydroponics=hydroponics),
+            request=request,
+        )
+        return aggregate_response(
+            request, filterset, ReadingRollup.objects.filter(hydroponics=hydroponics)
+        )
+
+    @action(detail=True, methods=['get'])
+    def analysis(self, request, pk=None):
+        """
+        Detect anomalies and drift in the sensor readings of this hydroponics system.
+
+        Analyzes the latest HYDROPONICS_ANALYSIS_MAX_ROWS readings matching the sensor
+        reading filters with NumPy, see lunasci.hydroponics.analysis. For pH, temperature and
+        TDS it returns summary statistics, the rolling mean and stddev over the last `window`
+        readings, the EWMA with smoothing factor `alpha` and its drift, the rate of change
+        per hour and the readings whose z-score exceeds `z_threshold`.
+        """
+        hydroponics = self.get_object()
+        options = analysis_options(request.query_params)
+        filterset = SensorReadingFilter(
+            request.query_params,
+            queryset=SensorReading.objects.filter(hydroponics=hydroponics),
+            request=request,
+        )
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        readings = load_window(filterset.qs, settings.HYDROPONICS_ANALYSIS_MAX_ROWS)
+        return Response(analyze_window(readings, **options))
+
+    @action(detail=True, methods=['get'])
+    def series(self, request, pk=None):
+        """
+        Return the sensor readings of this hydroponics system downsampled for charting.
+
+        Selects the latest HYDROPONICS_ANALYSIS_MAX_ROWS readings matching the sensor reading
+        filters and reduces every metric listed in `metrics` to at most `max_points`
+        [timestamp, value] pairs, timestamps being milliseconds since the Unix epoch.
+        The points are selected with Largest-Triangle-Three-Buckets (method=lttb, default)
+        or as the minimum and maximum of every bucket (method=minmax),
+        see lunasci.hydroponics.downsample.
+        """
+        hydroponics = self.get_object()
+        options = series_options(request.query_params)
+        filterset = SensorReadingFilter(
+            request.query_params,
+            queryset=SensorReading.objects.filter(hydroponics=hydroponics),
+            request=request,
+        )
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        readings = load_window(filterset.qs, settings.HYDROPONICS_ANALYSIS_MAX_ROWS)
+        return Response({
+            'count': len(readings),
+            'truncated': readings.truncated,
+            'method': options['method'],
+            'max_points': options['max_points'],
+            'series': downsample_window(readings, **options),
+        })
+
+    @action(detail=True, methods=['get'])
+    def latest(self, request, pk=None):
+        """
+        Return the latest sensor reading of this hydroponics system.
+
+        Served from the latest reading cache, so on a cache hit
+        the database is not queried at all.
+        """
+        snapshot = get_cached_latest(pk)
+        if snapshot is None:
+            hydroponics = self.get_object()
+            snapshot = get_latest(hydroponics.pk)
+        if not snapshot:
+            raise NotFound('This hydroponics system has no sensor readings.')
+        return Response(LatestReadingSerializer(snapshot, context={'request': request}).data)
 
     def perform_create(self, serializer):
         """
@@ -133,20 +550,313 @@ class HydroponicsViewSet(viewsets.ModelViewSet):
         """
         serializer.save(owner=self.request.user)
 
-class SensorReadingViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        serializer.save(version=F('version') + 1)
+
+@extend_schema_view(list=extend_schema(responses=SensorReadingSerializer))
+class SensorReadingViewSet(QueryBudgetMixin, ReplicaReadMixin, ConditionalRequestMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing SensorReading instances.
     
     Provides operations to list, retrieve, create, update, and delete sensor 
     readings. Access is allowed for both authenticated and unauthenticated users,
     but modification rights are controlled by the configured permissions.
+
+    Lists are paginated with cursors, see CreatedCursorPagination, and serialized
+    from value rows with SensorReadingRowSerializer. Lists and instances carry ETag
+    and Last-Modified headers derived from the version of the hydroponics systems,
+    see ConditionalRequestMixin.
+
+    Creating a reading is idempotent when the device numbers its readings: sending
+    a reading already stored under the same device_seq and measurement timestamp
+    returns the stored reading with a 200 status instead of creating it again.
+
+    Safe requests, including aggregates and exports, read from a replica when
+    replicas are configured, see ReplicaReadMixin.
+
+    Devices authenticated with a device key may create readings, one by one or in bulk,
+    for the hydroponics system of their key only, see lunasci.hydroponics.authentication.
     """
     queryset = SensorReading.objects.all()
     serializer_class = SensorReadingSerializer
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    ordering = ['created']
-    ordering_fields = '__all__'
+    authentication_classes = [*api_settings.DEFAULT_AUTHENTICATION_CLASSES, DeviceKeyAuthentication]
+    permission_classes = [IsAuthenticatedOrDeviceOrReadOnly]
+    device_actions = ('create', 'bulk')
+    pagination_class = CreatedCursorPagination
+    ordering = ['created', 'id']
+    # cursors skip rows whose ordering field is NULL, see CreatedCursorPagination
+    ordering_fields = ['id', 'created']
     filterset_class = SensorReadingFilter
+    # hydroponics__name filters resolve the ids of the matching systems with a query of their own,
+    # and updates and deletions recompute the rollup buckets of the readings, see refresh_buckets
+    query_budgets = {
+        'list': 5, 'retrieve': 4, 'create': 6, 'update': 20, 'partial_update': 19, 'destroy': 13,
+        'bulk': 7, 'aggregate': 6, 'export': 3,
+    }
+
+    def get_queryset(self):
+        """
+        Fetch plain value rows instead of model instances for the list endpoint.
+        """
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = queryset.values(*SensorReadingRowSerializer.ROW_FIELDS)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return SensorReadingRowSerializer
+        return super().get_serializer_class()
+
+    def get_list_state(self):
+        return fleet_state()
+
+    def get_device_scope(self):
+        """
+        Return the ids of the hydroponics systems the request may write readings of,
+        that of its device key, or None when it is not restricted.
+        """
+        if isinstance(self.request.auth, DeviceKey):
+            return {self.request.auth.hydroponics_id}
+        return None
+
+    def get_object_state(self, pk, lock=False):
+        readings = SensorReading.objects.filter(pk=pk)
+        if lock:
+            # the version of a reading is the one of its system, lock that row instead
+            hydroponics_id = readings.values_list('hydroponics_id', flat=True).first()
+            state = (
+                Hydroponics.objects.select_for_update()
+                .filter(pk=hydroponics_id)
+                .values('version', 'modified')
+                .first()
+            )
+        else:
+            state = readings.values(
+                version=F('hydroponics__version'), modified=F('hydroponics__modified'),
+            ).first()
+        if state is None:
+            return None
+        return ResourceState(f'sensorreading:{pk}:{state["version"]}', state['modified'])
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        scope = self.get_device_scope()
+        if scope is not None and serializer.validated_data['hydroponics'].pk not in scope:
+            raise PermissionDenied('Device keys can only write readings of their own hydroponics system.')
+        created = self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        response_status = status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        return Response(serializer.data, status=response_status, headers=headers)
+
+    def perform_create(self, serializer):
+        """
+        Insert the reading unless it is already stored, and return whether it was inserted.
+        """
+        reading = SensorReading(**serializer.validated_data)
+        created = insert_readings([reading])
+        if created:
+            serializer.instance = created[0]
+            readings_created(created)
+        else:
+            serializer.instance = SensorReading.objects.get(
+                hydroponics=reading.hydroponics_id, device_seq=reading.device_seq, created=reading.created,
+            )
+        return bool(created)
+
+    def perform_update(self, serializer):
+        previous = copy(serializer.instance)
+        reading = serializer.save()
+        refresh_buckets(removed=[previous], added=[reading])
+        readings_changed({previous.hydroponics_id, reading.hydroponics_id})
+
+    def perform_destroy(self, instance):
+        # deleting clears the primary key of the instance
+        deleted = copy(instance)
+        instance.delete()
+        refresh_buckets(removed=[deleted])
+        readings_changed({instance.hydroponics_id})
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='bulk',
+        parser_classes=[JSONParser, NDJSONParser],
+        serializer_class=SensorReadingBulkSerializer,
+    )
+    def bulk(self, request):
+        """
+        Ingest a batch of sensor readings for one or many hydroponics systems.
+
+        Accepts a JSON array or an NDJSON body of readings. Each reading references
+        its hydroponics system by id or hyperlink, and may carry its measurement
+        timestamp `created` and a `device_seq` sequence number. Valid readings are
+        inserted even if other rows of the batch are rejected; the response lists
+        the number of created readings, the number of readings skipped because
+        they were already stored, and the errors of every rejected row by its index.
+        Batches can therefore be sent again safely after a timeout. Requests authenticated
+        with a device key have the rows of any other system than theirs rejected.
+
+        With ?mode=copy, a CSV or NDJSON body is streamed into the database
+        with COPY instead, which has no size limit.
+        """
+        if request.query_params.get('mode') == 'copy':
+            return self._bulk_copy(request)
+
+        rows = request.data
+        if not isinstance(rows, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of readings.']})
+        if len(rows) > settings.HYDROPONICS_BULK_MAX_ROWS:
+            raise ValidationError({'non_field_errors': [
+                f'A batch may contain at most {settings.HYDROPONICS_BULK_MAX_ROWS} readings.'
+            ]})
+
+        readings, errors, duplicates = bulk_ingest(rows, hydroponics_ids=self.get_device_scope())
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif readings or duplicates:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {'created': len(readings), 'duplicates': duplicates, 'errors': errors},
+            status=response_status,
+        )
+
+    @action(detail=False, methods=['get'])
+    def aggregate(self, request):
+        """
+        Aggregate the filtered sensor readings into time buckets.
+
+        Accepts the same filters as the list endpoint and returns the count and the
+        min, max, avg, stddev and count of pH, temperature and TDS per bucket.
+        The bucket size is set with `bucket` (1m, 5m, 1h or 1d). Buckets span all
+        matching systems, unless `group_by=hydroponics` is passed.
+        """
+        filterset = SensorReadingFilter(
+            request.query_params,
+            queryset=self.get_queryset(),
+            request=request,
+        )
+        return aggregate_response(request, filterset, ReadingRollup.objects.all())
+
+    @extend_schema(
+        parameters=[OpenApiParameter('export_format', enum=list(EXPORT_FORMATS), default='csv')],
+        responses={200: OpenApiTypes.BINARY},
+    )
+    @action(
+        detail=False,
+        methods=['get'],
+        content_negotiation_class=ExportContentNegotiation,
+        pagination_class=None,
+    )
+    def export(self, request):
+        """
+        Stream all filtered sensor readings as a file download.
+
+        Accepts the same filters and ordering as the list endpoint. The format is set with
+        `export_format`: csv (default), ndjson, or binary, a packed column layout that can
+        be loaded straight into NumPy, see lunasci.hydroponics.export.
+        """
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': [f'Expected one of: {", ".join(EXPORT_FORMATS)}.']})
+        export_format = EXPORT_FORMATS[export_format]
+        queryset = self.filter_queryset(self.get_queryset())
+        # the rows are fetched once the request was handled, fix the database it was routed to
+        queryset = queryset.using(queryset.db)
+        response = StreamingHttpResponse(
+            export_readings(queryset, export_format.name),
+            content_type=export_format.media_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="sensor_readings.{export_format.extension}"'
+        return response
+
+    def _bulk_copy(self, request):
+        """
+        Stream a CSV or NDJSON request body straight into the database with COPY.
+        """
+        media_type = request.content_type.split(';')[0].strip()
+        if media_type == 'text/csv':
+            decode_rows = iter_csv_rows
+        elif media_type == NDJSONParser.media_type:
+            decode_rows = iter_ndjson_rows
+        else:
+            raise UnsupportedMediaType(media_type)
+
+        stream = request.stream or []
+        lines = (line.decode(settings.DEFAULT_CHARSET) for line in stream)
+        result = copy_ingest(decode_rows(lines), hydroponics_ids=self.get_device_scope())
+        if not result.rejected:
+            response_status = status.HTTP_201_CREATED
+        elif result.created or result.duplicates:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({
+            'created': result.created,
+            'duplicates': result.duplicates,
+            'rejected': result.rejected,
+            'errors': result.errors,
+        }, status=response_status)
+
+class AlertRuleViewSet(QueryBudgetMixin, viewsets.ModelViewSet):
+    """
+    ViewSet for managing AlertRule instances.
+
+    Provides operations to list, retrieve, create, update, and delete alert rules.
+    Only authenticated users can create rules, for their own hydroponics systems,
+    and only the owner of the hydroponics system is allowed to modify its rules.
+
+    Rules are evaluated against every reading as it is ingested, see lunasci.hydroponics.alerts.
+    Their state is maintained by the evaluation and cannot be set through the API.
+    """
+    queryset = AlertRule.objects.select_related('hydroponics')
+    serializer_class = AlertRuleSerializer
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsHydroponicsOwnerOrReadOnly]
+    pagination_class = CreatedCursorPagination
+    ordering = ['created', 'id']
+    ordering_fields = ['id', 'created', 'metric', 'state']
+    filterset_class = AlertRuleFilter
+    query_budgets = {
+        'list': 3, 'retrieve': 3, 'create': 4, 'update': 4, 'partial_update': 4, 'destroy': 5,
+    }
+
+    def _rules_changed(self):
+        """
+        Drop the compiled rules of this process right away and once more after the commit,
+        so they are not reloaded from a snapshot preceding the change.
+        """
+        invalidate_rule_index()
+        transaction.on_commit(invalidate_rule_index)
+
+    def perform_create(self, serializer):
+        serializer.save()
+        self._rules_changed()
+
+    def perform_update(self, serializer):
+        serializer.save()
+        self._rules_changed()
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        self._rules_changed()
+
+class AlertEventViewSet(QueryBudgetMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for listing and retrieving AlertEvent instances.
+
+    An event is recorded whenever an alert rule triggers or resolves,
+    and lists are paginated with cursors, see CreatedCursorPagination.
+    """
+    queryset = AlertEvent.objects.all()
+    serializer_class = AlertEventSerializer
+    pagination_class = CreatedCursorPagination
+    ordering = ['created', 'id']
+    ordering_fields = ['id', 'created']
+    filterset_class = AlertEventFilter
+    query_budgets = {'list': 3, 'retrieve': 3}
 
 class APIRoot(generics.GenericAPIView):
     """
@@ -164,6 +874,8 @@ class APIRoot(generics.GenericAPIView):
             'users': reverse('user-list', request=request),
             'hydroponics': reverse('hydroponics-list', request=request),
             'sensor_readings': reverse('sensorreading-list', request=request),
+            'alert_rules': reverse('alertrule-list', request=request),
+            'alert_events': reverse('alertevent-list', request=request),
             'admin': reverse('admin:index', request=request),
             'api-schema': reverse('schema', request=request),
             'api-docs': reverse('docs', request=request),
@@ -0,0 +1,386 @@
+"""
+This module measures how the API spends its time.
+
+InstrumentationMiddleware records, for every request, its duration, the number of SQL queries
+it ran and their total time, the time spent rendering the response body and the size of the
+response, grouped by view: ViewSet.action for DRF viewsets, e.g. HydroponicsViewSet.list, and
+module.function for plain views. The figures are kept in memory per process and served in the
+Prometheus text format by metrics_view, along with the number of database connections set up
+and, when connections are pooled, the state of the pools.
+
+Queries are counted by a database execute wrapper installed on the connections of every thread
+handling requests, which only does work while a QueryCounter is active in the current context.
+Context variables follow sync_to_async, so queries run by async views are counted as well.
+
+Requests can optionally be profiled with cProfile: with PROFILE_SLOW_REQUESTS set, a
+PROFILE_SAMPLE_RATE fraction of the requests is profiled, and the profiles of those slower
+than PROFILE_SLOW_REQUESTS seconds are written to PROFILE_DIR, to be opened with pstats
+or snakeviz.
+
+It contains:
+    - QueryCounter: Counts the SQL queries run while it is active, and their time.
+    - MetricsRegistry: The request metrics of the current process.
+    - registry: The metrics registry of the current process.
+    - view_name: Returns the name requests to a view are grouped by.
+    - InstrumentationMiddleware: Records the metrics of every request.
+    - metrics_view: Serves the metrics in the Prometheus text format.
+"""
+
+import cProfile
+import logging
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_safe
+
+from lunasci.database import pool_stats
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the request duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# View name of the requests not routed to any view
+UNMATCHED = '<unmatched>'
+
+_counters = ContextVar('query_counters', default=())
+
+def _count_queries(execute, sql, params, many, context):
+    counters = _counters.get()
+    if not counters:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        for counter in counters:
+            counter.count += 1
+            counter.duration += elapsed
+
+def install_query_counting(**kwargs):
+    """
+    Install the query counting execute wrapper on the database connections of the current thread.
+
+    Also connected to request_started, which is sent from the thread running the queries
+    of the request, for async requests as well.
+    """
+    for connection in connections.all():
+        if _count_queries not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_count_queries)
+
+class QueryCounter:
+    """
+    Counts the SQL queries run in the current context while it is active, and their time.
+
+    Used as a context manager. Counters can be nested, every active counter counts the query.
+
+    Attributes:
+        count (int): The number of queries run.
+        duration (float): The total time of the queries, in seconds.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._token = None
+
+    def __enter__(self):
+        install_query_counting()
+        self._token = _counters.set((*_counters.get(), self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _counters.reset(self._token)
+
+class _ViewMetrics:
+    """
+    The aggregated metrics of the requests to one view.
+    """
+
+    def __init__(self):
+        self.requests = {}
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.sql_duration = 0.0
+        self.render = 0.0
+        self.sized = 0
+        self.size = 0
+
+class MetricsRegistry:
+    """
+    The request metrics of the current process, keyed by view name.
+
+    Attributes:
+        views (dict): The _ViewMetrics of every view.
+        connections (dict): The number of database connections set up, keyed by database alias.
+    """
+
+    def __init__(self):
+        self.views = {}
+        self.connections = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, method, status, duration, queries, sql_duration, render, size):
+        """
+        Record a request. size is None when the length of the response is not known up front.
+        """
+        with self._lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = _ViewMetrics()
+            key = (method, status)
+            metrics.requests[key] = metrics.requests.get(key, 0) + 1
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    metrics.buckets[index] += 1
+                    break
+            metrics.count += 1
+            metrics.duration += duration
+            metrics.queries += queries
+            metrics.sql_duration += sql_duration
+            metrics.render += render
+            if size is not None:
+                metrics.sized += 1
+                metrics.size += size
+
+    def connection_created(self, sender, connection, **kwargs):
+        """
+        Record a database connection being set up, connected to the connection_created signal.
+        With a pool, connections are set up whenever they are checked out of it.
+        """
+        with self._lock:
+            self.connections[connection.alias] = self.connections.get(connection.alias, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self.views = {}
+            self.connections = {}
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            views = sorted(self.views.items())
+            lines = [
+                '# HELP lunasci_http_requests_total Requests handled, by view, method and status.',
+                '# TYPE lunasci_http_requests_total counter',
+            ]
+            for view, metrics in views:
+                for (method, status), count in sorted(metrics.requests.items()):
+                    lines.append(
+                        f'lunasci_http_requests_total{_labels(view=view, method=method, status=status)} {count}'
+                    )
+
+            lines += [
+                '# HELP lunasci_http_request_duration_seconds Time taken to handle requests.',
+                '# TYPE lunasci_http_request_duration_seconds histogram',
+            ]
+            for view, metrics in views:
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS, metrics.buckets):
+                    cumulative += count
+                    lines.append(
+                        f'lunasci_http_request_duration_seconds_bucket{_labels(view=view, le=bound)} {cumulative}'
+                    )
+                lines += [
+                    f'lunasci_http_request_duration_seconds_bucket{_labels(view=view, le="+Inf")} {metrics.count}',
+                    f'lunasci_http_request_duration_seconds_sum{_labels(view=view)} {metrics.duration!r}',
+                    f'lunasci_http_request_duration_seconds_count{_labels(view=view)} {metrics.count}',
+                ]
+
+            for name, help_text, attribute, count_attribute in (
+                ('lunasci_http_request_db_queries', 'SQL queries run per request.', 'queries', 'count'),
+                ('lunasci_http_request_db_seconds', 'Time spent in SQL queries per request.',
+                 'sql_duration', 'count'),
+                ('lunasci_http_request_render_seconds', 'Time spent rendering response bodies.',
+                 'render', 'count'),
+                ('lunasci_http_response_size_bytes', 'Size of the response bodies of known length.',
+                 'size', 'sized'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} summary']
+                for view, metrics in views:
+                    value = getattr(metrics, attribute)
+                    lines += [
+                        f'{name}_sum{_labels(view=view)} {value!r}',
+                        f'{name}_count{_labels(view=view)} {getattr(metrics, count_attribute)}',
+                    ]
+
+            lines += [
+                '# HELP lunasci_db_connections_total Database connections set up, or checked out of the pool.',
+                '# TYPE lunasci_db_connections_total counter',
+            ]
+            for alias, count in sorted(self.connections.items()):
+                lines.append(f'lunasci_db_connections_total{_labels(database=alias)} {count}')
+
+        pools = sorted(pool_stats().items())
+        for name, help_text, metric_type, value in (
+            ('lunasci_db_pool_connections', 'Connections open in the pool.', 'gauge',
+             lambda stats: stats.get('pool_size', 0)),
+            ('lunasci_db_pool_connections_in_use', 'Pooled connections checked out by requests.', 'gauge',
+             lambda stats: stats.get('pool_size', 0) - stats.get('pool_available', 0)),
+            ('lunasci_db_pool_requests_waiting', 'Requests waiting for a pooled connection.', 'gauge',
+             lambda stats: stats.get('requests_waiting', 0)),
+            ('lunasci_db_pool_connections_created_total', 'Connections created by the pool.', 'counter',
+             lambda stats: stats.get('connections_num', 0)),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+            for alias, stats in pools:
+                lines.append(f'{name}{_labels(database=alias)} {value(stats)}')
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+def view_name(view_func, method):
+    """
+    Return the name the requests to a view are grouped by: ViewSet.action for DRF viewsets,
+    View.method for other class based views and module.function for function views.
+    """
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is None:
+        module = view_func.__module__.rpartition('.')[2]
+        return f'{module}.{view_func.__name__}'
+    method = method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    if method == 'head' and 'head' not in actions:
+        method = 'get'
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+class _RequestStats:
+    """
+    The metrics of the request being handled, stored on the request.
+    """
+
+    def __init__(self):
+        self.view = UNMATCHED
+        self.render = 0.0
+
+_profiler_lock = threading.Lock()
+
+def _profile_name(view, duration):
+    view = re.sub(r'[^\w.-]', '_', view)
+    return f'{time.strftime("%Y%m%dT%H%M%S")}-{view}-{round(duration * 1000)}ms.prof'
+
+class InstrumentationMiddleware:
+    """
+    Records the duration, SQL queries, render time and response size of every request
+    in the metrics registry, and profiles slow requests when PROFILE_SLOW_REQUESTS is set.
+
+    Meant to be the first middleware, so the time spent in the other ones is included.
+    Render time is the time taken to render the body of responses that are rendered lazily,
+    i.e. DRF and template responses. Serializers mostly run in the views, before rendering,
+    so their time is part of the request duration only.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        request_started.connect(install_query_counting, dispatch_uid='lunasci.instrumentation')
+        connection_created.connect(registry.connection_created, dispatch_uid='lunasci.instrumentation')
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profiler = self._start_profiler()
+        try:
+            start = time.perf_counter()
+            request.instrumentation = stats = _RequestStats()
+            with QueryCounter() as queries:
+                response = self.get_response(request)
+            duration = time.perf_counter() - start
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _profiler_lock.release()
+        self._observe(request, response, stats, queries, duration)
+        if profiler is not None and duration >= settings.PROFILE_SLOW_REQUESTS:
+            self._dump_profile(profiler, request, stats.view, duration)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        request.instrumentation = stats = _RequestStats()
+        with QueryCounter() as queries:
+            response = await self.get_response(request)
+        self._observe(request, response, stats, queries, time.perf_counter() - start)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.instrumentation.view = view_name(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        # the last template response hook, called right before the response is rendered
+        start = time.perf_counter()
+        stats = request.instrumentation
+
+        def rendered(response):
+            stats.render += time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def _observe(self, request, response, stats, queries, duration):
+        size = None if response.streaming else len(response.content)
+        registry.observe(
+            stats.view, request.method, response.status_code, duration,
+            queries.count, queries.duration, stats.render, size,
+        )
+
+    def _start_profiler(self):
+        if settings.PROFILE_SLOW_REQUESTS is None or random.random() >= settings.PROFILE_SAMPLE_RATE:
+            return None
+        # a single request is profiled at a time
+        if not _profiler_lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active
+            _profiler_lock.release()
+            return None
+        return profiler
+
+    def _dump_profile(self, profiler, request, view, duration):
+        directory = Path(settings.PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / _profile_name(view, duration)
+        profiler.dump_stats(path)
+        logger.warning('Slow request %s %s took %.3fs, profile written to %s', request.method,
+                       request.path, duration, path)
+
+@require_safe
+def metrics_view(request):
+    """
+    Serve the request metrics of the current process in the Prometheus text format.
+
+    When METRICS_TOKEN is set, requests must send it as a bearer token.
+    """
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized\n', status=401, content_type='text/plain')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
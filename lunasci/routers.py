@@ -0,0 +1,101 @@
+"""
+This module routes the reads of safe API requests to read replicas.
+
+Replicas are configured with POSTGRES_REPLICA_HOSTS, each becoming a database alias listed in
+REPLICA_DATABASES. Viewsets using ReplicaReadMixin read from a replica picked at random while
+they handle GET, HEAD and OPTIONS requests, everything else reads from and writes to the
+default database, the primary.
+
+Replicas lag behind the primary, so a client that just wrote would not always see its own
+changes. Writes handled by ReplicaReadMixin therefore set a cookie for
+POSTGRES_REPLICA_PIN_SECONDS, and the reads of the clients sending it back stay on the primary.
+Clients that do not keep cookies may read stale data for that long after a write.
+
+Only the hydroponics and auth applications are replicated this way: sessions, for one,
+are always read from the primary. Queries run while a streaming response is consumed run
+after the request was handled, so they read from the primary unless their queryset was
+fixed to its database with using() beforehand.
+
+It contains:
+    - REPLICATED_APPS: The applications whose models are read from replicas.
+    - PIN_COOKIE: The cookie keeping the reads of a client on the primary after it wrote.
+    - read_from_replica: Routes the reads of the current context to a replica.
+    - ReplicaRouter: The database router sending routed reads to their replica.
+    - ReplicaReadMixin: Reads from a replica while a viewset handles safe requests.
+"""
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICATED_APPS = frozenset({'hydroponics', 'auth'})
+
+PIN_COOKIE = 'lunasci_primary'
+
+_replica = ContextVar('replica', default=None)
+
+@contextmanager
+def read_from_replica(alias=None):
+    """
+    Route the reads of the current context to the replica alias, or to a random replica.
+    Does nothing when no replica is configured.
+    """
+    alias = alias or (random.choice(settings.REPLICA_DATABASES) if settings.REPLICA_DATABASES else None)
+    token = _replica.set(alias)
+    try:
+        yield alias
+    finally:
+        _replica.reset(token)
+
+class ReplicaRouter:
+    """
+    Sends the reads of REPLICATED_APPS models to the replica chosen by read_from_replica,
+    and everything else to the default database. Replicas get their schema and data
+    through replication, so nothing is migrated on them.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is None or model._meta.app_label not in REPLICATED_APPS:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
+
+class ReplicaReadMixin:
+    """
+    Reads from a replica while the viewset handles safe requests, unless the client wrote
+    recently, and pins the reads of the clients whose writes succeeded to the primary.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not settings.REPLICA_DATABASES:
+            return super().dispatch(request, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code < 400:
+                response.set_cookie(
+                    PIN_COOKIE, '1', max_age=settings.POSTGRES_REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+                )
+            return response
+        if PIN_COOKIE in request.COOKIES:
+            return super().dispatch(request, *args, **kwargs)
+        with read_from_replica():
+            return super().dispatch(request, *args, **kwargs)
@@ -10,9 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import importlib.util
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,6 +46,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'django_filters',
@@ -52,6 +56,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'lunasci.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -99,8 +104,78 @@ DATABASES = {
         "PASSWORD": os.environ.get("POSTGRES_PASSWORD").strip(),
         "HOST": os.environ.get("POSTGRES_HOST", "localhost").strip(),
         "PORT": os.environ.get("POSTGRES_PORT", "5432").strip(),
+        # Seconds a connection is kept open to be reused by later requests of the same thread,
+        # 0 to close it after every request. Under ASGI requests run in threads of their own,
+        # so use POSTGRES_POOL there instead
+        "CONN_MAX_AGE": int(os.environ.get("POSTGRES_CONN_MAX_AGE", default="60").strip()),
+        # Check that a reused or pooled connection still works before handing it out
+        "CONN_HEALTH_CHECKS": (
+            os.environ.get("POSTGRES_CONN_HEALTH_CHECKS", default="1").strip() not in ("", "0")
+        ),
+    }
+}
+# Share a pool of connections between the threads of every process instead, with psycopg_pool,
+# which requires psycopg 3: pip install -r requirements-pool.txt. Requests wait up to
+# POSTGRES_POOL_TIMEOUT seconds for a connection when POSTGRES_POOL_MAX_SIZE are in use,
+# and idle connections above POSTGRES_POOL_MIN_SIZE are closed after POSTGRES_POOL_MAX_IDLE seconds
+if os.environ.get("POSTGRES_POOL", default="").strip() not in ("", "0"):
+    if not importlib.util.find_spec("psycopg") or not importlib.util.find_spec("psycopg_pool"):
+        raise ImproperlyConfigured(
+            "POSTGRES_POOL requires psycopg 3 and psycopg_pool, which psycopg2 does not provide: "
+            "pip install -r requirements-pool.txt"
+        )
+    # pooled connections go back to the pool at the end of every request
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get("POSTGRES_POOL_MIN_SIZE", default="2").strip()),
+            'max_size': int(os.environ.get("POSTGRES_POOL_MAX_SIZE", default="10").strip()),
+            'timeout': float(os.environ.get("POSTGRES_POOL_TIMEOUT", default="10").strip()),
+            'max_idle': float(os.environ.get("POSTGRES_POOL_MAX_IDLE", default="600").strip()),
+        },
+    }
+# Read replicas of the default database, as space separated host or host:port entries
+# (IPv6 addresses in brackets), serving the reads of safe requests, see lunasci.routers.
+# They use the credentials of the default database and the POSTGRES_REPLICA_DB database,
+# POSTGRES_DB by default, so a copy of the database on the same server can stand in for
+# a replica locally. They mirror the default database in the tests
+REPLICA_DATABASES = []
+replica_hosts = os.environ.get("POSTGRES_REPLICA_HOSTS", default="").split()
+for index, replica in enumerate(replica_hosts, start=1):
+    replica_host, replica_port = replica, DATABASES['default']['PORT']
+    if replica.rpartition(":")[2].isdigit():
+        replica_host, _, replica_port = replica.rpartition(":")
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        "NAME": os.environ.get("POSTGRES_REPLICA_DB", default=DATABASES['default']['NAME']).strip(),
+        "HOST": replica_host.strip("[]"),
+        "PORT": replica_port,
+        "OPTIONS": dict(DATABASES['default'].get('OPTIONS', {})),
+        "TEST": {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica_{index}')
+DATABASE_ROUTERS = ['lunasci.routers.ReplicaRouter']
+# Seconds the reads of a client stay on the default database after it wrote,
+# so it reads its own writes
+POSTGRES_REPLICA_PIN_SECONDS = int(
+    os.environ.get("POSTGRES_REPLICA_PIN_SECONDS", default="5").strip()
+)
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory by default, set REDIS_URL to share the cache between workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
+if os.environ.get("REDIS_URL", "").strip():
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get("REDIS_URL").strip(),
+    }
 
 
 # Password validation
@@ -156,6 +231,117 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Hydroponics app settings
+
+# Number of rows per INSERT statement when ingesting readings in bulk
+HYDROPONICS_BULK_BATCH_SIZE = int(
+    os.environ.get("HYDROPONICS_BULK_BATCH_SIZE", default="500").strip()
+)
+# Maximum number of readings accepted by a single bulk ingest request
+HYDROPONICS_BULK_MAX_ROWS = int(
+    os.environ.get("HYDROPONICS_BULK_MAX_ROWS", default="10000").strip()
+)
+
+# Default and maximum number of latest sensor readings embedded in a hydroponics instance
+HYDROPONICS_READINGS_LIMIT = int(
+    os.environ.get("HYDROPONICS_READINGS_LIMIT", default="10").strip()
+)
+HYDROPONICS_READINGS_LIMIT_MAX = int(
+    os.environ.get("HYDROPONICS_READINGS_LIMIT_MAX", default="100").strip()
+)
+# Largest page size clients may request from cursor paginated lists
+HYDROPONICS_MAX_PAGE_SIZE = int(
+    os.environ.get("HYDROPONICS_MAX_PAGE_SIZE", default="1000").strip()
+)
+# Largest number of buckets returned by the aggregation endpoints
+HYDROPONICS_AGGREGATE_MAX_BUCKETS = int(
+    os.environ.get("HYDROPONICS_AGGREGATE_MAX_BUCKETS", default="5000").strip()
+)
+# Fold newly ingested readings into the hourly and daily rollups right after ingest,
+# instead of only from the periodic rollup_readings command
+HYDROPONICS_ROLLUP_ON_INGEST = bool(
+    os.environ.get("HYDROPONICS_ROLLUP_ON_INGEST", default="").strip()
+)
+# Length of the sensor_reading partitions (day, week or month), the number of upcoming
+# partitions created ahead of time and, optionally, the number of past partitions to keep
+HYDROPONICS_PARTITION_INTERVAL = os.environ.get(
+    "HYDROPONICS_PARTITION_INTERVAL", default="month"
+).strip()
+HYDROPONICS_PARTITION_AHEAD = int(
+    os.environ.get("HYDROPONICS_PARTITION_AHEAD", default="3").strip()
+)
+HYDROPONICS_PARTITION_RETAIN = (
+    int(os.environ["HYDROPONICS_PARTITION_RETAIN"].strip())
+    if os.environ.get("HYDROPONICS_PARTITION_RETAIN", "").strip() else None
+)
+# Cache holding the latest sensor reading of every hydroponics system
+HYDROPONICS_CACHE_ALIAS = os.environ.get("HYDROPONICS_CACHE_ALIAS", default="default").strip()
+# Number of rows fetched from the server-side cursor per round trip when exporting readings
+HYDROPONICS_EXPORT_CHUNK_SIZE = int(
+    os.environ.get("HYDROPONICS_EXPORT_CHUNK_SIZE", default="5000").strip()
+)
+# Fan-out of new readings to live subscribers: "local" within the process, "postgres" across
+# processes with LISTEN/NOTIFY, or empty to disable publishing
+HYDROPONICS_LIVE_BACKEND = os.environ.get("HYDROPONICS_LIVE_BACKEND", default="local").strip()
+# Number of undelivered ingest batches after which a live subscriber is dropped
+HYDROPONICS_LIVE_QUEUE_SIZE = int(
+    os.environ.get("HYDROPONICS_LIVE_QUEUE_SIZE", default="100").strip()
+)
+# Seconds between keep-alive comments sent to idle live subscribers
+HYDROPONICS_LIVE_KEEPALIVE = int(
+    os.environ.get("HYDROPONICS_LIVE_KEEPALIVE", default="15").strip()
+)
+# Seconds an ingest process keeps using its compiled alert rules before reloading them,
+# i.e. how long rules changed through another process may take to apply
+HYDROPONICS_ALERT_RULES_TTL = int(
+    os.environ.get("HYDROPONICS_ALERT_RULES_TTL", default="30").strip()
+)
+# Largest number of readings loaded by the analysis endpoint, the latest ones,
+# enough for a month of readings taken every second by default
+HYDROPONICS_ANALYSIS_MAX_ROWS = int(
+    os.environ.get("HYDROPONICS_ANALYSIS_MAX_ROWS", default="3000000").strip()
+)
+# Default and maximum number of points per metric returned by the series endpoint
+HYDROPONICS_SERIES_POINTS = int(
+    os.environ.get("HYDROPONICS_SERIES_POINTS", default="2000").strip()
+)
+HYDROPONICS_SERIES_MAX_POINTS = int(
+    os.environ.get("HYDROPONICS_SERIES_MAX_POINTS", default="10000").strip()
+)
+# Days raw sensor readings are kept before being compacted into the rollups, for systems
+# without a retention of their own. Readings are kept forever when unset
+HYDROPONICS_RETENTION_DAYS = (
+    int(os.environ["HYDROPONICS_RETENTION_DAYS"].strip())
+    if os.environ.get("HYDROPONICS_RETENTION_DAYS", "").strip() else None
+)
+# What to do when a viewset action runs more queries than its budget: "log" a warning,
+# "raise" an error, as the tests do, or nothing when unset
+HYDROPONICS_QUERY_BUDGETS = os.environ.get("HYDROPONICS_QUERY_BUDGETS", default="").strip()
+# Number of device keys an ingest process keeps in memory once verified, and for how many seconds,
+# i.e. how long a key revoked through another process may keep working
+HYDROPONICS_DEVICE_KEY_CACHE_SIZE = int(
+    os.environ.get("HYDROPONICS_DEVICE_KEY_CACHE_SIZE", default="1024").strip()
+)
+HYDROPONICS_DEVICE_KEY_CACHE_TTL = int(
+    os.environ.get("HYDROPONICS_DEVICE_KEY_CACHE_TTL", default="60").strip()
+)
+
+# Instrumentation settings
+
+# Bearer token required to read the /metrics endpoint, open to everyone when unset
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", default="").strip()
+# Profile requests with cProfile and keep the profiles of those taking at least this many
+# seconds, disabled when unset. Only a PROFILE_SAMPLE_RATE fraction of the requests is profiled,
+# and the profiles are written to PROFILE_DIR
+PROFILE_SLOW_REQUESTS = (
+    float(os.environ["PROFILE_SLOW_REQUESTS"].strip())
+    if os.environ.get("PROFILE_SLOW_REQUESTS", "").strip() else None
+)
+PROFILE_SAMPLE_RATE = float(
+    os.environ.get("PROFILE_SAMPLE_RATE", default="0.1").strip()
+)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", default=str(BASE_DIR / 'profiles')).strip()
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Hydroponics API',
     'DESCRIPTION': 'Assignment for Luna Scientific to create a hydroponics management app with Django REST Framework',
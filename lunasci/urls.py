@@ -23,16 +23,45 @@ from drf_spectacular.views import (
     SpectacularRedocView,
 )
 
-from lunasci.hydroponics import views
+from lunasci import instrumentation
+from lunasci.hydroponics import async_views, views
 
 router = routers.SimpleRouter()
 router.register(r'users', views.UserViewSet)
 router.register(r'hydroponics', views.HydroponicsViewSet)
 router.register(r'sensor_readings', views.SensorReadingViewSet)
+router.register(r'alert_rules', views.AlertRuleViewSet)
+router.register(r'alert_events', views.AlertEventViewSet)
+
+# Asynchronous read-only endpoints, for ASGI deployments
+async_urlpatterns = [
+    path('hydroponics/', async_views.hydroponics_list, name='async-hydroponics-list'),
+    path('hydroponics/<int:pk>/', async_views.hydroponics_detail, name='async-hydroponics-detail'),
+    path('hydroponics/<int:pk>/latest/', async_views.hydroponics_latest, name='async-hydroponics-latest'),
+    path(
+        'hydroponics/<int:pk>/aggregate/',
+        async_views.hydroponics_aggregate,
+        name='async-hydroponics-aggregate',
+    ),
+    path('sensor_readings/', async_views.sensor_reading_list, name='async-sensorreading-list'),
+    path(
+        'sensor_readings/<int:pk>/',
+        async_views.sensor_reading_detail,
+        name='async-sensorreading-detail',
+    ),
+    path(
+        'sensor_readings/aggregate/',
+        async_views.sensor_reading_aggregate,
+        name='async-sensorreading-aggregate',
+    ),
+    path('sensor_readings/live/', async_views.sensor_reading_live, name='async-sensorreading-live'),
+]
 
 urlpatterns = [
     path('', views.APIRoot.as_view()),
     path('', include(router.urls)),
+    path('async/', include(async_urlpatterns)),
+    path('metrics', instrumentation.metrics_view, name='metrics'),
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
     path('api-schema/', SpectacularAPIView.as_view(), name='schema'),
@@ -0,0 +1,141 @@
+"""
+Load test comparing the synchronous (WSGI) and asynchronous (ASGI) deployments of the API.
+
+Opens --concurrency keep-alive connections per target URL and issues GET requests on each
+of them for --duration seconds, then reports the throughput and latency percentiles.
+Only depends on the standard library, so it can run from any machine with Python 3.
+
+Example, with the WSGI and ASGI servers started side by side:
+
+    gunicorn lunasci.wsgi:application --workers 4 --bind :8000
+    uvicorn lunasci.asgi:application --workers 1 --port 8001
+    python scripts/loadtest.py --concurrency 500 --duration 30 \\
+        http://localhost:8000/sensor_readings/ http://localhost:8001/async/sensor_readings/
+"""
+
+import argparse
+import asyncio
+import ssl
+import statistics
+import time
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+@dataclass
+class Result:
+    """
+    Measurements of one target URL.
+
+    Attributes:
+        latencies (list): The latency of every successful request, in seconds.
+        errors (int): The number of failed requests and broken connections.
+        statuses (dict): The number of responses per status code.
+    """
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+    statuses: dict = field(default_factory=dict)
+
+async def read_response(reader):
+    """
+    Read an HTTP/1.1 response, returning its status code and whether the connection stays open.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed by the server')
+    status = int(status_line.split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection', '').lower() != 'close'
+
+async def worker(url, deadline, result, headers):
+    """
+    Issue requests for url over a keep-alive connection until the deadline.
+    """
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    context = ssl.create_default_context() if parts.scheme == 'https' else None
+    target = parts.path + (f'?{parts.query}' if parts.query else '')
+    request = (
+        f'GET {target} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+        + ''.join(f'{header}\r\n' for header in headers)
+        + 'Accept: application/json\r\n\r\n'
+    ).encode()
+
+    writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(parts.hostname, port, ssl=context)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+            result.latencies.append(time.perf_counter() - start)
+            result.statuses[status] = result.statuses.get(status, 0) + 1
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            result.errors += 1
+            keep_alive = False
+        if not keep_alive and writer is not None:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+async def run(url, concurrency, duration, headers):
+    """
+    Load a single URL with concurrency connections for duration seconds.
+    """
+    result = Result()
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(worker(url, deadline, result, headers) for _ in range(concurrency)))
+    return result
+
+def report(url, result, duration):
+    """
+    Print the throughput and latency percentiles of a run.
+    """
+    print(url)
+    latencies = sorted(result.latencies)
+    if len(latencies) < 2:
+        print(f'  no successful requests, {result.errors} errors')
+        return
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f'  requests: {len(latencies)} ({len(latencies) / duration:.1f}/s), errors: {result.errors}')
+    print(f'  statuses: {dict(sorted(result.statuses.items()))}')
+    print(
+        f'  latency ms: p50 {quantiles[49] * 1000:.1f}, p95 {quantiles[94] * 1000:.1f}, '
+        f'p99 {quantiles[98] * 1000:.1f}, max {latencies[-1] * 1000:.1f}'
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('urls', nargs='+', help='URLs to load, one after the other.')
+    parser.add_argument('--concurrency', type=int, default=100, help='Concurrent connections per URL.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to load every URL.')
+    parser.add_argument(
+        '--header',
+        action='append',
+        default=[],
+        help='Extra request header, e.g. "Authorization: Basic ...", may be repeated.',
+    )
+    args = parser.parse_args()
+    for url in args.urls:
+        result = asyncio.run(run(url, args.concurrency, args.duration, args.header))
+        report(url, result, args.duration)
+
+if __name__ == '__main__':
+    main()